@@ -0,0 +1,96 @@
+# benchmarks/bench_database.py
+"""
+Micro-benchmark for the data layer: per-query latency and simulated updates/sec
+for the old connect-per-query pattern vs the shared async connection.
+
+Usage: python benchmarks/bench_database.py [--users 1000] [--queries 5000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import database
+
+
+def seed(n_users: int):
+    with sqlite3.connect(config.DB_FILE) as conn:
+        conn.executemany("INSERT OR IGNORE INTO users (telegram_id, full_name, balance_cents) VALUES (?, ?, ?)",
+                         ((100000 + i, f"User {i}", random.choice((0, 100, 550))) for i in range(n_users)))
+
+
+def report(label: str, latencies: list[float], elapsed: float, updates: int):
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1e6
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1e6
+    print(f"{label:<22} p50={p50:8.1f}us  p99={p99:8.1f}us  updates/sec={updates / elapsed:10.1f}")
+
+
+def bench_connect_per_query(user_ids: list[int]):
+    """Reproduces the previous data layer: a fresh connection for every query, run inline."""
+    latencies = []
+    start = time.perf_counter()
+    for user_id in user_ids:
+        t0 = time.perf_counter()
+        # A typical update touched the users table three times (add, language, debt)
+        with sqlite3.connect(config.DB_FILE) as conn:
+            conn.execute("INSERT OR IGNORE INTO users (telegram_id, full_name) VALUES (?, ?)", (user_id, "x"))
+            conn.commit()
+        with sqlite3.connect(config.DB_FILE) as conn:
+            conn.execute("SELECT language FROM users WHERE telegram_id = ?", (user_id,)).fetchone()
+        with sqlite3.connect(config.DB_FILE) as conn:
+            conn.execute("SELECT balance_cents FROM users WHERE telegram_id = ?", (user_id,)).fetchone()
+        latencies.append((time.perf_counter() - t0) / 3)
+    report("connect-per-query", latencies, time.perf_counter() - start, len(user_ids))
+
+
+async def bench_async_layer(user_ids: list[int], concurrency: int):
+    latencies = []
+
+    async def one_update(user_id: int):
+        t0 = time.perf_counter()
+        await database.add_or_ignore_user(user_id, "x")
+        await database.get_user_language(user_id)
+        await database.get_user_debt(user_id)
+        latencies.append((time.perf_counter() - t0) / 3)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def guarded(user_id: int):
+        async with semaphore:
+            await one_update(user_id)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(guarded(user_id) for user_id in user_ids))
+    report(f"async (concurrency={concurrency})", latencies, time.perf_counter() - start, len(user_ids))
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config.DB_FILE = os.path.join(tmp, "bench.db")
+        await database.init_db()
+        seed(args.users)
+        user_ids = [100000 + random.randrange(args.users) for _ in range(args.queries)]
+
+        bench_connect_per_query(user_ids)
+        await bench_async_layer(user_ids, 1)
+        await bench_async_layer(user_ids, args.concurrency)
+        await database.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
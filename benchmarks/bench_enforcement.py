@@ -0,0 +1,98 @@
+# benchmarks/bench_enforcement.py
+"""
+Times script.SpotifyFamilyEnforcer against the local Spotify fixture:
+cold start + login, a warm run on the live session, a run restored from saved
+cookies, and per-member toggles vs one batched pass. Exits non-zero if the
+fixture state doesn't match what was requested (e.g. a selector stopped matching, or a
+toggle's save was cut off by leaving the page too early).
+
+Usage: python benchmarks/bench_enforcement.py [--members 5] [--delay 0.0] [--save-delay 0.1] [--show-browser]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from script import SpotifyFamilyEnforcer
+from spotify_fixture import FixtureState, start_server
+
+
+def timed(label: str, func, *args, per: int = 1):
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<34} {elapsed * 1000:9.1f} ms" + (f"  ({elapsed * 1000 / per:.1f} ms/member)" if per > 1 else ""))
+    return result
+
+
+def check(state: FixtureState, expected: dict[int, bool]) -> bool:
+    mismatched = {pos: state.explicit_allowed[pos] for pos, allow in expected.items() if state.explicit_allowed[pos] != allow}
+    if mismatched:
+        print(f"FAIL: fixture state differs from requested settings for members {sorted(mismatched)}")
+    return not mismatched
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--members", type=int, default=5)
+    parser.add_argument("--delay", type=float, default=0.0, help="Simulated server latency per page, seconds")
+    parser.add_argument("--save-delay", type=float, default=0.1, help="Fixture debounce before a toggle is saved, seconds")
+    parser.add_argument("--show-browser", action="store_true")
+    args = parser.parse_args()
+
+    state = FixtureState(args.members, args.delay, args.save_delay)
+    server = start_server(state)
+    url = f"http://127.0.0.1:{server.server_port}/account/overview/"
+    positions = list(range(1, args.members + 1))
+    ok = True
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cookies = os.path.join(tmp, "cookies.json")
+
+        def make_enforcer():
+            return SpotifyFamilyEnforcer("bench@example.com", "secret", account_url=url, cookies_file=cookies,
+                                         headless=not args.show_browser)
+
+        enforcer = make_enforcer()
+        try:
+            disable_all = {pos: False for pos in positions}
+            timed("cold start + login, full run", enforcer.set_explicit_content, disable_all, per=len(positions))
+            ok &= check(state, disable_all)
+
+            enable_all = {pos: True for pos in positions}
+            timed("warm session, full run", enforcer.set_explicit_content, enable_all, per=len(positions))
+            ok &= check(state, enable_all)
+
+            timed("warm session, no-op run", enforcer.set_explicit_content, enable_all, per=len(positions))
+
+            start = time.perf_counter()
+            for pos in positions:
+                enforcer.set_explicit_content({pos: False})
+            elapsed = time.perf_counter() - start
+            print(f"{'warm session, one run per member':<34} {elapsed * 1000:9.1f} ms  ({elapsed * 1000 / len(positions):.1f} ms/member)")
+            ok &= check(state, disable_all)
+        finally:
+            enforcer.close()
+
+        logins_before = state.logins
+        restored = make_enforcer()
+        try:
+            timed("cookie-restored start, full run", restored.set_explicit_content, enable_all, per=len(positions))
+            ok &= check(state, enable_all)
+        finally:
+            restored.close()
+        if state.logins != logins_before:
+            print("FAIL: restoring the saved session still went through the login form")
+            ok = False
+
+    server.shutdown()
+    print(f"logins={state.logins} toggles={state.toggles}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
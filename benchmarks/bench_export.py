@@ -0,0 +1,129 @@
+# benchmarks/bench_export.py
+"""
+Benchmark for /export on a large payments table: rows/sec, file size and peak memory of the
+streamed CSV export (plain, gzipped and one month's range), and the latency of ordinary
+queries on the shared connection while an export runs.
+
+Peak memory is the growth of the process's maximum RSS over each run, so the streamed runs go
+first; --baseline adds a final run of the old way (fetchall() into one in-memory CSV) for
+comparison. It needs memory proportional to the table: ~1 GB per million payments.
+
+Usage: python benchmarks/bench_export.py [--payments 3000000] [--users 100000] [--baseline]
+"""
+import argparse
+import asyncio
+import csv
+import io
+import os
+import random
+import resource
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import database
+import exports
+
+HISTORY_DAYS = 3 * 365 # Payments are spread evenly over this many days before today
+
+
+def seed(n_payments: int, n_users: int, n_families: int = 5):
+    now = datetime.now()
+    with sqlite3.connect(config.DB_FILE) as conn:
+        conn.executemany("INSERT INTO families (name, billing_day, price) VALUES (?, ?, ?)",
+                         ((f"Family {i}", 1 + i % 28, 2.5) for i in range(n_families)))
+        conn.executemany("INSERT INTO users (telegram_id, full_name, language, family_id, balance_cents) "
+                         "VALUES (?, ?, 'en', ?, ?)",
+                         ((100000 + i, f"User {i}", 1 + i % n_families, random.choice((0, 250, 500)))
+                          for i in range(n_users)))
+        step = HISTORY_DAYS * 86400 / n_payments
+        conn.executemany("INSERT INTO payments (user_id, image_path, timestamp, sha256, file_unique_id) "
+                         "VALUES (?, ?, ?, ?, ?)",
+                         ((100000 + random.randrange(n_users), "x.jpg",
+                           (now - timedelta(seconds=(n_payments - i) * step)).isoformat(), f"{i:064x}", f"u{i}")
+                          for i in range(n_payments)))
+        conn.execute("ANALYZE")
+
+
+def max_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # KiB on Linux
+
+
+async def probe(user_ids: list[int], latencies: list[float], done: asyncio.Event):
+    """Ordinary profile reads on the shared connection, as handlers make them, until the export ends."""
+    while not done.is_set():
+        t0 = time.perf_counter()
+        await database.get_user_profile(random.choice(user_ids))
+        latencies.append(time.perf_counter() - t0)
+        await asyncio.sleep(0.005)
+
+
+async def bench_streamed(label: str, export, user_ids: list[int]):
+    database.profile_cache.clear() # Every probe read goes to SQLite
+    latencies: list[float] = []
+    done = asyncio.Event()
+    probing = asyncio.create_task(probe(user_ids, latencies, done))
+    rss_before = max_rss_mb()
+    t0 = time.perf_counter()
+    result = await export
+    elapsed = time.perf_counter() - t0
+    done.set()
+    await probing
+    os.remove(result.path)
+    p99 = sorted(latencies)[int(len(latencies) * 0.99) - 1] * 1000 if len(latencies) >= 100 else max(latencies) * 1000
+    print(f"{label:<22}{result.rows:>10,}{elapsed:>8.1f}s{result.rows / elapsed:>11,.0f}{result.size / 2**20:>9.1f}"
+          f"{max_rss_mb() - rss_before:>10.1f}   probe p50 {statistics.median(latencies) * 1000:.2f}ms "
+          f"p99 {p99:.2f}ms ({len(latencies)} reads)")
+
+
+def bench_fetchall():
+    """The old way: one fetchall() and the whole CSV built in memory before sending."""
+    rss_before = max_rss_mb()
+    t0 = time.perf_counter()
+    with sqlite3.connect(config.DB_FILE) as conn:
+        rows = conn.execute(*database._payments_export_query(None, None, None, None)).fetchall()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(exports.PAYMENT_COLUMNS)
+    writer.writerows(rows)
+    data = buffer.getvalue().encode("utf-8-sig")
+    elapsed = time.perf_counter() - t0
+    print(f"{'fetchall (baseline)':<22}{len(rows):>10,}{elapsed:>8.1f}s{len(rows) / elapsed:>11,.0f}"
+          f"{len(data) / 2**20:>9.1f}{max_rss_mb() - rss_before:>10.1f}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--payments", type=int, default=3_000_000)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--baseline", action="store_true", help="also run the fetchall() export (memory-hungry)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config.DB_FILE = os.path.join(tmp, "export.db")
+        await database.init_db()
+        t0 = time.perf_counter()
+        await database._run(seed, args.payments, args.users)
+        print(f"Seeded {args.payments:,} payments, {args.users:,} users in {time.perf_counter() - t0:.1f}s")
+
+        user_ids = [100000 + i for i in range(args.users)]
+        last_month = date.today() - timedelta(days=30)
+        print(f"{'export':<22}{'rows':>10}{'time':>9}{'rows/s':>11}{'MB':>9}{'RSS +MB':>10}")
+        await bench_streamed("payments", exports.export_payments(), user_ids)
+        await bench_streamed("payments gzip", exports.export_payments(compress=True), user_ids)
+        await bench_streamed("payments last 30 days", exports.export_payments(start=last_month), user_ids)
+        await bench_streamed("payments one family", exports.export_payments(family_ids=[1]), user_ids)
+        await bench_streamed("balances", exports.export_balances(), user_ids)
+        await database.close_db()
+        if args.baseline:
+            bench_fetchall()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,65 @@
+# benchmarks/check_api_calls.py
+"""
+Regression check for the number of Bot API calls per interaction. Replays every ordinary
+user interaction (the update kinds below) through the real Dispatcher with the recording
+session from replay_updates.py and fails if any single update caused more than one call,
+e.g. a follow-up message sent only to attach the menu keyboard.
+
+Usage: python benchmarks/check_api_calls.py [--samples 20] [--verbose]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import database
+from bot import create_bot, create_dispatcher
+from ingestion import ReceiptIngestion
+from replay_updates import ReplaySession, UpdateFactory, seed
+
+# Interactions a regular user has with the bot, and the calls each may make
+ORDINARY_KINDS = ("start", "language", "upload", "photo", "stats", "text")
+MAX_CALLS = 1
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=20, help="updates replayed per kind")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    config.TOKEN = config.TOKEN or "123:check"
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        config.DB_FILE = os.path.join(tmp, "calls.db")
+        await database.init_db()
+        await database._run(seed, 100)
+
+        session = ReplaySession()
+        bot = create_bot(session)
+        dp = create_dispatcher(ReceiptIngestion(bot), throttle=False)
+        factory = UpdateFactory(100)
+        for kind in ORDINARY_KINDS:
+            worst = {}
+            for _ in range(args.samples):
+                session.calls.clear()
+                await dp.feed_raw_update(bot, factory.make(kind))
+                if sum(session.calls.values()) > sum(worst.values()):
+                    worst = dict(session.calls)
+            ok = sum(worst.values()) <= MAX_CALLS
+            failures += not ok
+            if args.verbose or not ok:
+                print(f"{kind:<10} max {sum(worst.values())} call(s) per update {worst} {'ok' if ok else 'TOO MANY'}")
+        await bot.session.close()
+        await database.close_db()
+
+    print(f"{len(ORDINARY_KINDS) - failures}/{len(ORDINARY_KINDS)} interactions within {MAX_CALLS} API call(s).")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
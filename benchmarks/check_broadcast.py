@@ -0,0 +1,133 @@
+# benchmarks/check_broadcast.py
+"""
+Behaviour check for broadcast.Broadcaster against a fake Bot API session that answers each
+chat from a script: flood limits (429 with retry_after), users who blocked the bot (403),
+network errors, or success. Checks the outcome counted for every scenario, that a chat which
+keeps hitting the flood limit is given up after max_retries instead of retrying forever, that
+blocked users are flagged in the DB, and that sends never exceed the configured msgs/sec.
+Exits non-zero on a failure.
+
+Usage: python benchmarks/check_broadcast.py [--rate 50] [--messages 300] [--verbose]
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from aiogram.exceptions import TelegramNetworkError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import database
+from bot import create_bot
+from broadcast import Broadcaster
+from replay_updates import ReplaySession
+
+CHAT_BASE = 100000
+
+
+class ScriptedSession(ReplaySession):
+    """Answers sendMessage per chat from a list of outcomes; chats without one (or past its end) succeed."""
+
+    def __init__(self, scripts: dict[int, list[str]]):
+        super().__init__()
+        self.scripts = {chat_id: list(outcomes) for chat_id, outcomes in scripts.items()}
+        self.sent_at: list[float] = []
+
+    async def make_request(self, bot, method, timeout=None):
+        chat_id = getattr(method, "chat_id", None)
+        outcome = self.scripts.get(chat_id, []).pop(0) if self.scripts.get(chat_id) else "ok"
+        if outcome == "retry_after":
+            error = {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                     "parameters": {"retry_after": 1}}
+            return self.check_response(bot, method, 429, self.json_dumps(error)).result
+        if outcome == "forbidden":
+            error = {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}
+            return self.check_response(bot, method, 403, self.json_dumps(error)).result
+        if outcome == "network":
+            raise TelegramNetworkError(method, "Connection reset by peer")
+        self.sent_at.append(time.monotonic())
+        return await super().make_request(bot, method, timeout)
+
+
+async def run(scripts: dict[int, list[str]], chat_ids: list[int], **kwargs):
+    session = ScriptedSession(scripts)
+    bot = create_bot(session)
+
+    async def messages():
+        for chat_id in chat_ids:
+            yield chat_id, "check"
+
+    report = await Broadcaster(bot, **kwargs).run(messages())
+    await bot.session.close()
+    return report, session
+
+
+def is_blocked(chat_id: int) -> bool:
+    with sqlite3.connect(config.DB_FILE) as conn:
+        return bool(conn.execute("SELECT is_blocked FROM users WHERE telegram_id = ?", (chat_id,)).fetchone()[0])
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=50, help="Broadcaster msgs/sec for the ceiling check")
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    config.TOKEN = config.TOKEN or "123:check"
+    results: list[tuple[str, bool, str]] = []
+    fast = {"rate": 1000, "chat_interval": 0, "max_retries": 2}
+    with tempfile.TemporaryDirectory() as tmp:
+        config.DB_FILE = os.path.join(tmp, "broadcast.db")
+        await database.init_db()
+        for i in range(4):
+            await database.add_or_ignore_user(CHAT_BASE + i, f"User {i}")
+
+        chat = CHAT_BASE
+        report, _session = await run({chat: ["retry_after"]}, [chat], **fast)
+        results.append(("retry_after once", report.sent == 1 and report.retries == 1, str(report)))
+
+        try:
+            report, _session = await asyncio.wait_for(run({chat: ["retry_after"] * 100}, [chat], **fast), timeout=15)
+            ok = report.failed == 1 and report.retries == fast["max_retries"]
+            results.append(("retry_after forever", ok, str(report)))
+        except asyncio.TimeoutError:
+            results.append(("retry_after forever", False, "still retrying after 15s"))
+
+        chat = CHAT_BASE + 1
+        report, _session = await run({chat: ["forbidden"]}, [chat], **fast)
+        ok = report.blocked == 1 and report.sent == 0 and is_blocked(chat) and not is_blocked(CHAT_BASE + 2)
+        results.append(("forbidden", ok, f"{report}, is_blocked={is_blocked(chat)}"))
+
+        chat = CHAT_BASE + 2
+        report, _session = await run({chat: ["network", "network"]}, [chat], **fast)
+        results.append(("network, recovers", report.sent == 1 and report.retries == 2, str(report)))
+        report, _session = await run({chat: ["network"] * 100}, [chat], **fast)
+        ok = report.failed == 1 and report.retries == fast["max_retries"]
+        results.append(("network, gives up", ok, str(report)))
+
+        chat_ids = [CHAT_BASE + 1000 + i for i in range(args.messages)]
+        report, session = await run({}, chat_ids, rate=args.rate, concurrency=config.BROADCAST_CONCURRENCY)
+        # The bucket starts full: the first `rate` sends are a burst, the steady rate is measured after it
+        steady = session.sent_at[int(args.rate):]
+        observed = (len(steady) - 1) / (steady[-1] - steady[0]) if len(steady) > 1 else 0.0
+        ok = report.sent == args.messages and observed <= args.rate * 1.05
+        results.append(("msgs/sec ceiling", ok, f"{report}, steady {observed:.1f} msg/s (limit {args.rate:g})"))
+        await database.close_db()
+
+    failures = 0
+    for name, ok, detail in results:
+        failures += not ok
+        if args.verbose or not ok:
+            print(f"{name:<22}{'ok' if ok else 'WRONG':<7}{detail}")
+    print(f"{len(results) - failures}/{len(results)} broadcast scenarios behave as expected.")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
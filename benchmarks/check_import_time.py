@@ -0,0 +1,114 @@
+# benchmarks/check_import_time.py
+"""
+Cold-start check. Imports each module below in a fresh interpreter with `python -X importtime`,
+from an empty working directory (no locales, no database, no receipts), and fails if:
+  - the import raises, i.e. it needed files or services that only exist at runtime,
+  - the import left anything behind in the working directory (I/O on import),
+  - a module pulled in something it must not (e.g. selenium.webdriver, which only the
+    enforcement run needs),
+  - the import time spent in this repo's own modules exceeds the budget.
+Third-party import time (mostly aiogram) is reported but not budgeted: it depends on the
+machine, and the bot can't start without it anyway.
+
+Usage: python benchmarks/check_import_time.py [--runs 3] [--budget-scale 1.0]
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that nothing may import eagerly
+BROWSER = ("selenium.webdriver",)
+BOT_FRAMEWORK = ("aiogram",)
+WEB_SERVER = ("aiohttp.web", "aiogram.webhook.aiohttp_server")
+
+# module: (budget for this repo's own modules in ms, modules it must not import)
+TARGETS = {
+    "config": (15, BROWSER + BOT_FRAMEWORK),
+    "database": (30, BROWSER + BOT_FRAMEWORK),
+    "lease": (30, BROWSER + BOT_FRAMEWORK),
+    "script": (20, BROWSER + BOT_FRAMEWORK),
+    "localization": (20, BROWSER),
+    "scheduler": (60, BROWSER + WEB_SERVER),
+    "bot": (120, BROWSER + WEB_SERVER),
+}
+
+LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def repo_modules() -> set[str]:
+    names = set()
+    for entry in os.listdir(REPO):
+        path = os.path.join(REPO, entry)
+        if entry.endswith(".py"):
+            names.add(entry[:-3])
+        elif os.path.isfile(os.path.join(path, "__init__.py")):
+            names.add(entry)
+    return names
+
+
+def import_profile(module: str) -> tuple[float, float, set[str], list[str]] | str:
+    """Imports a module in a clean process. Returns (total ms, own ms, imported modules, leftovers) or an error."""
+    with tempfile.TemporaryDirectory() as cwd:
+        env = {**os.environ, "PYTHONPATH": REPO, "PYTHONDONTWRITEBYTECODE": "1"}
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=cwd, env=env,
+                                capture_output=True, text=True)
+        leftovers = sorted(os.listdir(cwd))
+    if result.returncode != 0:
+        return result.stderr.strip().splitlines()[-1]
+
+    own_packages = repo_modules()
+    total = own = 0.0
+    imported = set()
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = int(match[1]), int(match[2]), match[3], match[4]
+        imported.add(name)
+        if name.split(".")[0] in own_packages:
+            own += self_us / 1000
+        if name == module and len(indent) == 1:
+            total = cumulative_us / 1000
+    return total, own, imported, leftovers
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3, help="imports per module; the median is reported")
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="multiplier for slow machines")
+    args = parser.parse_args()
+
+    failures = 0
+    print(f"{'module':<14}{'total ms':>10}{'own ms':>9}{'budget':>8}  result")
+    for module, (budget, forbidden) in TARGETS.items():
+        runs = [import_profile(module) for _ in range(args.runs)]
+        errors = [run for run in runs if isinstance(run, str)]
+        if errors:
+            failures += 1
+            print(f"{module:<14}{'':>27}  FAIL: import raised: {errors[0]}")
+            continue
+        total = statistics.median(run[0] for run in runs)
+        own = statistics.median(run[1] for run in runs)
+        limit = budget * args.budget_scale
+        problems = []
+        if own > limit:
+            problems.append("over budget")
+        pulled = sorted({name for name in runs[0][2] for prefix in forbidden
+                         if name == prefix or name.startswith(prefix + ".")})
+        if pulled:
+            problems.append(f"imports {', '.join(pulled[:3])}{' ...' if len(pulled) > 3 else ''}")
+        if runs[0][3]:
+            problems.append(f"created {', '.join(runs[0][3])}")
+        failures += bool(problems)
+        print(f"{module:<14}{total:>10.1f}{own:>9.1f}{limit:>8.0f}  {'FAIL: ' + '; '.join(problems) if problems else 'ok'}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
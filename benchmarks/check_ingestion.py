@@ -0,0 +1,139 @@
+# benchmarks/check_ingestion.py
+"""
+Crash-recovery check for the receipt ingestion pipeline. A worker process claims a batch of
+receipt jobs and is killed with SIGKILL while they're 'processing'; a new pipeline starts on
+the same database straight away, well inside INGESTION_STALE_AFTER, as a supervisor restarting
+a crashed bot would. Every orphaned job must still be processed once its claim goes stale.
+A job that is merely slow (processing for half the stale timeout) must not be retried.
+Exits non-zero on a failure.
+
+The stale timeout and sweep interval are scaled down (--stale, --sweep) so the check runs in
+seconds; the code path is the one production runs with the config.py values.
+
+Usage: python benchmarks/check_ingestion.py [--jobs 3] [--stale 3] [--sweep 1]
+"""
+import argparse
+import asyncio
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import database
+import receipts
+from bot import create_bot
+from ingestion import ReceiptIngestion
+from replay_updates import ReplaySession
+
+USER_ID = 100001
+
+
+async def hang(bot, file_id: str, file_unique_id: str):
+    await asyncio.Event().wait() # Killed before the download ever finishes
+
+
+def fake_store(delay: float):
+    async def store(bot, file_id: str, file_unique_id: str) -> receipts.StoredReceipt:
+        await asyncio.sleep(delay)
+        sha256 = file_unique_id.encode().hex().ljust(64, "0")[:64]
+        return receipts.StoredReceipt(sha256, receipts.receipt_path(sha256), None)
+    return store
+
+
+async def crashing_worker(db_file: str):
+    """Claims whatever is pending and hangs on it until the parent kills the process."""
+    config.DB_FILE = db_file
+    await database.init_db()
+    receipts.store_receipt = hang
+    ingestion = ReceiptIngestion(create_bot(ReplaySession()))
+    await ingestion.start()
+    await asyncio.Event().wait()
+
+
+def statuses(db_file: str) -> dict[int, tuple[str, int]]:
+    with sqlite3.connect(db_file) as conn:
+        return {row[0]: (row[1], row[2]) for row in conn.execute("SELECT id, status, attempts FROM receipt_jobs")}
+
+
+async def wait_done(db_file: str, job_ids: list[int], timeout: float) -> float | None:
+    """Polls until every job is done; returns the seconds it took, or None on timeout."""
+    t0 = time.monotonic()
+    while time.monotonic() - t0 < timeout:
+        current = statuses(db_file)
+        if all(current[job_id][0] == "done" for job_id in job_ids):
+            return time.monotonic() - t0
+        await asyncio.sleep(0.05)
+    return None
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=3)
+    parser.add_argument("--stale", type=float, default=3, help="INGESTION_STALE_AFTER for the check, seconds")
+    parser.add_argument("--sweep", type=float, default=1, help="INGESTION_STALE_SWEEP_INTERVAL for the check, seconds")
+    parser.add_argument("--worker", metavar="DB_FILE", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    config.TOKEN = config.TOKEN or "123:check"
+    if args.worker:
+        await crashing_worker(args.worker)
+        return
+
+    config.INGESTION_STALE_AFTER = args.stale
+    config.INGESTION_STALE_SWEEP_INTERVAL = args.sweep
+    config.INGESTION_POLL_INTERVAL = 0.2
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        config.DB_FILE = os.path.join(tmp, "ingestion.db")
+        config.RECEIPTS_DIR = os.path.join(tmp, "receipts")
+        await database.init_db()
+        await database.add_or_ignore_user(USER_ID, "Check")
+        orphans = [await database.enqueue_receipt_job(USER_ID, USER_ID, "Check", "en", f"f{i}", f"crash{i}")
+                   for i in range(args.jobs)]
+
+        worker = subprocess.Popen([sys.executable, __file__, "--worker", config.DB_FILE])
+        deadline = time.monotonic() + 10
+        while any(statuses(config.DB_FILE)[job_id][0] != "processing" for job_id in orphans):
+            if time.monotonic() > deadline:
+                worker.kill()
+                sys.exit("Worker process never claimed the jobs.")
+            await asyncio.sleep(0.05)
+        worker.send_signal(signal.SIGKILL)
+        worker.wait()
+        print(f"Killed worker {worker.pid} with {len(orphans)} jobs processing; restarting at once.")
+
+        receipts.store_receipt = fake_store(0)
+        bot = create_bot(ReplaySession())
+        ingestion = ReceiptIngestion(bot)
+        await ingestion.start()
+        limit = args.stale + args.sweep + 2 # Stale timeout, one sweep, and slack for polling
+        recovered = await wait_done(config.DB_FILE, orphans, limit)
+        ok = recovered is not None
+        failures += not ok
+        print(f"orphaned jobs      {'processed after %.1fs' % recovered if ok else 'still stuck after %.0fs' % limit} "
+              f"(limit {limit:.0f}s) {'ok' if ok else 'WRONG'}")
+
+        receipts.store_receipt = fake_store(args.stale / 2)
+        await ingestion.submit(USER_ID, USER_ID, "Check", "en", "slow", "slow")
+        slow_id = max(statuses(config.DB_FILE))
+        done = await wait_done(config.DB_FILE, [slow_id], args.stale * 2 + args.sweep)
+        attempts = statuses(config.DB_FILE)[slow_id][1]
+        ok = done is not None and attempts == 1
+        failures += not ok
+        print(f"slow live job      {attempts} attempt(s) {'ok' if ok else 'WRONG'}")
+
+        await ingestion.stop()
+        await bot.session.close()
+        await database.close_db()
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,148 @@
+# benchmarks/check_lease_failover.py
+"""
+Failover check for the scheduler lease on one machine. Starts several worker processes
+sharing one database; each contends for the lease and, while leader, writes heartbeat rows.
+The current leader is repeatedly killed with SIGKILL (no chance to release the lease) and
+the script measures how long it takes another process to take over. At the end it checks
+that no two processes were ever leader at the same time. Exits non-zero on a failure.
+
+Usage: python benchmarks/check_lease_failover.py [--workers 3] [--kills 3] [--ttl 3] [--interval 1]
+"""
+import argparse
+import asyncio
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import database
+from lease import LeaderLease
+
+LEASE_NAME = "failover-check"
+
+
+async def worker(db_file: str, ttl: float, interval: float):
+    config.DB_FILE = db_file
+    await database.init_db()
+    beats = sqlite3.connect(db_file, timeout=5)
+
+    async def lead():
+        while True:
+            with beats:
+                beats.execute("INSERT INTO beats (pid, at) VALUES (?, ?)", (os.getpid(), time.time()))
+            await asyncio.sleep(0.1)
+
+    await LeaderLease(LEASE_NAME, ttl=ttl, renew_interval=interval).run(lead)
+
+
+def current_leader(conn: sqlite3.Connection) -> int | None:
+    row = conn.execute("SELECT holder FROM leases WHERE name = ? AND expires_at > ?", (LEASE_NAME, time.time())).fetchone()
+    return int(row[0].split(":")[1]) if row else None
+
+
+def wait_for_leader(conn: sqlite3.Connection, exclude: int | None, timeout: float) -> tuple[int, float] | None:
+    """Polls heartbeats until a process other than `exclude` is leading; returns (pid, first beat time)."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        row = conn.execute("SELECT pid, MIN(at) FROM beats WHERE pid != ? GROUP BY pid ORDER BY MIN(at) DESC LIMIT 1",
+                           (exclude or 0,)).fetchone()
+        if row and current_leader(conn) == row[0]:
+            return row
+        time.sleep(0.05)
+    return None
+
+
+def overlaps(conn: sqlite3.Connection) -> list[tuple[int, int]]:
+    spans = conn.execute("SELECT pid, MIN(at), MAX(at) FROM beats GROUP BY pid ORDER BY MIN(at)").fetchall()
+    return [(a[0], b[0]) for a, b in zip(spans, spans[1:]) if b[1] < a[2]]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--kills", type=int, default=3)
+    parser.add_argument("--ttl", type=float, default=3)
+    parser.add_argument("--interval", type=float, default=1)
+    parser.add_argument("--worker", metavar="DB_FILE", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        try:
+            asyncio.run(worker(args.worker, args.ttl, args.interval))
+        except KeyboardInterrupt: # Graceful stop: the lease was released on the way out
+            pass
+        return
+
+    bound = args.ttl + args.interval # Expiry of the dead holder's lease plus one takeover attempt
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "lease.db")
+        config.DB_FILE = db_file
+        asyncio.run(database.init_db())
+        asyncio.run(database.close_db())
+        conn = sqlite3.connect(db_file, timeout=5)
+        conn.execute("CREATE TABLE beats (pid INTEGER, at REAL)")
+        conn.commit()
+
+        command = [sys.executable, os.path.abspath(__file__), "--worker", db_file,
+                   "--ttl", str(args.ttl), "--interval", str(args.interval)]
+        procs = {}
+        for _ in range(args.workers):
+            proc = subprocess.Popen(command)
+            procs[proc.pid] = proc
+
+        failures = 0
+        leader = wait_for_leader(conn, None, timeout=bound + 10)
+        if leader is None:
+            print("No process became leader.")
+            failures += 1
+        for round_no in range(1, args.kills + 1):
+            if leader is None:
+                break
+            pid = leader[0]
+            killed_at = time.time()
+            procs.pop(pid).send_signal(signal.SIGKILL)
+            # Keep the pool size constant so there is always someone to take over
+            proc = subprocess.Popen(command)
+            procs[proc.pid] = proc
+            leader = wait_for_leader(conn, pid, timeout=bound * 3)
+            if leader is None:
+                print(f"Round {round_no}: nobody took over after killing {pid}.")
+                failures += 1
+                break
+            takeover = leader[1] - killed_at
+            ok = takeover <= bound + 0.5
+            failures += not ok
+            print(f"Round {round_no}: killed leader {pid}, {leader[0]} took over in {takeover:.2f}s "
+                  f"(bound {bound:.1f}s) {'ok' if ok else 'TOO SLOW'}")
+
+        # A clean shutdown releases the lease, so the handover is immediate
+        if leader is not None:
+            pid = leader[0]
+            stopped_at = time.time()
+            procs.pop(pid).send_signal(signal.SIGINT)
+            leader = wait_for_leader(conn, pid, timeout=bound * 3)
+            if leader is not None:
+                print(f"Graceful stop of {pid}: {leader[0]} took over in {leader[1] - stopped_at:.2f}s")
+
+        for proc in procs.values():
+            proc.kill()
+            proc.wait()
+
+        overlapping = overlaps(conn)
+        if overlapping:
+            print(f"Overlapping leaders: {overlapping}")
+            failures += 1
+        else:
+            print("No overlapping leaders.")
+        conn.close()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
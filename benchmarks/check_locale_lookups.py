@@ -0,0 +1,98 @@
+# benchmarks/check_locale_lookups.py
+"""
+Regression check for locale resolution. Replays every update kind through the real
+Dispatcher (recording session from replay_updates.py) and counts, per update, the sender's
+locale lookups (database.get_user_language) and profile reads from SQLite
+(database._get_user_profile). The profile cache is cleared before each update, so every
+lookup that isn't shared shows up. Fails if an update resolves the locale more than once, or
+reads the sender's profile from the database more than once: the locale is resolved by
+DatabaseI18nMiddleware, and _() inside handlers must not look it up again.
+
+Usage: python benchmarks/check_locale_lookups.py [--samples 20] [--verbose]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import database
+from bot import create_bot, create_dispatcher
+from ingestion import ReceiptIngestion
+from replay_updates import ReplaySession, UpdateFactory, seed
+from user_cache import profile_cache
+
+KINDS = ("start", "language", "upload", "photo", "stats", "text", "admin_stats", "admin_payments", "stats_page")
+MAX_LOOKUPS = 1
+
+
+def count_calls(name: str, counter: Counter):
+    """Wraps database.<name> so every call counts against the user id it was made for."""
+    original = getattr(database, name)
+    if asyncio.iscoroutinefunction(original):
+        async def wrapper(user_id, *args, **kwargs):
+            counter[user_id] += 1
+            return await original(user_id, *args, **kwargs)
+    else:
+        def wrapper(user_id, *args, **kwargs):
+            counter[user_id] += 1
+            return original(user_id, *args, **kwargs)
+    wrapper.__name__ = original.__name__ # _run() labels DB metrics by it
+    setattr(database, name, wrapper)
+
+
+def sender_id(update: dict) -> int:
+    return (update.get("message") or update["callback_query"])["from"]["id"]
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=20, help="updates replayed per kind")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    config.TOKEN = config.TOKEN or "123:check"
+    lookups: Counter[int] = Counter()
+    reads: Counter[int] = Counter()
+    count_calls("get_user_language", lookups)
+    count_calls("_get_user_profile", reads)
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        config.DB_FILE = os.path.join(tmp, "locale.db")
+        await database.init_db()
+        await database._run(seed, 100)
+
+        session = ReplaySession()
+        bot = create_bot(session)
+        dp = create_dispatcher(ReceiptIngestion(bot), throttle=False)
+        factory = UpdateFactory(100)
+        for kind in KINDS:
+            worst_lookups = worst_reads = 0
+            for _ in range(args.samples):
+                update = factory.make(kind)
+                user_id = sender_id(update)
+                profile_cache.clear()
+                lookups.clear()
+                reads.clear()
+                await dp.feed_raw_update(bot, update)
+                worst_lookups = max(worst_lookups, lookups[user_id])
+                worst_reads = max(worst_reads, reads[user_id])
+            ok = worst_lookups == 1 and worst_reads <= MAX_LOOKUPS
+            failures += not ok
+            if args.verbose or not ok:
+                print(f"{kind:<16} max {worst_lookups} locale lookup(s), {worst_reads} profile read(s) per update "
+                      f"{'ok' if ok else 'WRONG'}")
+        await bot.session.close()
+        await database.close_db()
+
+    print(f"{len(KINDS) - failures}/{len(KINDS)} update kinds resolve the locale exactly once.")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,218 @@
+# benchmarks/check_query_plans.py
+"""
+Query-plan regression check for the data layer. Seeds a large database, calls every
+public function in database.py, captures the SQL each one runs (sqlite3 trace callback)
+and runs EXPLAIN QUERY PLAN on it. Exits non-zero if any statement falls back to a full
+table scan that isn't explicitly allowed below, or if a public function isn't exercised.
+
+Usage: python benchmarks/check_query_plans.py [--users 50000] [--verbose]
+"""
+import argparse
+import asyncio
+import inspect
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import database
+
+# Full scans that are intended, keyed by the database function that runs them
+ALLOWED_SCANS = {
+    "check_ledger_consistency": {"u", "ledger"}, # Audits every balance by design
+    "get_families": {"f"}, # A handful of rows
+    "get_scheduled_jobs": {"j"}, # A few jobs per family
+    "get_recent_payments": {"p"}, # Walks the rowid backwards and stops at LIMIT
+    "prune_profile_changes": {"profile_changes"}, # Hourly, over at most an hour of entries
+}
+
+# Public functions that run no query of their own
+NOT_QUERIES = {
+    "init_db", "close_db", # Schema and migrations
+    "sync_profile_cache", # Polling loop over get_profile_changes
+}
+
+FULL_SCAN = re.compile(r"^SCAN (\w+)$") # "SCAN t USING [COVERING] INDEX ..." is an index scan
+DML = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+
+def seed(n_users: int, n_families: int = 5):
+    now = datetime.now()
+    with sqlite3.connect(config.DB_FILE) as conn:
+        conn.executemany("INSERT INTO families (name, billing_day, price) VALUES (?, ?, ?)",
+                         ((f"Family {i}", 1 + i % 28, 2.5) for i in range(n_families)))
+        family_ids = [row[0] for row in conn.execute("SELECT id FROM families")]
+        conn.executemany("INSERT INTO users (telegram_id, full_name, language, family_id) VALUES (?, ?, ?, ?)",
+                         ((100000 + i, f"User {i}", random.choice(("en", "ru")), random.choice(family_ids))
+                          for i in range(n_users)))
+        conn.executemany("INSERT INTO ledger (user_id, kind, amount_cents, period, created_at) VALUES (?, ?, ?, ?, ?)",
+                         ((100000 + i, "charge", 250, "2026-01", now.isoformat()) for i in range(n_users)))
+        conn.executemany("INSERT INTO payments (user_id, image_path, timestamp, sha256, file_unique_id) "
+                         "VALUES (?, ?, ?, ?, ?)",
+                         ((100000 + random.randrange(n_users), "x.jpg", (now - timedelta(minutes=i)).isoformat(),
+                           f"{i:064x}", f"u{i}") for i in range(n_users)))
+        conn.executemany("INSERT INTO receipt_jobs (user_id, chat_id, file_id, file_unique_id, status, created_at, "
+                         "available_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         ((100000 + i, 100000 + i, f"f{i}", f"j{i}", random.choice(("done", "done", "failed")),
+                           now.isoformat(), now.isoformat(), now.isoformat()) for i in range(n_users)))
+        conn.executemany("INSERT INTO family_admins (family_id, telegram_id) VALUES (?, ?)",
+                         ((family_id, 100000 + family_id) for family_id in family_ids))
+        conn.execute("ANALYZE")
+
+
+async def exercise(calls: dict):
+    """Calls every database function once, recording the statements each one ran."""
+    user_id, family_id = 100007, 1
+    now = datetime.now()
+
+    async def record(name: str, coro):
+        statements = []
+        await database._run(lambda: database._get_conn().set_trace_callback(statements.append))
+        result = coro if not asyncio.iscoroutine(coro) else await coro
+        if hasattr(result, "__anext__"):
+            async for _item in result:
+                pass
+        await database._run(lambda: database._get_conn().set_trace_callback(None))
+        calls[name] = list(dict.fromkeys(statements)) # Trigger firings repeat the statement
+
+    database.profile_cache.clear()
+    await record("add_or_ignore_user", database.add_or_ignore_user(999999, "New", family_id))
+    await record("get_user_profile", database.get_user_profile(user_id))
+    await record("set_user_language", database.set_user_language(user_id, "ru"))
+    await record("update_user_debt", database.update_user_debt(user_id, 4.0))
+    database.profile_cache.clear()
+    await record("get_user_language", database.get_user_language(user_id + 2))
+    await record("get_user_debt", database.get_user_debt(user_id + 3))
+    await record("bulk_update_debts", database.bulk_update_debts([(user_id + i, 500) for i in range(5)], note="check"))
+    await record("get_users_page", database.get_users_page(after_id=100500, limit=31))
+    await record("get_users_page (filtered)", database.get_users_page(after_id=100500, limit=31, debtors_only=True,
+                                                                      language="en", family_ids=[family_id]))
+    await record("get_users_page (backwards)", database.get_users_page(before_id=100500, limit=31,
+                                                                       family_ids=[family_id, 2]))
+    await record("iter_debtors", database.iter_debtors(family_id, batch_size=1000))
+    await record("mark_user_blocked", database.mark_user_blocked(user_id + 1))
+    await record("set_spotify_member", database.set_spotify_member(user_id, 1))
+    await record("plan_enforcement", database.plan_enforcement(family_id))
+    await record("plan_enforcement (restore)", database.plan_enforcement(family_id, restore_only=True))
+    actions = await database.get_pending_enforcement_actions(family_id)
+    await record("get_pending_enforcement_actions", database.get_pending_enforcement_actions(family_id))
+    await record("fail_enforcement_actions", database.fail_enforcement_actions([a[0] for a in actions], "err"))
+    await record("complete_enforcement_actions", database.complete_enforcement_actions(actions))
+    await record("get_enforcement_overview", database.get_enforcement_overview(family_id))
+    await record("add_payment_record", database.add_payment_record(user_id, "y.jpg", "ab" * 32, "new-unique"))
+    await record("find_payment_by_file_unique_id", database.find_payment_by_file_unique_id("u10"))
+    await record("find_payment_by_sha256", database.find_payment_by_sha256(f"{10:064x}"))
+    await record("get_recent_payments", database.get_recent_payments())
+    await record("get_payment", database.get_payment(1))
+    await record("get_unarchived_receipts", database.get_unarchived_receipts(now - timedelta(days=90), 500))
+    await record("add_archived_receipts", database.add_archived_receipts([(f"{10:064x}", "2026-01", 0, 100, 120)]))
+    await record("get_archived_receipt", database.get_archived_receipt(f"{10:064x}"))
+    await record("drop_archive_bundles", database.drop_archive_bundles("2025-01"))
+    await record("get_recent_payments (scoped)", database.get_recent_payments(family_ids=[family_id]))
+    await record("accrue_monthly_charges", database.accrue_monthly_charges(family_id))
+    await record("get_ledger_entries", database.get_ledger_entries(user_id))
+    await record("check_ledger_consistency", database.check_ledger_consistency())
+    job_id = await database.enqueue_receipt_job(user_id, user_id, "x", "en", "file", "unique")
+    await record("enqueue_receipt_job", database.enqueue_receipt_job(user_id, user_id, "x", "en", "file", "unique2"))
+    await record("claim_receipt_job", database.claim_receipt_job(job_id))
+    await record("finish_receipt_job", database.finish_receipt_job(job_id, "pending", "err", now))
+    await record("get_due_receipt_job_ids", database.get_due_receipt_job_ids(100))
+    await record("requeue_stale_receipt_jobs", database.requeue_stale_receipt_jobs(now))
+    await record("count_pending_receipt_jobs", database.count_pending_receipt_jobs())
+    await record("get_profile_changes", database.get_profile_changes(0))
+    await record("prune_profile_changes", database.prune_profile_changes())
+    await record("add_scheduled_job", database.add_scheduled_job("check:1", "notify_debtors", family_id, now))
+    await record("get_scheduled_jobs", database.get_scheduled_jobs())
+    await record("record_job_run", database.record_job_run("check:1", now, "ok", None, now))
+    await record("delete_scheduled_job", database.delete_scheduled_job("check:1"))
+    await record("acquire_lease", database.acquire_lease("scheduler", "check", 30))
+    await record("get_lease", database.get_lease("scheduler"))
+    await record("release_lease", database.release_lease("scheduler", "check"))
+    await record("add_family", database.add_family("New", 15, 1.0))
+    await record("get_families", database.get_families())
+    await record("set_user_family", database.set_user_family(user_id, 2))
+    await record("add_family_admin", database.add_family_admin(family_id, user_id))
+    await record("get_admin_family_ids", database.get_admin_family_ids(user_id))
+    await record("get_family_admin_ids", database.get_family_admin_ids(family_id))
+
+
+def export_statement(query: str, params: tuple) -> str:
+    """The SQL an export runs, with its parameters inlined. Exports use their own connection, so
+    they're expanded here rather than traced in exercise()."""
+    statements = []
+    with sqlite3.connect(config.DB_FILE) as conn:
+        conn.set_trace_callback(statements.append)
+        conn.execute(query, params).close()
+    return statements[0]
+
+
+def exercise_exports(calls: dict):
+    start, end = datetime.now() - timedelta(days=30), datetime.now()
+    calls["iter_payments_export"] = [export_statement(*database._payments_export_query(None, None, None, None))]
+    calls["iter_payments_export (range)"] = [export_statement(*database._payments_export_query(start, end, None, None))]
+    calls["iter_payments_export (user)"] = [export_statement(*database._payments_export_query(start, end, 100007, None))]
+    calls["iter_payments_export (scoped)"] = [export_statement(*database._payments_export_query(start, end, None, [1, 2]))]
+    calls["iter_balances_export"] = [export_statement(*database._balances_export_query(None, None))]
+    calls["iter_balances_export (user)"] = [export_statement(*database._balances_export_query(100007, None))]
+    calls["iter_balances_export (scoped)"] = [export_statement(*database._balances_export_query(None, [1, 2]))]
+
+
+def unexercised(calls: dict) -> list[str]:
+    """Public functions of database.py that no call in calls covers."""
+    public = {name for name, function in inspect.getmembers(database, inspect.isfunction)
+              if not name.startswith("_") and function.__module__ == database.__name__}
+    return sorted(public - NOT_QUERIES - {name.split(" (")[0] for name in calls})
+
+
+def plan(conn: sqlite3.Connection, sql: str) -> list[str]:
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config.DB_FILE = os.path.join(tmp, "plans.db")
+        await database.init_db()
+        await database.close_db()
+        seed(args.users)
+        calls: dict[str, list[str]] = {}
+        await exercise(calls)
+        await database.close_db()
+        exercise_exports(calls)
+
+        failures = 0
+        with sqlite3.connect(config.DB_FILE) as conn:
+            for name, statements in calls.items():
+                function = name.split(" (")[0]
+                for sql in statements:
+                    if not sql.lstrip().upper().startswith(DML): # Skips BEGIN/COMMIT and trigger markers
+                        continue
+                    steps = plan(conn, sql)
+                    scans = {m.group(1) for step in steps if (m := FULL_SCAN.match(step))}
+                    bad = scans - ALLOWED_SCANS.get(function, set())
+                    if bad or args.verbose:
+                        status = "FULL SCAN" if bad else "ok"
+                        print(f"[{status}] {name}: {' '.join(sql.split())[:150]}")
+                        for step in steps:
+                            print(f"    {step}")
+                    failures += bool(bad)
+        missing = unexercised(calls)
+        if missing:
+            print(f"Not exercised: {', '.join(missing)}")
+        print(f"Checked {sum(len(s) for s in calls.values())} statements from {len(calls)} calls: "
+              f"{failures} unexpected full scans, {len(missing)} public functions not exercised.")
+        sys.exit(1 if failures or missing else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
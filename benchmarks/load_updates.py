@@ -0,0 +1,152 @@
+# benchmarks/load_updates.py
+"""
+Load generator comparing polling and webhook delivery. It runs a fake Bot API server that
+the bot is pointed at (TELEGRAM_API_SERVER), injects synthetic "Stats" messages at a fixed
+rate and measures, per update, the time until the bot's reply reaches the fake API.
+
+Each update comes from a new chat, so per-chat limits don't skew the numbers.
+
+Webhook mode:
+    python benchmarks/load_updates.py --mode webhook --updates 2000 --rate 200
+    TELEGRAM_BOT_TOKEN=123:bench TELEGRAM_API_SERVER=http://127.0.0.1:8081 BOT_MODE=webhook \
+        WEBHOOK_URL=http://127.0.0.1:8080 WEBHOOK_SECRET=bench python bot.py
+
+Polling mode: same, with --mode polling and BOT_MODE=polling.
+Start the generator first; it begins injecting once the bot has connected.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from aiohttp import ClientSession, web
+
+CHAT_ID_BASE = 900_000_000
+
+
+class FakeBotAPI:
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.ready = asyncio.Event() # Set once the bot is connected (webhook registered / first getUpdates)
+        self.updates: asyncio.Queue[dict] = asyncio.Queue()
+        self.sent_at: dict[int, float] = {} # chat_id -> injection time
+        self.latencies: list[float] = []
+        self.done = asyncio.Event()
+        self.expected = 0
+        self.message_id = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        data = dict(await request.post()) if request.can_read_body else {}
+        if method == "getme":
+            return web.json_response({"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Bench",
+                                                             "username": "bench_bot"}})
+        if method == "setwebhook":
+            self.ready.set()
+        if method == "getupdates":
+            self.ready.set()
+            return web.json_response({"ok": True, "result": await self._next_updates(float(data.get("timeout", 0)))})
+        if method == "sendmessage":
+            chat_id = int(data["chat_id"])
+            injected_at = self.sent_at.pop(chat_id, None)
+            if injected_at is not None:
+                self.latencies.append(time.perf_counter() - injected_at)
+                if len(self.latencies) >= self.expected:
+                    self.done.set()
+            self.message_id += 1
+            return web.json_response({"ok": True, "result": {"message_id": self.message_id, "date": int(time.time()),
+                                                             "chat": {"id": chat_id, "type": "private"},
+                                                             "text": data.get("text", "")}})
+        return web.json_response({"ok": True, "result": True})
+
+    async def _next_updates(self, timeout: float) -> list[dict]:
+        try:
+            batch = [await asyncio.wait_for(self.updates.get(), timeout=max(timeout, 0.01))]
+        except asyncio.TimeoutError:
+            return []
+        while not self.updates.empty() and len(batch) < 100:
+            batch.append(self.updates.get_nowait())
+        return batch
+
+
+def make_update(i: int) -> dict:
+    chat_id = CHAT_ID_BASE + i
+    sender = {"id": chat_id, "is_bot": False, "first_name": f"Load {i}"}
+    return {"update_id": i + 1, "message": {"message_id": i + 1, "date": int(time.time()), "text": "Stats",
+                                            "chat": {"id": chat_id, "type": "private"}, "from": sender}}
+
+
+async def inject(api: FakeBotAPI, args):
+    interval = 1 / args.rate
+    http_latencies: list[float] = []
+    async with ClientSession() as session:
+        async def post(update: dict):
+            t0 = time.perf_counter()
+            async with session.post(args.webhook_url, json=update,
+                                    headers={"X-Telegram-Bot-Api-Secret-Token": args.secret}) as response:
+                await response.read()
+                if response.status != 200:
+                    print(f"webhook answered {response.status}")
+            http_latencies.append(time.perf_counter() - t0)
+
+        posts = []
+        start = time.perf_counter()
+        for i in range(args.updates):
+            # Open loop: updates arrive on schedule whether or not the bot keeps up
+            await asyncio.sleep(max(0.0, start + i * interval - time.perf_counter()))
+            update = make_update(i)
+            api.sent_at[CHAT_ID_BASE + i] = time.perf_counter()
+            if api.mode == "webhook":
+                posts.append(asyncio.create_task(post(update)))
+            else:
+                api.updates.put_nowait(update)
+        await asyncio.gather(*posts)
+    return start, http_latencies
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=("polling", "webhook"), required=True)
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=100, help="injected updates per second")
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--webhook-url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default="bench")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    api = FakeBotAPI(args.mode)
+    api.expected = args.updates
+    app = web.Application()
+    app.router.add_route("*", "/bot{token}/{method}", api.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.api_port).start()
+    print(f"Fake Bot API on http://127.0.0.1:{args.api_port}, waiting for the bot ({args.mode})...")
+
+    await api.ready.wait()
+    await asyncio.sleep(1) # Let the bot finish starting up
+    start, http_latencies = await inject(api, args)
+    try:
+        await asyncio.wait_for(api.done.wait(), timeout=args.timeout)
+    except asyncio.TimeoutError:
+        print(f"Timed out: {len(api.latencies)}/{args.updates} replies received.")
+    elapsed = time.perf_counter() - start
+    await runner.cleanup()
+
+    if api.latencies:
+        print(f"{args.mode}: {len(api.latencies)} replies in {elapsed:.1f}s = {len(api.latencies) / elapsed:.1f} updates/s")
+        print(f"  reply latency p50={percentile(api.latencies, 0.5):.1f}ms  p99={percentile(api.latencies, 0.99):.1f}ms  "
+              f"max={max(api.latencies) * 1000:.1f}ms  mean={statistics.mean(api.latencies) * 1000:.1f}ms")
+    if http_latencies:
+        print(f"  webhook HTTP response p50={percentile(http_latencies, 0.5):.1f}ms  "
+              f"p99={percentile(http_latencies, 0.99):.1f}ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,257 @@
+# benchmarks/replay_updates.py
+"""
+Replays synthetic updates through the real Dispatcher (bot.create_dispatcher) without
+Telegram. Outbound Bot API calls go to a fake session that records them and answers with
+plausible results. The database is a fresh SQLite file seeded with N users per run.
+
+Two phases per database size:
+  profile    - each update kind replayed one at a time, to count the SQL statements
+               (sqlite3 trace callback) and Bot API calls a single update causes
+  throughput - the whole mix replayed with the given concurrency, for updates/sec and
+               latency percentiles per kind
+
+Usage: python benchmarks/replay_updates.py [--users 10,10000,1000000] [--updates 5000]
+           [--concurrency 32] [--mix stats=4,start=1,photo=1,admin_stats=0.1]
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Any, AsyncGenerator, get_args
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import Message
+
+import config
+import database
+from bot import create_bot, create_dispatcher
+from ingestion import ReceiptIngestion
+from keyboards import StatsPage
+from user_cache import profile_cache
+
+USER_ID_BASE = 100_000
+NEW_USER_ID_BASE = 50_000_000 # /start senders who aren't in the seeded database yet
+ADMIN_ID = next(iter(config.ADMIN_IDS))
+DEFAULT_MIX = "start=1,language=1,upload=1,photo=1,stats=4,text=1,admin_stats=0.2,stats_page=0.2,admin_payments=0.1"
+
+
+class ReplaySession(BaseSession):
+    """Bot API session that never touches the network; counts calls per method."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls: Counter[str] = Counter()
+        self.message_id = 0
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[TelegramType], timeout: int | None = None) -> TelegramType:
+        self.calls[method.__api_method__] += 1
+        returning = method.__returning__
+        if returning is Message or Message in get_args(returning):
+            self.message_id += 1
+            chat_id = getattr(method, "chat_id", None) or USER_ID_BASE
+            result: Any = {"message_id": self.message_id, "date": int(time.time()),
+                           "chat": {"id": chat_id, "type": "private"}, "text": getattr(method, "text", None)}
+        elif method.__api_method__ == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Replay", "username": "replay_bot"}
+        else:
+            result = True
+        response = self.check_response(bot, method, 200, self.json_dumps({"ok": True, "result": result}))
+        return response.result
+
+    async def stream_content(self, url: str, headers: dict[str, Any] | None = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True) -> AsyncGenerator[bytes, None]:
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def seed(n_users: int, n_families: int = 5):
+    """Bulk-inserts users (and some payment history) straight into SQLite."""
+    now = datetime.now()
+    with sqlite3.connect(config.DB_FILE) as conn:
+        conn.executemany("INSERT INTO families (name, billing_day, price) VALUES (?, ?, ?)",
+                         ((f"Family {i}", 1 + i % 28, 2.5) for i in range(n_families)))
+        family_ids = [row[0] for row in conn.execute("SELECT id FROM families")]
+        conn.executemany("INSERT INTO users (telegram_id, full_name, language, family_id, balance_cents) "
+                         "VALUES (?, ?, 'en', ?, ?)",
+                         ((USER_ID_BASE + i, f"User {i}", random.choice(family_ids), random.choice((0, 0, 250, 500)))
+                          for i in range(n_users)))
+        conn.execute("INSERT OR IGNORE INTO users (telegram_id, full_name, language, family_id) VALUES (?, 'Admin', 'en', ?)",
+                     (ADMIN_ID, family_ids[0]))
+        conn.executemany("INSERT INTO payments (user_id, image_path, timestamp, sha256, file_unique_id) "
+                         "VALUES (?, ?, ?, ?, ?)",
+                         ((USER_ID_BASE + random.randrange(n_users), "x.jpg", (now - timedelta(minutes=i)).isoformat(),
+                           f"{i:064x}", f"seed{i}") for i in range(max(1, n_users // 10))))
+        conn.execute("ANALYZE")
+
+
+class UpdateFactory:
+    """Builds raw update dicts, as Telegram would send them, for each kind in the mix."""
+
+    def __init__(self, n_users: int):
+        self.n_users = n_users
+        self.update_ids = itertools.count(1)
+        self.new_user_ids = itertools.count(NEW_USER_ID_BASE)
+
+    def _user(self) -> int:
+        return USER_ID_BASE + random.randrange(self.n_users)
+
+    def _message(self, user_id: int, **content) -> dict:
+        update_id = next(self.update_ids)
+        sender = {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+        return {"update_id": update_id, "message": {"message_id": update_id, "date": int(time.time()),
+                                                    "chat": {"id": user_id, "type": "private"}, "from": sender, **content}}
+
+    def _command(self, user_id: int, text: str) -> dict:
+        command_length = len(text.split()[0])
+        return self._message(user_id, text=text, entities=[{"type": "bot_command", "offset": 0, "length": command_length}])
+
+    def make(self, kind: str) -> dict:
+        if kind == "start":
+            return self._command(next(self.new_user_ids), "/start")
+        if kind == "language":
+            return self._message(self._user(), text=random.choice(("English", "Русский")))
+        if kind == "upload":
+            return self._message(self._user(), text="Upload")
+        if kind == "photo":
+            update_id = next(self.update_ids)
+            photo = [{"file_id": f"file{update_id}", "file_unique_id": f"uniq{update_id}", "width": 1280, "height": 960}]
+            return {**self._message(self._user(), photo=photo), "update_id": update_id}
+        if kind == "stats":
+            return self._message(self._user(), text="Stats")
+        if kind == "text":
+            return self._message(self._user(), text="hello?")
+        if kind == "admin_stats":
+            return self._command(ADMIN_ID, random.choice(("/admin_stats", "/admin_stats debtors")))
+        if kind == "admin_payments":
+            return self._command(ADMIN_ID, "/admin_payments")
+        if kind == "stats_page":
+            update_id = next(self.update_ids)
+            after = USER_ID_BASE + random.randrange(self.n_users)
+            message = self._message(ADMIN_ID, text="page")["message"]
+            return {"update_id": update_id, "callback_query": {
+                "id": str(update_id), "from": message["from"], "chat_instance": "replay", "message": message,
+                "data": StatsPage(after=after, debtors=random.random() < 0.5).pack()}}
+        raise ValueError(f"Unknown update kind: {kind}")
+
+
+def parse_mix(spec: str) -> dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        kind, _sep, weight = part.partition("=")
+        mix[kind.strip()] = float(weight or 1)
+    return mix
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000
+
+
+async def profile(dp, bot: Bot, session: ReplaySession, factory: UpdateFactory, kinds: list[str], samples: int) -> dict:
+    """Per kind: average SQL statements and Bot API calls for one update, handled on its own."""
+    statements: list[str] = []
+    await database._run(lambda: database._get_conn().set_trace_callback(statements.append))
+    costs = {}
+    for kind in kinds:
+        statements.clear()
+        session.calls.clear()
+        for _ in range(samples):
+            await dp.feed_raw_update(bot, factory.make(kind))
+        # Statements run by triggers are traced as "-- TRIGGER ..." comments
+        sql = sum(1 for statement in statements if not statement.startswith("--"))
+        costs[kind] = (sql / samples, sum(session.calls.values()) / samples)
+    await database._run(lambda: database._get_conn().set_trace_callback(None))
+    return costs
+
+
+async def throughput(dp, bot: Bot, factory: UpdateFactory, mix: dict[str, float], n_updates: int,
+                     concurrency: int) -> tuple[float, dict[str, list[float]]]:
+    kinds = random.choices(list(mix), weights=list(mix.values()), k=n_updates)
+    updates = [(kind, factory.make(kind)) for kind in kinds]
+    latencies: dict[str, list[float]] = defaultdict(list)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def replay(kind: str, update: dict):
+        async with semaphore:
+            t0 = time.perf_counter()
+            await dp.feed_raw_update(bot, update)
+            latencies[kind].append(time.perf_counter() - t0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(replay(kind, update) for kind, update in updates))
+    return time.perf_counter() - start, latencies
+
+
+async def run(dp, bot: Bot, session: ReplaySession, n_users: int, args, mix: dict[str, float]):
+    with tempfile.TemporaryDirectory() as tmp:
+        config.DB_FILE = os.path.join(tmp, "replay.db")
+        await database.init_db()
+        t0 = time.perf_counter()
+        await database._run(seed, n_users)
+        print(f"\n=== {n_users:,} users (seeded in {time.perf_counter() - t0:.1f}s) ===")
+
+        factory = UpdateFactory(n_users)
+        profile_cache.clear()
+
+        costs = await profile(dp, bot, session, factory, list(mix), args.samples)
+        elapsed, latencies = await throughput(dp, bot, factory, mix, args.updates, args.concurrency)
+
+        total = sum(len(values) for values in latencies.values())
+        print(f"{total} updates in {elapsed:.2f}s = {total / elapsed:,.0f} updates/s (concurrency {args.concurrency})")
+        print(f"{'kind':<16}{'count':>7}{'p50 ms':>9}{'p99 ms':>9}{'SQL/upd':>9}{'API/upd':>9}")
+        for kind in mix:
+            values = latencies.get(kind, [])
+            sql, api = costs[kind]
+            p50, p99 = (percentile(values, 0.5), percentile(values, 0.99)) if values else (0.0, 0.0)
+            print(f"{kind:<16}{len(values):>7}{p50:>9.2f}{p99:>9.2f}{sql:>9.1f}{api:>9.1f}")
+        cache = profile_cache.stats()
+        print(f"profile cache: {cache['hits']} hits, {cache['misses']} misses, {cache['evictions']} evictions")
+
+        await database.close_db()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", default="10,10000,1000000", help="comma-separated database sizes")
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--samples", type=int, default=20, help="updates per kind in the profile phase")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="kind=weight pairs")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--throttle", action="store_true",
+                        help="keep the anti-flood middleware (off by default: replayed users are far busier than real ones)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    random.seed(args.seed)
+    config.TOKEN = config.TOKEN or "123:replay"
+    mix = parse_mix(args.mix)
+
+    # The routers are module-level and can only be attached once, so every size shares one
+    # Dispatcher. The ingestion workers aren't started: the photo handler only persists the
+    # job, which is all a user waits for
+    session = ReplaySession()
+    bot = create_bot(session)
+    dp = create_dispatcher(ReceiptIngestion(bot), throttle=args.throttle)
+    for n_users in (int(n) for n in args.users.split(",")):
+        await run(dp, bot, session, n_users, args, mix)
+    await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
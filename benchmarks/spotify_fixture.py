@@ -0,0 +1,166 @@
+# benchmarks/spotify_fixture.py
+"""
+Local stand-in for the Spotify account pages used by script.py: login form,
+account overview with the family menu entry, the family-web-iframe and the
+member list / member settings pages. The page structure mirrors the XPaths in
+script.py, so a selector change there that the fixture doesn't follow shows up
+as a failed benchmark run instead of a broken enforcement run against the real account.
+
+The member page saves its toggle like the real one, with a request sent from the page, after
+a short debounce (--save-delay): leaving the page before the request has been sent loses the change.
+
+Usage: python benchmarks/spotify_fixture.py [--port 8765] [--delay 0.05] [--save-delay 0.1]
+"""
+import argparse
+import threading
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import time
+
+SESSION_COOKIE = "sp_dc"
+SESSION_VALUE = "fixture-session"
+
+LOGIN_PAGE = """<!doctype html><html><body>
+<form method="post" action="/login">
+  <input id="login-username" name="username">
+  <input id="login-password" name="password" type="password">
+  <button id="login-button" type="submit">Log In</button>
+</form>
+</body></html>"""
+
+# /html/body/div[1]/div[1]/div/div[2]/div/div[4]/div[3]/a[3]
+OVERVIEW_PAGE = """<!doctype html><html><body>
+<div><div><div>
+  <div></div>
+  <div><div>
+    <div></div><div></div><div></div>
+    <div>
+      <div></div><div></div>
+      <div>
+        <a href="/account/overview/">Overview</a>
+        <a href="/account/subscription/">Manage your plan</a>
+        <a href="/account/family/">Manage your family</a>
+      </div>
+    </div>
+  </div></div>
+</div></div></div>
+</body></html>"""
+
+FAMILY_PAGE = """<!doctype html><html><body>
+<iframe id="family-web-iframe" src="/family-web/" width="800" height="600"></iframe>
+</body></html>"""
+
+# //*[@id="__next"]/main/div[2]/div/section/div[1]/ul/li[N]/a, owner at li[1]
+MEMBER_LIST_PAGE = """<!doctype html><html><body><div id="__next"><main>
+<div></div>
+<div><div><section><div><ul>
+  <li><span>Plan owner</span></li>
+  {items}
+</ul></div></section></div></div>
+</main></div></body></html>"""
+
+MEMBER_PAGE = """<!doctype html><html><body><div id="__next"><main>
+<h1>Member {position}</h1>
+<label>Allow explicit content
+  <input type="checkbox" {checked}
+         onchange="const body = this.checked ? '1' : '0'; setTimeout(() =>
+           fetch('/family-web/member/{position}/explicit', {{method: 'POST', body}}), {save_delay_ms})">
+</label>
+</main></div></body></html>"""
+
+
+class FixtureState:
+    def __init__(self, members: int = 5, delay: float = 0.0, save_delay: float = 0.0):
+        self.delay = delay
+        self.save_delay = save_delay
+        self.explicit_allowed = {position: True for position in range(1, members + 1)}
+        self.logins = 0
+        self.toggles = 0
+        self.lock = threading.Lock()
+
+
+def make_handler(state: FixtureState):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _logged_in(self) -> bool:
+            cookie = SimpleCookie(self.headers.get("Cookie", ""))
+            return cookie.get(SESSION_COOKIE) is not None and cookie[SESSION_COOKIE].value == SESSION_VALUE
+
+        def _send(self, body: str, status: int = 200, headers: dict | None = None):
+            if state.delay:
+                time.sleep(state.delay)
+            data = body.encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.startswith("/account/overview"):
+                self._send(OVERVIEW_PAGE if self._logged_in() else LOGIN_PAGE)
+            elif self.path.startswith("/account/family"):
+                self._send(FAMILY_PAGE if self._logged_in() else LOGIN_PAGE)
+            elif self.path.rstrip("/") == "/family-web":
+                items = "\n  ".join(f'<li><a href="/family-web/member/{p}">Member {p}</a></li>'
+                                    for p in state.explicit_allowed)
+                self._send(MEMBER_LIST_PAGE.format(items=items))
+            elif self.path.startswith("/family-web/member/"):
+                position = int(self.path.rsplit("/", 1)[1])
+                checked = "checked" if state.explicit_allowed.get(position) else ""
+                self._send(MEMBER_PAGE.format(position=position, checked=checked,
+                                              save_delay_ms=int(state.save_delay * 1000)))
+            else:
+                self._send("not found", status=404)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+            if self.path == "/login":
+                with state.lock:
+                    state.logins += 1
+                fields = parse_qs(body)
+                if fields.get("username") and fields.get("password"):
+                    self._send("", status=303, headers={
+                        "Location": "/account/overview/",
+                        "Set-Cookie": f"{SESSION_COOKIE}={SESSION_VALUE}; Path=/",
+                    })
+                else:
+                    self._send(LOGIN_PAGE)
+            elif self.path.startswith("/family-web/member/") and self.path.endswith("/explicit"):
+                position = int(self.path.split("/")[3])
+                with state.lock:
+                    state.explicit_allowed[position] = body == "1"
+                    state.toggles += 1
+                self._send("ok")
+            else:
+                self._send("not found", status=404)
+
+    return Handler
+
+
+def start_server(state: FixtureState, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Starts the fixture in a background thread; port 0 picks a free port."""
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--members", type=int, default=5)
+    parser.add_argument("--delay", type=float, default=0.0, help="Simulated server latency per page, seconds")
+    parser.add_argument("--save-delay", type=float, default=0.0, help="Debounce before a toggle is saved, seconds")
+    args = parser.parse_args()
+
+    server = start_server(FixtureState(args.members, args.delay, args.save_delay), port=args.port)
+    print(f"Spotify fixture on http://127.0.0.1:{server.server_port}/account/overview/ (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
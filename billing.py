@@ -0,0 +1,22 @@
+# billing.py
+import calendar
+from datetime import date, timedelta
+
+
+def billing_day_in(year: int, month: int, day: int) -> date:
+    """The billing day in a given month, clamped to the month's last day (e.g. the 31st -> Feb 28)."""
+    return date(year, month, min(day, calendar.monthrange(year, month)[1]))
+
+
+def last_billing_date(billing_day: int, today: date) -> date:
+    """The most recent billing date on or before `today`."""
+    current = billing_day_in(today.year, today.month, billing_day)
+    if current <= today:
+        return current
+    previous_month = today.replace(day=1) - timedelta(days=1)
+    return billing_day_in(previous_month.year, previous_month.month, billing_day)
+
+
+def billing_period(billing_day: int, today: date) -> str:
+    """Ledger period ('YYYY-MM') of the billing cycle `today` falls in."""
+    return f"{last_billing_date(billing_day, today):%Y-%m}"
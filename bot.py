@@ -1,48 +1,158 @@
 # bot.py
 import asyncio
 import logging
+import signal
 import sys
+from typing import TYPE_CHECKING
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.base import BaseSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
-from aiogram.utils.i18n.middleware import SimpleI18nMiddleware
 
 
 
 import database
+import keyboards
+import metrics
 from localization import i18n
+from middlewares.i18n import DatabaseI18nMiddleware
+from middlewares.metrics import HandlerMetricsMiddleware, TelegramMetricsMiddleware
+from middlewares.throttling import ThrottlingMiddleware
 
 from handlers import common, admin
 import config
+import script
 
+from ingestion import ReceiptIngestion
+from lease import SCHEDULER_LEASE, LeaderLease
 from scheduler import scheduler_loop
 
+if TYPE_CHECKING:
+    from aiohttp import web
 
 
-
-async def main():
-
-    database.init_db()
-
+def create_bot(session: BaseSession | None = None) -> Bot:
+    """Builds the Bot; a custom session (e.g. a recording fake in benchmarks) replaces the HTTP one."""
+    if session is None and config.TELEGRAM_API_SERVER:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(config.TELEGRAM_API_SERVER))
     bot = Bot(
         token=config.TOKEN,
+        session=session,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
-    dp = Dispatcher()
+    bot.session.middleware(TelegramMetricsMiddleware())
+    return bot
+
 
-    dp.update.middleware(SimpleI18nMiddleware(i18n=i18n))
+def create_dispatcher(ingestion: ReceiptIngestion, throttle: bool = True) -> Dispatcher:
+    """Builds the Dispatcher with its middlewares and routers; the same for polling and webhook mode."""
+    dp = Dispatcher(ingestion=ingestion)
+
+    dp.update.middleware(DatabaseI18nMiddleware(i18n=i18n))
+    if throttle:
+        # Outer, so floods are dropped before any filter or handler runs (and after i18n, for the notice)
+        throttling = ThrottlingMiddleware()
+        dp.message.outer_middleware(throttling)
+        dp.callback_query.outer_middleware(throttling)
+    handler_metrics = HandlerMetricsMiddleware()
+    dp.message.middleware(handler_metrics)
+    dp.callback_query.middleware(handler_metrics)
 
     dp.include_router(common.common_router)
     dp.include_router(admin.admin_router)
+    return dp
 
-    scheduler_task = asyncio.create_task(scheduler_loop(bot))
 
+async def run_polling(dp: Dispatcher, bot: Bot):
     logging.info("Starting bot polling...")
+    await bot.delete_webhook() # getUpdates is refused while a webhook is set
+    await dp.start_polling(bot)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """Serves updates from an embedded aiohttp app until SIGINT/SIGTERM."""
+    # The aiohttp server side is only needed in webhook mode
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+    from aiohttp import web
+
+    if not config.WEBHOOK_URL or not config.WEBHOOK_SECRET:
+        raise RuntimeError("Webhook mode needs WEBHOOK_URL and WEBHOOK_SECRET.")
+
+    app = web.Application()
+    # Requests without the right secret get 401; accepted updates are answered right away
+    # and handled in background tasks, so slow handlers never hold up Telegram's request
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=config.WEBHOOK_SECRET,
+                         handle_in_background=True).register(app, path=config.WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, config.WEBHOOK_HOST, config.WEBHOOK_PORT)
+    await site.start()
+    await bot.set_webhook(f"{config.WEBHOOK_URL}{config.WEBHOOK_PATH}", secret_token=config.WEBHOOK_SECRET,
+                          allowed_updates=dp.resolve_used_update_types())
+    logging.info(f"Serving webhook on {config.WEBHOOK_HOST}:{config.WEBHOOK_PORT}{config.WEBHOOK_PATH}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup() # Stops accepting requests, then runs the shutdown hooks
+
+
+async def start_metrics_server() -> "web.AppRunner | None":
+    """Serves the Prometheus text endpoint on its own port (kept off the public webhook server)."""
+    if not config.METRICS_PORT:
+        return None
+    from aiohttp import web
+
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=metrics.REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, config.METRICS_HOST, config.METRICS_PORT).start()
+    logging.info(f"Serving metrics on {config.METRICS_HOST}:{config.METRICS_PORT}/metrics")
+    return runner
+
+
+async def main():
+
+    await database.init_db()
+    # Loads the translation catalogs now: a missing or uncompiled one fails startup, not every update
+    keyboards.build_main_menus()
+
+    bot = create_bot()
+    ingestion = ReceiptIngestion(bot)
+    dp = create_dispatcher(ingestion)
+
+    # Every process handles updates; only the holder of the scheduler lease runs scheduled jobs
+    scheduler_task = asyncio.create_task(LeaderLease(SCHEDULER_LEASE).run(lambda: scheduler_loop(bot)))
+    await ingestion.start()
+    metrics_runner = await start_metrics_server()
+    # Other processes may change profiles this one has cached
+    cache_sync_task = asyncio.create_task(database.sync_profile_cache()) if config.USER_CACHE_SYNC_INTERVAL else None
+
     try:
-        await dp.start_polling(bot)
+        if config.BOT_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            await run_polling(dp, bot)
     finally:
         logging.info("Stopping bot...")
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await ingestion.stop()
+        if cache_sync_task is not None:
+            cache_sync_task.cancel()
         scheduler_task.cancel()
         try:
             await scheduler_task
@@ -50,6 +160,8 @@ async def main():
             logging.info("Scheduler task cancelled successfully.")
         # Close bot session
         await bot.session.close()
+        await database.close_db()
+        await asyncio.to_thread(script.shutdown)
         logging.info("Bot stopped.")
 
 
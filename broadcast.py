@@ -0,0 +1,162 @@
+# broadcast.py
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterable, Awaitable, Callable
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+import config
+import database
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, bursting up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+@dataclass
+class BroadcastReport:
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    blocked: int = 0
+    retries: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+    finished_at: float | None = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def rate(self) -> float:
+        return self.sent / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __str__(self):
+        return (f"{self.sent}/{self.total} sent, {self.failed} failed, {self.blocked} blocked, "
+                f"{self.retries} retries in {self.elapsed:.1f}s ({self.rate:.1f} msg/s)")
+
+
+class Broadcaster:
+    """
+    Sends messages to many chats concurrently while respecting Telegram's global and
+    per-chat rate limits. A RetryAfter from Telegram pauses every worker, transient
+    network/server errors are retried with backoff (both count toward max_retries per
+    message, after which the message is reported as failed), and users who blocked the bot are
+    reported through `on_blocked` (by default flagged in the DB so later runs skip them).
+    """
+
+    def __init__(self, bot: Bot, *,
+                 rate: float = config.BROADCAST_RATE,
+                 chat_interval: float = config.BROADCAST_CHAT_INTERVAL,
+                 concurrency: int = config.BROADCAST_CONCURRENCY,
+                 max_retries: int = config.BROADCAST_MAX_RETRIES,
+                 on_blocked: Callable[[int], Awaitable[None]] | None = database.mark_user_blocked):
+        self.bot = bot
+        self.bucket = TokenBucket(rate)
+        self.chat_interval = chat_interval
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.on_blocked = on_blocked
+        self._paused_until = 0.0
+        self._chat_next_send: dict[int, float] = {}
+
+    async def _wait_for_slot(self, chat_id: int):
+        # Global pause after a RetryAfter, then the per-chat spacing, then the global bucket
+        while (delay := self._paused_until - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+        delay = self._chat_next_send.get(chat_id, 0.0) - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await self.bucket.acquire()
+        now = time.monotonic()
+        self._chat_next_send[chat_id] = now + self.chat_interval
+        if len(self._chat_next_send) > self.concurrency * 100:
+            # Only chats sent to within the last interval still constrain us
+            self._chat_next_send = {cid: t for cid, t in self._chat_next_send.items() if t > now}
+
+    async def _deliver(self, chat_id: int, text: str, report: BroadcastReport):
+        attempt = 0
+        while True:
+            await self._wait_for_slot(chat_id)
+            try:
+                await self.bot.send_message(chat_id, text)
+                report.sent += 1
+                return
+            except TelegramRetryAfter as e:
+                logging.warning(f"Flood limit hit, pausing broadcast for {e.retry_after}s")
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                if attempt >= self.max_retries: # Counts like any other retry, so one chat can't stall the run
+                    logging.warning(f"Giving up on chat {chat_id} after {attempt} retries: {e}")
+                    report.failed += 1
+                    return
+            except TelegramForbiddenError:
+                report.blocked += 1
+                if self.on_blocked is not None:
+                    await self.on_blocked(chat_id)
+                return
+            except (TelegramNetworkError, TelegramServerError) as e:
+                if attempt >= self.max_retries:
+                    logging.warning(f"Giving up on chat {chat_id} after {attempt} retries: {e}")
+                    report.failed += 1
+                    return
+                await asyncio.sleep(2 ** attempt)
+            except Exception as e:
+                logging.warning(f"Failed to send broadcast message to chat {chat_id}: {e}")
+                report.failed += 1
+                return
+            attempt += 1
+            report.retries += 1
+
+    async def run(self, messages: AsyncIterable[tuple[int, str]]) -> BroadcastReport:
+        """Consumes (chat_id, text) pairs as they are produced and returns a report when all are handled."""
+        report = BroadcastReport()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2) # Backpressure on the producer
+
+        async def worker():
+            while (item := await queue.get()) is not None:
+                await self._deliver(*item, report)
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            async for chat_id, text in messages:
+                report.total += 1
+                await queue.put((chat_id, text))
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+        report.finished_at = time.monotonic()
+        return report
+
+
+async def broadcast(bot: Bot, messages: AsyncIterable[tuple[int, str]], **kwargs) -> BroadcastReport:
+    """Shortcut for Broadcaster(bot, **kwargs).run(messages)."""
+    return await Broadcaster(bot, **kwargs).run(messages)
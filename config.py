@@ -1,19 +1,88 @@
 import os
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, time
 
 load_dotenv()
 
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+TELEGRAM_API_SERVER = os.getenv("TELEGRAM_API_SERVER") # Base URL of a self-hosted Bot API server; unset = api.telegram.org
+
+# Update delivery: "polling" (getUpdates) or "webhook" (embedded aiohttp server behind an HTTPS proxy)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL") # Public base URL Telegram posts updates to, e.g. https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") # Telegram echoes it in X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0")) # Serves Prometheus text on /metrics when set; 0 = off
 DB_FILE = "spotify_family.db"
-BILLING_DATE = datetime(2025, 5, 10)
-RECEIPTS_DIR = "receipts"
+BILLING_DATE = datetime(2025, 5, 10) # Billing day of the default family created on first start
+DEFAULT_FAMILY_PRICE = 1.0
+ACCRUAL_TIME = time(0, 5) # Monthly charges are booked on the billing day
+NOTIFICATION_TIME = time(10, 0) # Debt reminders, the day before the billing day
+EXPLICIT_CHECK_TIME = time(11, 0) # Explicit content enforcement, 3 days after the billing day
+EXPLICIT_RESTORE_INTERVAL = 900 # Seconds between checks for blocked members who have paid
+RECEIPTS_DIR = "receipts" # Created on the first stored receipt
+# Receipts unused for this long are packed into compressed monthly bundles in RECEIPTS_DIR/archive
+RECEIPT_ARCHIVE_AFTER_DAYS = 90
+RECEIPT_ARCHIVE_TIME = time(3, 0) # Daily archival run
+RECEIPT_ARCHIVE_BATCH = 500 # Receipts read from the DB at a time during a run
+RECEIPT_RETENTION_MONTHS = 0 # Bundles older than this many months are deleted; 0 keeps them forever
 LOCALES_DIR = "locales"
 DEFAULT_LOCALE = "en"
 I18N_DOMAIN = "messages"
+USER_CACHE_SIZE = 10000 # Max cached user profiles
+USER_CACHE_TTL = 600 # Seconds before a cached profile is re-read from the DB
+# Each process caches profiles on its own. It evicts profiles changed by other processes (language,
+# debt, family) by polling a change log every this many seconds: the longest another process can
+# show a stale profile. 0 turns polling off, only safe with a single bot process
+USER_CACHE_SYNC_INTERVAL = 2
+PROFILE_CHANGES_RETENTION = 3600 # Seconds change log entries are kept; far longer than any poll gap
+ADMIN_STATS_PAGE_SIZE = 30 # Users per /admin_stats page, keeps messages far below Telegram's 4096 chars
+BULK_DEBT_MAX_BYTES = 1024 * 1024 # Largest CSV accepted by bulk /update_debt
+BULK_DEBT_MAX_ROWS = 5000
+EXPORT_BATCH_SIZE = 1000 # Rows per fetchmany() while streaming an /export
+# Telegram's limit for documents sent by bots: 50 MB, or 2000 MB through a self-hosted Bot API server
+EXPORT_MAX_BYTES = (2000 if TELEGRAM_API_SERVER else 50) * 1024 * 1024
+
+# Broadcasts stay under Telegram's limits: ~30 msg/s overall and 1 msg/s per chat
+BROADCAST_RATE = 25
+BROADCAST_CHAT_INTERVAL = 1.0
+BROADCAST_CONCURRENCY = 10
+BROADCAST_MAX_RETRIES = 3
+
+# Per-user anti-flood (middlewares/throttling.py): bursts of THROTTLE_BURST, then THROTTLE_RATE updates/s
+THROTTLE_RATE = 1.0
+THROTTLE_BURST = 5
+THROTTLE_NOTICE_INTERVAL = 10 # At most one "slow down" reply per user in this many seconds
+THROTTLE_IDLE_TTL = 60 # Seconds before an idle user's bucket is forgotten
+MEDIA_GROUP_WINDOW = 30 # Album parts arriving this long after the first still count as the same receipt
+
+# Background receipt ingestion (ingestion.py)
+INGESTION_WORKERS = 4
+INGESTION_QUEUE_SIZE = 100 # Jobs beyond this wait in the DB until workers catch up
+INGESTION_MAX_ATTEMPTS = 5
+INGESTION_RETRY_DELAY = 5 # Seconds before the first retry, doubled on each further attempt
+INGESTION_POLL_INTERVAL = 5 # Seconds between checks of the DB for due jobs
+INGESTION_STALE_AFTER = 300 # A job 'processing' for longer than this is assumed orphaned by a crash and retried
+INGESTION_STALE_SWEEP_INTERVAL = 60 # Seconds between checks for such jobs
 
+# Several bot processes may share the database; only the holder of the scheduler lease runs jobs
+LEASE_TTL = 30 # Seconds a lease stays valid without renewal; a dead leader is replaced within ~TTL + interval
+LEASE_RENEW_INTERVAL = 10 # Heartbeat (and takeover attempt) period
+SCHEDULER_REFRESH_INTERVAL = 60 # Leader re-reads scheduled_jobs to pick up families added by other processes
 
-ADMIN_IDS = {int(admin_id) for admin_id in os.getenv("ADMIN_IDS", "123456789").split(',')} # Example: Load from .env
+# Spotify family enforcement (script.py)
+# Every family shares one Spotify account, so only one family can be enforced: the one that family
+# account belongs to. Only its members are mapped to Spotify positions. Default: the first family
+SPOTIFY_FAMILY_ID = int(os.getenv("SPOTIFY_FAMILY_ID", "1"))
+SPOTIFY_EMAIL = os.getenv("EMAIL")
+SPOTIFY_PASSWORD = os.getenv("PASSWORD")
+SPOTIFY_ACCOUNT_URL = os.getenv("SPOTIFY_ACCOUNT_URL", "https://www.spotify.com/account/overview/")
+SPOTIFY_COOKIES_FILE = "spotify_cookies.json" # Saved browser session, reused instead of logging in again
+SPOTIFY_HEADLESS = os.getenv("SPOTIFY_HEADLESS", "1") != "0"
+SPOTIFY_WAIT_TIMEOUT = 10 # Seconds to wait for a page element before giving up
 
 
-os.makedirs(RECEIPTS_DIR, exist_ok=True)
\ No newline at end of file
+ADMIN_IDS = {int(admin_id) for admin_id in os.getenv("ADMIN_IDS", "123456789").split(',')} # Example: Load from .env
\ No newline at end of file
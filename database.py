@@ -1,140 +1,1331 @@
+import asyncio
 import sqlite3
 import logging
-from datetime import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import AsyncIterator
 import config
+import metrics
+from billing import billing_period
+from user_cache import UserProfile, profile_cache
+
+
+# --- Connection ---
+# All queries run on one dedicated thread that owns a single long-lived connection,
+# so handlers and the scheduler never block the event loop on SQLite I/O.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+_conn: sqlite3.Connection | None = None
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",  # ~16 MB page cache
+    "PRAGMA mmap_size = 134217728",  # 128 MB
+)
+
+
+def _get_conn() -> sqlite3.Connection:
+    """Returns the shared connection, opening it on first use (executor thread only)."""
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(config.DB_FILE)
+        for pragma in PRAGMAS:
+            _conn.execute(pragma)
+    return _conn
+
+
+def _close_conn():
+    global _conn
+    if _conn is not None:
+        _conn.close()
+        _conn = None
+
+
+async def _run(func, *args):
+    """Runs a blocking DB function on the dedicated SQLite thread, timing it (queue wait included)."""
+    loop = asyncio.get_running_loop()
+    name = func.__name__.lstrip("_")
+    started = time.perf_counter()
+    try:
+        return await loop.run_in_executor(_executor, func, *args)
+    except Exception as e:
+        metrics.DB_ERRORS.inc(name, type(e).__name__)
+        raise
+    finally:
+        metrics.DB_LATENCY.observe(time.perf_counter() - started, name)
+
+
+async def close_db():
+    """Closes the shared connection. Call on shutdown."""
+    await _run(_close_conn)
 
 
 # --- Initialization ---
-def init_db():
-    try:
-        with sqlite3.connect(config.DB_FILE) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-                                id INTEGER PRIMARY KEY,
-                                telegram_id INTEGER UNIQUE NOT NULL,
-                                full_name TEXT,
-                                language TEXT DEFAULT 'en',
-                                debt REAL DEFAULT 1.0,
-                                role TEXT DEFAULT 'member')''')
-            cursor.execute('''CREATE TABLE IF NOT EXISTS payments (
-                                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                                user_id INTEGER,
-                                image_path TEXT,
-                                timestamp TEXT,
-                                FOREIGN KEY(user_id) REFERENCES users(telegram_id))''')
-            cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_telegram_id ON users (telegram_id)")
-            conn.commit()
-            logging.info("Database initialized successfully.")
+def _add_column_if_missing(conn: sqlite3.Connection, table: str, column: str, definition: str) -> bool:
+    """Adds a column to a table created by an older version of the schema. Returns True if it was added."""
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        return True
+    return False
+
+
+def _migration_1_baseline(conn: sqlite3.Connection):
+    """Baseline schema. Also brings any database created before versioning up to date."""
+    conn.execute('''CREATE TABLE IF NOT EXISTS families (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        name TEXT NOT NULL,
+                        billing_day INTEGER NOT NULL CHECK (billing_day BETWEEN 1 AND 31),
+                        price REAL NOT NULL DEFAULT 0.0)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS family_admins (
+                        family_id INTEGER NOT NULL REFERENCES families(id),
+                        telegram_id INTEGER NOT NULL,
+                        PRIMARY KEY (family_id, telegram_id)) WITHOUT ROWID''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_family_admins_telegram_id ON family_admins (telegram_id)")
+    conn.execute('''CREATE TABLE IF NOT EXISTS users (
+                        id INTEGER PRIMARY KEY,
+                        telegram_id INTEGER UNIQUE NOT NULL,
+                        full_name TEXT,
+                        language TEXT DEFAULT 'en',
+                        balance_cents INTEGER NOT NULL DEFAULT 0,
+                        role TEXT DEFAULT 'member',
+                        is_blocked INTEGER DEFAULT 0,
+                        family_id INTEGER REFERENCES families(id))''')
+    _add_column_if_missing(conn, "users", "is_blocked", "INTEGER DEFAULT 0")
+    _add_column_if_missing(conn, "users", "family_id", "INTEGER REFERENCES families(id)")
+    conn.execute('''CREATE TABLE IF NOT EXISTS payments (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER,
+                        image_path TEXT,
+                        timestamp TEXT,
+                        sha256 TEXT,
+                        file_unique_id TEXT,
+                        duplicate_of INTEGER REFERENCES payments(id),
+                        FOREIGN KEY(user_id) REFERENCES users(telegram_id))''')
+    _add_column_if_missing(conn, "payments", "sha256", "TEXT")
+    _add_column_if_missing(conn, "payments", "file_unique_id", "TEXT")
+    _add_column_if_missing(conn, "payments", "duplicate_of", "INTEGER REFERENCES payments(id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_payments_sha256 ON payments (sha256)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_payments_file_unique_id ON payments (file_unique_id)")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_telegram_id ON users (telegram_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_family ON users (family_id, telegram_id)")
+    # Single-family installs: everything existing belongs to one default family
+    if conn.execute("SELECT 1 FROM families LIMIT 1").fetchone() is None:
+        conn.execute("INSERT INTO families (name, billing_day, price) VALUES (?, ?, ?)",
+                     ("Default", config.BILLING_DATE.day, config.DEFAULT_FAMILY_PRICE))
+    conn.execute("UPDATE users SET family_id = (SELECT MIN(id) FROM families) WHERE family_id IS NULL")
+    # --- Ledger ---
+    # Every change to what a user owes is an appended row; users.balance_cents is the
+    # running sum, kept up to date by the trigger below (positive = user owes money).
+    conn.execute('''CREATE TABLE IF NOT EXISTS ledger (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER NOT NULL REFERENCES users(telegram_id),
+                        kind TEXT NOT NULL CHECK (kind IN ('charge', 'payment', 'adjustment')),
+                        amount_cents INTEGER NOT NULL,
+                        period TEXT, -- 'YYYY-MM' billing cycle, set for charges
+                        payment_id INTEGER REFERENCES payments(id),
+                        note TEXT,
+                        created_at TEXT NOT NULL)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ledger_user ON ledger (user_id, id)")
+    # At most one charge per user and cycle, so accrual can simply be re-run
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_ledger_charge_period ON ledger (user_id, period) "
+                 "WHERE kind = 'charge'")
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS ledger_apply_balance AFTER INSERT ON ledger
+                    BEGIN
+                        UPDATE users SET balance_cents = balance_cents + NEW.amount_cents
+                        WHERE telegram_id = NEW.user_id;
+                    END''')
+    if _add_column_if_missing(conn, "users", "balance_cents", "INTEGER NOT NULL DEFAULT 0"):
+        # Carry the old float debt over as each user's opening ledger entry
+        conn.execute("INSERT INTO ledger (user_id, kind, amount_cents, note, created_at) "
+                     "SELECT telegram_id, 'adjustment', CAST(ROUND(debt * 100) AS INTEGER), 'opening balance', ? "
+                     "FROM users WHERE CAST(ROUND(debt * 100) AS INTEGER) != 0",
+                     (datetime.now().isoformat(),))
+    conn.execute('''CREATE TABLE IF NOT EXISTS receipt_jobs (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER NOT NULL,
+                        chat_id INTEGER NOT NULL,
+                        full_name TEXT,
+                        locale TEXT,
+                        file_id TEXT NOT NULL,
+                        file_unique_id TEXT NOT NULL,
+                        status TEXT NOT NULL DEFAULT 'pending',
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        last_error TEXT,
+                        created_at TEXT NOT NULL,
+                        available_at TEXT NOT NULL,
+                        updated_at TEXT NOT NULL)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_receipt_jobs_status ON receipt_jobs (status, available_at)")
+    conn.execute('''CREATE TABLE IF NOT EXISTS scheduled_jobs (
+                        name TEXT PRIMARY KEY,
+                        kind TEXT NOT NULL,
+                        next_run_at TEXT NOT NULL,
+                        last_run_at TEXT,
+                        last_status TEXT,
+                        last_error TEXT,
+                        family_id INTEGER REFERENCES families(id))''')
+    _add_column_if_missing(conn, "scheduled_jobs", "family_id", "INTEGER REFERENCES families(id)")
+    # Global jobs from before families existed are replaced by per-family ones
+    conn.execute("DELETE FROM scheduled_jobs WHERE family_id IS NULL")
+
+
+def _migration_2_indexes(conn: sqlite3.Connection):
+    """Indexes for payment history and debtor lookups; drops the index duplicating users' UNIQUE constraint."""
+    conn.execute("DROP INDEX IF EXISTS idx_telegram_id") # Same as the autoindex behind telegram_id UNIQUE
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_payments_user ON payments (user_id, timestamp)")
+    # Only debtors are indexed, so reminder and enforcement runs don't walk paid-up members
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_debtors ON users (family_id, telegram_id) WHERE balance_cents > 0")
+
+
+
+def _migration_3_leases(conn: sqlite3.Connection):
+    """Named leases, so only one of several bot processes runs singleton work like the scheduler."""
+    conn.execute('''CREATE TABLE IF NOT EXISTS leases (
+                        name TEXT PRIMARY KEY,
+                        holder TEXT NOT NULL,
+                        expires_at REAL NOT NULL) WITHOUT ROWID''') # Unix time, shared by all processes
+
+
+def _migration_4_enforcement(conn: sqlite3.Connection):
+    """Spotify member mapping, the explicit-content state last applied per user and the enforcement action log."""
+    _add_column_if_missing(conn, "users", "spotify_member", "INTEGER") # Position (1-5) in the Spotify family list
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_spotify_member ON users (family_id, spotify_member) "
+                 "WHERE spotify_member IS NOT NULL")
+    conn.execute('''CREATE TABLE IF NOT EXISTS enforcement_state (
+                        user_id INTEGER PRIMARY KEY,
+                        spotify_member INTEGER NOT NULL,
+                        allow_explicit INTEGER NOT NULL,
+                        applied_at TEXT NOT NULL)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS enforcement_actions (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER NOT NULL,
+                        family_id INTEGER NOT NULL,
+                        spotify_member INTEGER NOT NULL,
+                        allow_explicit INTEGER NOT NULL,
+                        status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'done', 'superseded')),
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        last_error TEXT,
+                        created_at TEXT NOT NULL,
+                        updated_at TEXT NOT NULL)''')
+    # At most one open action per user, so planning the same change twice is a no-op
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_enforcement_pending_user ON enforcement_actions (user_id) "
+                 "WHERE status = 'pending'")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_enforcement_pending_family ON enforcement_actions (family_id) "
+                 "WHERE status = 'pending'")
+
+
+def _migration_5_receipt_archive(conn: sqlite3.Connection):
+    """Index of receipts packed into monthly archive bundles (receipts.py)."""
+    conn.execute('''CREATE TABLE IF NOT EXISTS receipt_archive (
+                        sha256 TEXT PRIMARY KEY,
+                        bundle TEXT, -- NULL: the file was already gone when it was archived
+                        offset INTEGER,
+                        length INTEGER,
+                        size INTEGER,
+                        archived_at TEXT NOT NULL) WITHOUT ROWID''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_receipt_archive_bundle ON receipt_archive (bundle)")
+
+
+def _migration_6_payment_timestamps(conn: sqlite3.Connection):
+    """Payments by time, for date-range exports in time order without a sort."""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_payments_timestamp ON payments (timestamp)")
+
+
+def _migration_7_profile_changes(conn: sqlite3.Connection):
+    """Log of profile edits, so every process can evict them from its profile cache."""
+    conn.execute('''CREATE TABLE IF NOT EXISTS profile_changes (
+                        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                        telegram_id INTEGER NOT NULL,
+                        changed_at TEXT NOT NULL)''') # UTC, from SQLite's clock
+    # The columns behind UserProfile; balance changes made by ledger_apply_balance count too
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS users_profile_changed
+                    AFTER UPDATE OF full_name, language, balance_cents, role, family_id ON users
+                    BEGIN
+                        INSERT INTO profile_changes (telegram_id, changed_at) VALUES (NEW.telegram_id, datetime('now'));
+                    END''')
+
+
+def _migration_8_single_spotify_account(conn: sqlite3.Connection):
+    """Spotify positions belong to the one account of SPOTIFY_FAMILY_ID, so they're unique across all families."""
+    cleared = conn.execute("UPDATE users SET spotify_member = NULL WHERE spotify_member IS NOT NULL "
+                           "AND family_id IS NOT ?", (config.SPOTIFY_FAMILY_ID,)).rowcount
+    if cleared:
+        logging.warning(f"Unmapped {cleared} Spotify members outside family {config.SPOTIFY_FAMILY_ID}.")
+    conn.execute("DROP INDEX IF EXISTS idx_users_spotify_member")
+    conn.execute("CREATE UNIQUE INDEX idx_users_spotify_member ON users (spotify_member) WHERE spotify_member IS NOT NULL")
+    # Other families' runs toggled the same positions, so what was applied is unknown: forget it, and
+    # the next runs apply every member again
+    conn.execute("DELETE FROM enforcement_state")
+    conn.execute("UPDATE enforcement_actions SET status = 'superseded', updated_at = ? WHERE status = 'pending'",
+                 (datetime.now().isoformat(),))
+    conn.execute("DELETE FROM scheduled_jobs WHERE kind IN ('explicit_check', 'explicit_restore') "
+                 "AND family_id IS NOT ?", (config.SPOTIFY_FAMILY_ID,))
+
+
+# Applied in order, each in its own transaction; PRAGMA user_version records how many have run.
+# Never edit a released step: append a new one instead.
+MIGRATIONS = (
+    _migration_1_baseline,
+    _migration_2_indexes,
+    _migration_3_leases,
+    _migration_4_enforcement,
+    _migration_5_receipt_archive,
+    _migration_6_payment_timestamps,
+    _migration_7_profile_changes,
+    _migration_8_single_spotify_account,
+)
+
+
+def _migrate(conn: sqlite3.Connection) -> int:
+    """Applies pending migrations. Returns the resulting schema version."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version > len(MIGRATIONS):
+        raise sqlite3.DatabaseError(f"Database schema version {version} is newer than this code ({len(MIGRATIONS)})")
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        # Explicit BEGIN: sqlite3 doesn't open a transaction for DDL on its own, and a
+        # half-applied step must roll back together with its version bump
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+        logging.info(f"Applied database migration {number}: {migration.__name__}")
+        version = number
+    return version
+
+
+def _init_db() -> int:
+    return _migrate(_get_conn())
+
+async def init_db():
+    try:
+        version = await _run(_init_db)
+        logging.info(f"Database initialized successfully (schema version {version}).")
     except sqlite3.Error as e:
         logging.error(f"Database initialization error: {e}", exc_info=True)
         raise # Re-raise the exception to be handled by the caller if needed
 
 # --- User Operations ---
-def add_or_ignore_user(user_id: int, full_name: str):
-    """Adds a user if they don't exist."""
+def _add_or_ignore_user(user_id: int, full_name: str, family_id: int | None):
+    conn = _get_conn()
+    with conn:
+        cursor = conn.execute("INSERT OR IGNORE INTO users (telegram_id, full_name, family_id) "
+                              "VALUES (?, ?, COALESCE((SELECT id FROM families WHERE id = ?), (SELECT MIN(id) FROM families)))",
+                              (user_id, full_name, family_id))
+        if cursor.rowcount:
+            # A new member owes the current cycle's share, like everyone charged on the billing day
+            billing_day, price = conn.execute("SELECT f.billing_day, f.price FROM users u JOIN families f ON f.id = u.family_id "
+                                              "WHERE u.telegram_id = ?", (user_id,)).fetchone()
+            conn.execute("INSERT OR IGNORE INTO ledger (user_id, kind, amount_cents, period, note, created_at) "
+                         "VALUES (?, 'charge', CAST(ROUND(? * 100) AS INTEGER), ?, 'joined', ?)",
+                         (user_id, price, billing_period(billing_day, date.today()), datetime.now().isoformat()))
+        # A returning user has unblocked the bot, so include them in broadcasts again
+        conn.execute("UPDATE users SET is_blocked = 0 WHERE telegram_id = ? AND is_blocked = 1", (user_id,))
+
+
+async def add_or_ignore_user(user_id: int, full_name: str, family_id: int | None = None):
+    """Adds a user if they don't exist, in the given family (unknown or None: the first family)."""
     try:
-        with sqlite3.connect(config.DB_FILE) as conn:
-            cursor = conn.cursor()
-            cursor.execute("INSERT OR IGNORE INTO users (telegram_id, full_name) VALUES (?, ?)",
-                           (user_id, full_name))
-            conn.commit()
+        await _run(_add_or_ignore_user, user_id, full_name, family_id)
     except sqlite3.Error as e:
         logging.error(f"DB Error adding/ignoring user {user_id}: {e}")
 
-def set_user_language(user_id: int, lang: str):
+
+def _get_user_profile(user_id: int) -> UserProfile | None:
+    row = _get_conn().execute("SELECT telegram_id, full_name, language, balance_cents / 100.0, role, family_id FROM users "
+                              "WHERE telegram_id = ?", (user_id,)).fetchone()
+    return UserProfile(*row) if row else None
+
+
+async def get_user_profile(user_id: int) -> UserProfile | None:
+    """Fetches the user's profile (name, language, debt, role, family), served from the cache when possible."""
+    profile = profile_cache.get(user_id)
+    if profile is not None:
+        return profile
+    try:
+        profile = await _run(_get_user_profile, user_id)
+    except sqlite3.Error as e:
+        logging.error(f"DB Error fetching profile for user {user_id}: {e}")
+        return None
+    if profile is not None:
+        profile_cache.put(profile)
+    return profile
+
+
+def _set_user_language(user_id: int, lang: str):
+    conn = _get_conn()
+    with conn:
+        conn.execute("UPDATE users SET language = ? WHERE telegram_id = ?", (lang, user_id))
+
+
+async def set_user_language(user_id: int, lang: str):
     """Updates the user's language preference."""
     try:
-        with sqlite3.connect(config.DB_FILE) as conn:
-            cursor = conn.cursor()
-            cursor.execute("UPDATE users SET language = ? WHERE telegram_id = ?", (lang, user_id))
-            conn.commit()
-            return True
+        await _run(_set_user_language, user_id, lang)
+        profile_cache.update(user_id, language=lang)
+        return True
     except sqlite3.Error as e:
         logging.error(f"DB Error updating language for user {user_id}: {e}")
         return False
 
-def get_user_language(user_id: int) -> str:
+
+async def get_user_language(user_id: int) -> str:
     """Fetches the user's language preference."""
-    try:
-        with sqlite3.connect(config.DB_FILE) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT language FROM users WHERE telegram_id = ?", (user_id,))
-            result = cursor.fetchone()
-            if result and result[0]:
-                return result[0]
-    except sqlite3.Error as e:
-        logging.error(f"DB Error fetching language for user {user_id}: {e}")
+    profile = await get_user_profile(user_id)
+    if profile and profile.language:
+        return profile.language
     return config.DEFAULT_LOCALE # Fallback to default
 
-def get_user_debt(user_id: int) -> float | None:
+
+async def get_user_debt(user_id: int) -> float | None:
     """Fetches the user's current debt."""
+    profile = await get_user_profile(user_id)
+    return profile.debt if profile else None
+
+
+def _update_user_debt(user_id: int, new_debt: float, note: str | None) -> bool:
+    conn = _get_conn()
+    with conn:
+        # The balance is never overwritten: the difference is booked as an adjustment
+        cursor = conn.execute("INSERT INTO ledger (user_id, kind, amount_cents, note, created_at) "
+                              "SELECT telegram_id, 'adjustment', CAST(ROUND(? * 100) AS INTEGER) - balance_cents, ?, ? "
+                              "FROM users WHERE telegram_id = ? AND CAST(ROUND(? * 100) AS INTEGER) != balance_cents",
+                              (new_debt, note, datetime.now().isoformat(), user_id, new_debt))
+        if cursor.rowcount:
+            return True
+        # Nothing to book: either the user doesn't exist or the balance already matches
+        return conn.execute("SELECT 1 FROM users WHERE telegram_id = ?", (user_id,)).fetchone() is not None
+
+
+async def update_user_debt(user_id: int, new_debt: float, note: str | None = None) -> bool:
+    """Sets a specific user's debt by appending an adjustment for the difference to the ledger."""
     try:
-        with sqlite3.connect(config.DB_FILE) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT debt FROM users WHERE telegram_id = ?", (user_id,))
-            result = cursor.fetchone()
-            return result[0] if result else None
+        updated = await _run(_update_user_debt, user_id, new_debt, note)
     except sqlite3.Error as e:
-        logging.error(f"DB Error fetching debt for user {user_id}: {e}")
+        logging.error(f"DB Error updating debt for user {user_id}: {e}")
+        return False
+    if updated:
+        profile_cache.update(user_id, debt=round(new_debt, 2))
+    return updated
+
+
+
+def _bulk_update_debts(debts: list[tuple[int, int]], family_ids: list[int] | None,
+                       note: str | None) -> tuple[list[tuple[int, int, str]], list[int]]:
+    conn = _get_conn()
+    with conn:
+        # One write transaction: the checks and every adjustment commit or roll back together
+        conn.execute("BEGIN IMMEDIATE")
+        known: dict[int, tuple[int, int, str]] = {}
+        user_ids = [user_id for user_id, cents in debts]
+        for i in range(0, len(user_ids), 500): # Stay below SQLite's bound-parameter limit
+            chunk = user_ids[i:i + 500]
+            for row in conn.execute("SELECT telegram_id, family_id, balance_cents, language FROM users "
+                                    f"WHERE telegram_id IN ({','.join('?' * len(chunk))})", chunk):
+                known[row[0]] = row[1:]
+        rejected = [user_id for user_id in user_ids
+                    if user_id not in known or (family_ids is not None and known[user_id][0] not in family_ids)]
+        if rejected:
+            return [], rejected
+        changed = [(user_id, cents, known[user_id][2]) for user_id, cents in debts if cents != known[user_id][1]]
+        now = datetime.now().isoformat()
+        conn.executemany("INSERT INTO ledger (user_id, kind, amount_cents, note, created_at) VALUES (?, 'adjustment', ?, ?, ?)",
+                         [(user_id, cents - known[user_id][1], note, now) for user_id, cents, language in changed])
+    return changed, []
+
+
+async def bulk_update_debts(debts: list[tuple[int, int]], family_ids: list[int] | None = None,
+                            note: str | None = None) -> tuple[list[tuple[int, int, str]], list[int]] | None:
+    """
+    Sets many balances (telegram_id, cents) at once, all or nothing. Every user must exist and,
+    when family_ids is given, belong to one of those families; otherwise nothing is written.
+    Returns (changed users as (telegram_id, cents, language), rejected telegram_ids), or None on a DB error.
+    """
+    try:
+        changed, rejected = await _run(_bulk_update_debts, debts, family_ids, note)
+    except sqlite3.Error as e:
+        logging.error(f"DB Error in bulk debt update: {e}")
         return None
+    for user_id, cents, language in changed:
+        profile_cache.update(user_id, debt=cents / 100.0)
+    return changed, rejected
 
-def update_user_debt(user_id: int, new_debt: float) -> bool:
-    """Updates a specific user's debt."""
+def _get_users_page(after_id: int | None, before_id: int | None, limit: int, debtors_only: bool,
+                    language: str | None, family_ids: list[int] | None) -> list:
+    conditions, params = [], []
+    if family_ids is not None:
+        conditions.append(f"family_id IN ({','.join('?' * len(family_ids))})")
+        params.extend(family_ids)
+    if debtors_only:
+        conditions.append("balance_cents > 0")
+    if language:
+        conditions.append("language = ?")
+        params.append(language)
+    if before_id is not None:
+        conditions.append("telegram_id < ?")
+        params.append(before_id)
+        order = "DESC"
+    else:
+        conditions.append("telegram_id > ?")
+        params.append(after_id or 0)
+        order = "ASC"
+    rows = _get_conn().execute(
+        f"SELECT telegram_id, full_name, balance_cents / 100.0, language FROM users WHERE {' AND '.join(conditions)} "
+        f"ORDER BY telegram_id {order} LIMIT ?", (*params, limit)).fetchall()
+    return rows if order == "ASC" else rows[::-1]
+
+
+async def get_users_page(after_id: int | None = None, before_id: int | None = None, limit: int = 30,
+                         debtors_only: bool = False, language: str | None = None,
+                         family_ids: list[int] | None = None) -> list:
+    """
+    Fetches one page of user stats (telegram_id, full_name, debt, language) in telegram_id order,
+    using keyset pagination: rows after `after_id`, or the page just before `before_id`.
+    """
     try:
-        with sqlite3.connect(config.DB_FILE) as conn:
-            cursor = conn.cursor()
-            cursor.execute("UPDATE users SET debt = ? WHERE telegram_id = ?", (new_debt, user_id))
-            conn.commit()
-            return cursor.rowcount > 0 # Return True if update happened
+        return await _run(_get_users_page, after_id, before_id, limit, debtors_only, language, family_ids)
     except sqlite3.Error as e:
-        logging.error(f"DB Error updating debt for user {user_id}: {e}")
+        logging.error(f"DB Error fetching user stats page: {e}")
+        return []
+
+
+def _get_debtors_page(family_id: int, after_id: int, limit: int) -> list:
+    return _get_conn().execute(
+        "SELECT telegram_id, full_name, balance_cents / 100.0, language FROM users "
+        "WHERE family_id = ? AND telegram_id > ? AND balance_cents > 0 AND is_blocked = 0 ORDER BY telegram_id LIMIT ?",
+        (family_id, after_id, limit)).fetchall()
+
+
+async def iter_debtors(family_id: int, batch_size: int = 500):
+    """Streams a family's reachable debtors (id, name, debt, language) in telegram_id order, one batch per query."""
+    after_id = 0
+    while True:
+        try:
+            rows = await _run(_get_debtors_page, family_id, after_id, batch_size)
+        except sqlite3.Error as e:
+            logging.error(f"DB Error fetching debtors after {after_id}: {e}")
+            return
+        for row in rows:
+            yield row
+        if len(rows) < batch_size:
+            return
+        after_id = rows[-1][0]
+
+
+def _mark_user_blocked(user_id: int):
+    conn = _get_conn()
+    with conn:
+        conn.execute("UPDATE users SET is_blocked = 1 WHERE telegram_id = ?", (user_id,))
+
+
+async def mark_user_blocked(user_id: int):
+    """Flags a user who blocked the bot so broadcasts skip them."""
+    try:
+        await _run(_mark_user_blocked, user_id)
+    except sqlite3.Error as e:
+        logging.error(f"DB Error marking user {user_id} as blocked: {e}")
+
+
+def _set_spotify_member(user_id: int, position: int | None) -> bool:
+    conn = _get_conn()
+    with conn:
+        cursor = conn.execute("UPDATE users SET spotify_member = ? WHERE telegram_id = ? "
+                              "AND (? IS NULL OR family_id = ?)", (position, user_id, position, config.SPOTIFY_FAMILY_ID))
+    return cursor.rowcount > 0
+
+
+async def set_spotify_member(user_id: int, position: int | None) -> bool:
+    """
+    Maps a user to a member position in the Spotify family list (None unmaps).
+    False if the user is unknown, not in SPOTIFY_FAMILY_ID, or the position is taken.
+    """
+    try:
+        return await _run(_set_spotify_member, user_id, position)
+    except sqlite3.Error as e:
+        logging.error(f"DB Error setting Spotify member of user {user_id}: {e}")
         return False
 
-def get_all_users_stats() -> list:
-    """Fetches stats for all users."""
+# --- Payment Operations ---
+def _add_payment_record(user_id: int, image_path: str, sha256: str | None, file_unique_id: str | None,
+                        duplicate_of: int | None):
+    conn = _get_conn()
+    with conn:
+        now = datetime.now().isoformat()
+        cursor = conn.execute("INSERT INTO payments (user_id, image_path, timestamp, sha256, file_unique_id, duplicate_of) "
+                              "VALUES (?, ?, ?, ?, ?, ?)",
+                              (user_id, image_path, now, sha256, file_unique_id, duplicate_of))
+        # A payment settles the outstanding balance (a resent old receipt doesn't count)
+        if duplicate_of is None:
+            conn.execute("INSERT INTO ledger (user_id, kind, amount_cents, payment_id, created_at) "
+                         "SELECT telegram_id, 'payment', -balance_cents, ?, ? FROM users "
+                         "WHERE telegram_id = ? AND balance_cents > 0",
+                         (cursor.lastrowid, now, user_id))
+        row = conn.execute("SELECT balance_cents FROM users WHERE telegram_id = ?", (user_id,)).fetchone()
+    return row[0] / 100.0 if row else None
+
+
+async def add_payment_record(user_id: int, image_path: str, sha256: str | None = None,
+                             file_unique_id: str | None = None, duplicate_of: int | None = None):
+    """Adds a payment record and settles the user's balance, unless the receipt duplicates an earlier payment."""
+    try:
+        balance = await _run(_add_payment_record, user_id, image_path, sha256, file_unique_id, duplicate_of)
+        if balance is not None:
+            profile_cache.update(user_id, debt=balance)
+        return True
+    except sqlite3.Error as e:
+        logging.error(f"DB Error adding payment for user {user_id}: {e}")
+        return False
+
+
+def _find_payment_by_file_unique_id(file_unique_id: str) -> tuple[int, str] | None:
+    return _get_conn().execute("SELECT id, sha256 FROM payments WHERE file_unique_id = ? AND sha256 IS NOT NULL "
+                               "ORDER BY id LIMIT 1", (file_unique_id,)).fetchone()
+
+
+async def find_payment_by_file_unique_id(file_unique_id: str) -> tuple[int, str] | None:
+    """Finds the first payment (id, sha256) made with this Telegram file."""
+    try:
+        return await _run(_find_payment_by_file_unique_id, file_unique_id)
+    except sqlite3.Error as e:
+        logging.error(f"DB Error looking up receipt {file_unique_id}: {e}")
+        return None
+
+
+def _find_payment_by_sha256(sha256: str) -> int | None:
+    row = _get_conn().execute("SELECT id FROM payments WHERE sha256 = ? ORDER BY id LIMIT 1", (sha256,)).fetchone()
+    return row[0] if row else None
+
+
+async def find_payment_by_sha256(sha256: str) -> int | None:
+    """Finds the id of the first payment whose receipt has this content hash."""
     try:
-        with sqlite3.connect(config.DB_FILE) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT telegram_id, full_name, debt, language FROM users")
-            return cursor.fetchall()
+        return await _run(_find_payment_by_sha256, sha256)
     except sqlite3.Error as e:
-        logging.error(f"DB Error fetching all user stats: {e}")
+        logging.error(f"DB Error looking up receipt hash {sha256}: {e}")
+        return None
+
+
+def _get_recent_payments(limit: int, family_ids: list[int] | None) -> list:
+    query = ("SELECT p.id, p.user_id, u.full_name, p.timestamp, p.duplicate_of FROM payments p "
+             "LEFT JOIN users u ON u.telegram_id = p.user_id")
+    params: list = []
+    if family_ids is not None:
+        query += f" WHERE u.family_id IN ({','.join('?' * len(family_ids))})"
+        params.extend(family_ids)
+    query += " ORDER BY p.id DESC LIMIT ?"
+    return _get_conn().execute(query, (*params, limit)).fetchall()
+
+
+async def get_recent_payments(limit: int = 20, family_ids: list[int] | None = None) -> list:
+    """Fetches the latest payments (id, user_id, full_name, timestamp, duplicate_of), optionally per family."""
+    try:
+        return await _run(_get_recent_payments, limit, family_ids)
+    except sqlite3.Error as e:
+        logging.error(f"DB Error fetching recent payments: {e}")
         return []
 
-def get_users_for_notification() -> list:
-    """Fetches all users (id, name, debt) for notifications."""
+
+# --- Ledger ---
+def _accrue_monthly_charges(family_id: int, today: date) -> tuple[str, int]:
+    conn = _get_conn()
+    row = conn.execute("SELECT billing_day FROM families WHERE id = ?", (family_id,)).fetchone()
+    if row is None:
+        return "", 0
+    period = billing_period(row[0], today)
+    with conn:
+        # One statement for the whole family; the unique (user_id, period) index makes re-runs no-ops
+        cursor = conn.execute("INSERT OR IGNORE INTO ledger (user_id, kind, amount_cents, period, note, created_at) "
+                              "SELECT u.telegram_id, 'charge', CAST(ROUND(f.price * 100) AS INTEGER), ?, 'monthly', ? "
+                              "FROM users u JOIN families f ON f.id = u.family_id "
+                              "WHERE u.family_id = ? AND f.price > 0",
+                              (period, datetime.now().isoformat(), family_id))
+    return period, cursor.rowcount
+
+
+async def accrue_monthly_charges(family_id: int, today: date | None = None) -> int:
+    """Charges every member of a family for the current billing cycle. Returns the number of new charges."""
+    try:
+        period, charged = await _run(_accrue_monthly_charges, family_id, today or date.today())
+    except sqlite3.Error as e:
+        logging.error(f"DB Error accruing charges for family {family_id}: {e}")
+        raise
+    if charged:
+        profile_cache.clear() # Balances of the whole family changed
+    logging.info(f"Accrued {charged} charges for family {family_id}, period {period}.")
+    return charged
+
+
+def _get_ledger_entries(user_id: int, limit: int) -> list:
+    return _get_conn().execute("SELECT id, kind, amount_cents / 100.0, period, note, created_at FROM ledger "
+                               "WHERE user_id = ? ORDER BY id DESC LIMIT ?", (user_id, limit)).fetchall()
+
+
+async def get_ledger_entries(user_id: int, limit: int = 20) -> list:
+    """Fetches a user's latest ledger entries (id, kind, amount, period, note, created_at), newest first."""
     try:
-        with sqlite3.connect(config.DB_FILE) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT telegram_id, full_name, debt FROM users")
-            return cursor.fetchall()
+        return await _run(_get_ledger_entries, user_id, limit)
     except sqlite3.Error as e:
-        logging.error(f"DB Error fetching users for notification: {e}")
+        logging.error(f"DB Error fetching ledger for user {user_id}: {e}")
         return []
 
-def get_debtor_ids() -> list[int]:
-    """Fetches telegram_ids of users with debt > 0."""
+
+def _check_ledger_consistency(repair: bool) -> list:
+    conn = _get_conn()
+    drift = conn.execute("SELECT u.telegram_id, u.balance_cents, COALESCE(l.total, 0) FROM users u "
+                         "LEFT JOIN (SELECT user_id, SUM(amount_cents) AS total FROM ledger GROUP BY user_id) l "
+                         "ON l.user_id = u.telegram_id "
+                         "WHERE u.balance_cents != COALESCE(l.total, 0)").fetchall()
+    if drift and repair:
+        with conn:
+            conn.executemany("UPDATE users SET balance_cents = ? WHERE telegram_id = ?",
+                             [(total, telegram_id) for telegram_id, balance, total in drift])
+    return drift
+
+
+async def check_ledger_consistency(repair: bool = False) -> list | None:
+    """
+    Compares every materialized balance with the sum of the user's ledger entries.
+    Returns the drifted users as (telegram_id, balance_cents, ledger_cents); with repair=True
+    the balances are reset to the ledger sums. None on a DB error.
+    """
     try:
-        with sqlite3.connect(config.DB_FILE) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT telegram_id FROM users WHERE debt > 0")
-            return [row[0] for row in cursor.fetchall()]
+        drift = await _run(_check_ledger_consistency, repair)
     except sqlite3.Error as e:
-        logging.error(f"DB Error fetching debtor IDs: {e}")
+        logging.error(f"DB Error checking ledger consistency: {e}")
+        return None
+    if drift and repair:
+        profile_cache.clear()
+    return drift
+
+
+# --- Export ---
+# Exports read through their own read-only connections, on their own threads: a long export
+# neither queues behind nor holds up the shared connection, and each query reads one WAL
+# snapshot from start to end while writes carry on.
+_export_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="sqlite-export")
+
+
+def _payments_export_query(start: datetime | None, end: datetime | None, user_id: int | None,
+                           family_ids: list[int] | None) -> tuple[str, tuple]:
+    # payments drives the join, so rows come out of idx_payments_timestamp (or idx_payments_user)
+    # already in order: no temp b-tree, whatever the size of the range
+    join = "CROSS JOIN" if family_ids is not None else "LEFT JOIN"
+    query = ("SELECT p.id, p.timestamp, p.user_id, u.full_name, u.family_id, p.sha256, p.duplicate_of "
+             f"FROM payments p {join} users u ON u.telegram_id = p.user_id WHERE 1")
+    params: list = []
+    if start is not None:
+        query += " AND p.timestamp >= ?"
+        params.append(start.isoformat())
+    if end is not None:
+        query += " AND p.timestamp < ?"
+        params.append(end.isoformat())
+    if user_id is not None:
+        query += " AND p.user_id = ?"
+        params.append(user_id)
+    if family_ids is not None:
+        query += f" AND u.family_id IN ({','.join('?' * len(family_ids))})"
+        params.extend(family_ids)
+    return query + " ORDER BY p.timestamp, p.id", tuple(params)
+
+
+def _balances_export_query(user_id: int | None, family_ids: list[int] | None) -> tuple[str, tuple]:
+    query = ("SELECT telegram_id, full_name, family_id, language, printf('%.2f', balance_cents / 100.0), role, "
+             "is_blocked, spotify_member FROM users WHERE 1")
+    params: list = []
+    if user_id is not None:
+        query += " AND telegram_id = ?"
+        params.append(user_id)
+    if family_ids is not None:
+        query += f" AND family_id IN ({','.join('?' * len(family_ids))})"
+        params.extend(family_ids)
+    return query + " ORDER BY family_id, telegram_id", tuple(params)
+
+
+def _open_export_cursor(query: str, params: tuple) -> sqlite3.Cursor:
+    # Used by one export at a time, from whichever export thread picks up its next batch
+    conn = sqlite3.connect(f"file:{config.DB_FILE}?mode=ro", uri=True, check_same_thread=False)
+    try:
+        conn.execute("PRAGMA busy_timeout = 5000")
+        return conn.execute(query, params)
+    except BaseException:
+        conn.close()
+        raise
+
+
+async def _iter_export(query: str, params: tuple, batch_size: int) -> AsyncIterator[list[tuple]]:
+    loop = asyncio.get_running_loop()
+    cursor = await loop.run_in_executor(_export_executor, _open_export_cursor, query, params)
+    try:
+        while rows := await loop.run_in_executor(_export_executor, cursor.fetchmany, batch_size):
+            yield rows
+    finally:
+        await loop.run_in_executor(_export_executor, cursor.connection.close)
+
+
+def iter_payments_export(start: datetime | None = None, end: datetime | None = None, user_id: int | None = None,
+                         family_ids: list[int] | None = None, batch_size: int = 1000) -> AsyncIterator[list[tuple]]:
+    """
+    Streams payments (id, timestamp, user_id, full_name, family_id, sha256, duplicate_of) in time order,
+    `batch_size` rows at a time, from `start` (inclusive) to `end` (exclusive). Raises on DB errors.
+    """
+    return _iter_export(*_payments_export_query(start, end, user_id, family_ids), batch_size)
+
+
+def iter_balances_export(user_id: int | None = None, family_ids: list[int] | None = None,
+                         batch_size: int = 1000) -> AsyncIterator[list[tuple]]:
+    """
+    Streams users (telegram_id, full_name, family_id, language, balance, role, is_blocked, spotify_member)
+    by family, `batch_size` rows at a time. Raises on DB errors.
+    """
+    return _iter_export(*_balances_export_query(user_id, family_ids), batch_size)
+
+
+# --- Receipt Ingestion Jobs ---
+def _enqueue_receipt_job(user_id: int, chat_id: int, full_name: str, locale: str, file_id: str,
+                         file_unique_id: str) -> int:
+    now = datetime.now().isoformat()
+    conn = _get_conn()
+    with conn:
+        cursor = conn.execute("INSERT INTO receipt_jobs (user_id, chat_id, full_name, locale, file_id, file_unique_id, "
+                              "created_at, available_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                              (user_id, chat_id, full_name, locale, file_id, file_unique_id, now, now, now))
+    return cursor.lastrowid
+
+
+async def enqueue_receipt_job(user_id: int, chat_id: int, full_name: str, locale: str, file_id: str,
+                              file_unique_id: str) -> int | None:
+    """Persists a receipt to be ingested in the background and returns the job id."""
+    try:
+        return await _run(_enqueue_receipt_job, user_id, chat_id, full_name, locale, file_id, file_unique_id)
+    except sqlite3.Error as e:
+        logging.error(f"DB Error enqueuing receipt for user {user_id}: {e}")
+        return None
+
+
+def _claim_receipt_job(job_id: int) -> tuple | None:
+    conn = _get_conn()
+    with conn:
+        cursor = conn.execute("UPDATE receipt_jobs SET status = 'processing', attempts = attempts + 1, updated_at = ? "
+                              "WHERE id = ? AND status = 'pending'", (datetime.now().isoformat(), job_id))
+        if cursor.rowcount == 0:
+            return None # Already taken by another worker or process
+        return conn.execute("SELECT id, user_id, chat_id, full_name, locale, file_id, file_unique_id, attempts, "
+                            "created_at FROM receipt_jobs WHERE id = ?", (job_id,)).fetchone()
+
+
+async def claim_receipt_job(job_id: int) -> tuple | None:
+    """
+    Marks a pending job as processing and returns it
+    (id, user_id, chat_id, full_name, locale, file_id, file_unique_id, attempts, created_at),
+    or None if it isn't pending anymore.
+    """
+    try:
+        return await _run(_claim_receipt_job, job_id)
+    except sqlite3.Error as e:
+        logging.error(f"DB Error claiming receipt job {job_id}: {e}")
+        return None
+
+
+def _finish_receipt_job(job_id: int, status: str, error: str | None, available_at: str | None):
+    conn = _get_conn()
+    with conn:
+        conn.execute("UPDATE receipt_jobs SET status = ?, last_error = ?, available_at = COALESCE(?, available_at), "
+                     "updated_at = ? WHERE id = ?", (status, error, available_at, datetime.now().isoformat(), job_id))
+
+
+async def finish_receipt_job(job_id: int, status: str, error: str | None = None, retry_at: datetime | None = None):
+    """Sets a job's outcome: 'done', 'failed', or back to 'pending' until retry_at."""
+    try:
+        await _run(_finish_receipt_job, job_id, status, error, retry_at.isoformat() if retry_at else None)
+    except sqlite3.Error as e:
+        logging.error(f"DB Error updating receipt job {job_id}: {e}")
+
+
+def _get_due_receipt_job_ids(limit: int) -> list[int]:
+    return [row[0] for row in _get_conn().execute(
+        "SELECT id FROM receipt_jobs WHERE status = 'pending' AND available_at <= ? ORDER BY available_at LIMIT ?",
+        (datetime.now().isoformat(), limit))]
+
+
+async def get_due_receipt_job_ids(limit: int) -> list[int]:
+    """Fetches ids of pending jobs whose retry time has come, oldest first."""
+    try:
+        return await _run(_get_due_receipt_job_ids, limit)
+    except sqlite3.Error as e:
+        logging.error(f"DB Error fetching due receipt jobs: {e}")
         return []
 
-# --- Payment Operations ---
-def add_payment_record(user_id: int, image_path: str):
-    """Adds a payment record and resets user debt."""
-    try:
-        with sqlite3.connect(config.DB_FILE) as conn:
-            cursor = conn.cursor()
-            cursor.execute("INSERT INTO payments (user_id, image_path, timestamp) VALUES (?, ?, ?)",
-                           (user_id, image_path, datetime.now().isoformat()))
-            # Reset debt upon successful payment record insertion
-            cursor.execute("UPDATE users SET debt = 0.0 WHERE telegram_id = ?", (user_id,))
-            conn.commit()
-            return True
+
+def _requeue_stale_receipt_jobs(stale_before: str) -> int:
+    conn = _get_conn()
+    with conn:
+        cursor = conn.execute("UPDATE receipt_jobs SET status = 'pending' WHERE status = 'processing' AND updated_at < ?",
+                              (stale_before,))
+    return cursor.rowcount
+
+
+async def requeue_stale_receipt_jobs(stale_before: datetime) -> int:
+    """Returns jobs 'processing' since before stale_before (left by a crashed worker) to the pending state."""
+    try:
+        return await _run(_requeue_stale_receipt_jobs, stale_before.isoformat())
     except sqlite3.Error as e:
-        logging.error(f"DB Error adding payment for user {user_id}: {e}")
+        logging.error(f"DB Error requeuing stale receipt jobs: {e}")
+        return 0
+
+
+def _count_pending_receipt_jobs() -> int:
+    return _get_conn().execute("SELECT COUNT(*) FROM receipt_jobs WHERE status = 'pending'").fetchone()[0]
+
+
+async def count_pending_receipt_jobs() -> int:
+    try:
+        return await _run(_count_pending_receipt_jobs)
+    except sqlite3.Error as e:
+        logging.error(f"DB Error counting pending receipt jobs: {e}")
+        return 0
+
+
+# --- Receipt Archive ---
+def _get_payment(payment_id: int) -> tuple | None:
+    return _get_conn().execute("SELECT p.user_id, u.family_id, p.sha256, p.image_path, p.timestamp FROM payments p "
+                               "LEFT JOIN users u ON u.telegram_id = p.user_id WHERE p.id = ?", (payment_id,)).fetchone()
+
+
+async def get_payment(payment_id: int) -> tuple | None:
+    """Fetches a payment as (user_id, family_id, sha256, image_path, timestamp)."""
+    try:
+        return await _run(_get_payment, payment_id)
+    except sqlite3.Error as e:
+        logging.error(f"DB Error fetching payment {payment_id}: {e}")
+        return None
+
+
+def _get_unarchived_receipts(before: str, limit: int) -> list[tuple[str, str]]:
+    # A receipt is archived once every payment using it is old; it goes into the bundle of its first use
+    return _get_conn().execute(
+        "SELECT p.sha256, MIN(p.timestamp) AS first_used FROM payments p "
+        "WHERE p.sha256 IS NOT NULL AND NOT EXISTS (SELECT 1 FROM receipt_archive a WHERE a.sha256 = p.sha256) "
+        "GROUP BY p.sha256 HAVING MAX(p.timestamp) < ? ORDER BY first_used LIMIT ?", (before, limit)).fetchall()
+
+
+async def get_unarchived_receipts(before: datetime, limit: int) -> list[tuple[str, str]]:
+    """Receipts (sha256, first use timestamp) not archived yet and unused since `before`, oldest first. Raises on DB errors."""
+    return await _run(_get_unarchived_receipts, before.isoformat(), limit)
+
+
+def _add_archived_receipts(entries: list[tuple[str, str | None, int | None, int | None, int | None]]):
+    now = datetime.now().isoformat()
+    conn = _get_conn()
+    with conn:
+        conn.executemany("INSERT OR IGNORE INTO receipt_archive (sha256, bundle, offset, length, size, archived_at) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", ((*entry, now) for entry in entries))
+
+
+async def add_archived_receipts(entries: list[tuple[str, str | None, int | None, int | None, int | None]]):
+    """Indexes archived receipts as (sha256, bundle, offset, length, size). Raises on DB errors."""
+    await _run(_add_archived_receipts, entries)
+
+
+def _get_archived_receipt(sha256: str) -> tuple[str | None, int | None, int | None] | None:
+    return _get_conn().execute("SELECT bundle, offset, length FROM receipt_archive WHERE sha256 = ?",
+                               (sha256,)).fetchone()
+
+
+async def get_archived_receipt(sha256: str) -> tuple[str | None, int | None, int | None] | None:
+    """Finds where an archived receipt is: (bundle, offset, length), or None if it isn't archived."""
+    try:
+        return await _run(_get_archived_receipt, sha256)
+    except sqlite3.Error as e:
+        logging.error(f"DB Error looking up archived receipt {sha256}: {e}")
+        return None
+
+
+def _drop_archive_bundles(before_bundle: str) -> int:
+    conn = _get_conn()
+    with conn:
+        cursor = conn.execute("DELETE FROM receipt_archive WHERE bundle < ?", (before_bundle,))
+    return cursor.rowcount
+
+
+async def drop_archive_bundles(before_bundle: str) -> int:
+    """Forgets every receipt in bundles named before `before_bundle` ("YYYY-MM"). Raises on DB errors."""
+    return await _run(_drop_archive_bundles, before_bundle)
+
+
+# --- Explicit Content Enforcement ---
+def _plan_enforcement(family_id: int, restore_only: bool) -> int:
+    now = datetime.now().isoformat()
+    conn = _get_conn()
+    with conn:
+        # Open actions the balance no longer calls for (the user paid or fell behind again, or was remapped)
+        conn.execute("UPDATE enforcement_actions SET status = 'superseded', updated_at = ? "
+                     "WHERE family_id = ? AND status = 'pending' AND NOT EXISTS ("
+                     "SELECT 1 FROM users u WHERE u.telegram_id = enforcement_actions.user_id "
+                     "AND u.family_id = enforcement_actions.family_id "
+                     "AND u.spotify_member = enforcement_actions.spotify_member "
+                     "AND (u.balance_cents <= 0) = enforcement_actions.allow_explicit)", (now, family_id))
+        # Mapped members whose desired state (explicit allowed unless in debt) differs from the last applied
+        # one; restore runs only look for paid-up members we blocked, or whose state was never applied
+        if restore_only:
+            condition = ("u.balance_cents <= 0 AND (s.user_id IS NULL "
+                         "OR s.allow_explicit = 0 AND s.spotify_member = u.spotify_member)")
+        else:
+            condition = ("s.user_id IS NULL OR s.spotify_member != u.spotify_member "
+                         "OR s.allow_explicit != (u.balance_cents <= 0)")
+        cursor = conn.execute("INSERT INTO enforcement_actions (user_id, family_id, spotify_member, allow_explicit, "
+                              "created_at, updated_at) "
+                              "SELECT u.telegram_id, u.family_id, u.spotify_member, u.balance_cents <= 0, ?, ? "
+                              "FROM users u LEFT JOIN enforcement_state s ON s.user_id = u.telegram_id "
+                              f"WHERE u.family_id = ? AND u.spotify_member IS NOT NULL AND ({condition}) "
+                              "ON CONFLICT (user_id) WHERE status = 'pending' DO NOTHING",
+                              (now, now, family_id))
+    return cursor.rowcount
+
+
+async def plan_enforcement(family_id: int, restore_only: bool = False) -> int:
+    """
+    Records a pending action for every mapped member of a family whose explicit-content state has to change,
+    and supersedes pending actions that are no longer wanted. Returns the number of new actions.
+    Raises on DB errors, so the scheduled job is recorded as failed.
+    """
+    return await _run(_plan_enforcement, family_id, restore_only)
+
+
+def _get_pending_enforcement_actions(family_id: int, restore_only: bool) -> list[tuple[int, int, int, int]]:
+    query = ("SELECT id, user_id, spotify_member, allow_explicit FROM enforcement_actions "
+             "WHERE family_id = ? AND status = 'pending'")
+    if restore_only:
+        query += " AND allow_explicit = 1"
+    return _get_conn().execute(query + " ORDER BY id", (family_id,)).fetchall()
+
+
+async def get_pending_enforcement_actions(family_id: int, restore_only: bool = False) -> list[tuple[int, int, int, int]]:
+    """Fetches a family's open actions as (id, user_id, spotify_member, allow_explicit), oldest first. Raises on DB errors."""
+    return await _run(_get_pending_enforcement_actions, family_id, restore_only)
+
+
+def _complete_enforcement_actions(actions: list[tuple[int, int, int, int]]):
+    now = datetime.now().isoformat()
+    conn = _get_conn()
+    with conn:
+        for action_id, user_id, spotify_member, allow_explicit in actions:
+            cursor = conn.execute("UPDATE enforcement_actions SET status = 'done', attempts = attempts + 1, "
+                                  "last_error = NULL, updated_at = ? WHERE id = ? AND status = 'pending'",
+                                  (now, action_id))
+            if cursor.rowcount:
+                conn.execute("INSERT INTO enforcement_state (user_id, spotify_member, allow_explicit, applied_at) "
+                             "VALUES (?, ?, ?, ?) ON CONFLICT (user_id) DO UPDATE SET "
+                             "spotify_member = excluded.spotify_member, allow_explicit = excluded.allow_explicit, "
+                             "applied_at = excluded.applied_at", (user_id, spotify_member, allow_explicit, now))
+
+
+async def complete_enforcement_actions(actions: list[tuple[int, int, int, int]]):
+    """Marks applied actions done and records the state they set. Raises on DB errors."""
+    await _run(_complete_enforcement_actions, actions)
+
+
+def _fail_enforcement_actions(action_ids: list[int], error: str):
+    now = datetime.now().isoformat()
+    conn = _get_conn()
+    with conn:
+        conn.executemany("UPDATE enforcement_actions SET attempts = attempts + 1, last_error = ?, updated_at = ? "
+                         "WHERE id = ? AND status = 'pending'", ((error, now, action_id) for action_id in action_ids))
+
+
+async def fail_enforcement_actions(action_ids: list[int], error: str):
+    """Records a failed attempt; the actions stay pending and are retried by the next run."""
+    try:
+        await _run(_fail_enforcement_actions, action_ids, error)
+    except sqlite3.Error as e:
+        logging.error(f"DB Error recording failed enforcement actions {action_ids}: {e}")
+
+
+def _get_enforcement_overview(family_id: int) -> list[tuple]:
+    return _get_conn().execute(
+        "SELECT u.telegram_id, u.full_name, u.spotify_member, u.balance_cents / 100.0, s.allow_explicit, s.applied_at, "
+        "a.allow_explicit, a.attempts, a.last_error FROM users u "
+        "LEFT JOIN enforcement_state s ON s.user_id = u.telegram_id "
+        "LEFT JOIN enforcement_actions a ON a.user_id = u.telegram_id AND a.status = 'pending' "
+        "WHERE u.family_id = ? AND u.spotify_member IS NOT NULL ORDER BY u.spotify_member", (family_id,)).fetchall()
+
+
+async def get_enforcement_overview(family_id: int) -> list[tuple]:
+    """
+    A family's mapped members as (telegram_id, name, member, debt, applied allow_explicit, applied_at,
+    pending allow_explicit, attempts, last_error); the applied and pending columns are None if there are none.
+    """
+    try:
+        return await _run(_get_enforcement_overview, family_id)
+    except sqlite3.Error as e:
+        logging.error(f"DB Error fetching enforcement overview for family {family_id}: {e}")
+        return []
+
+
+# --- Leases ---
+def _acquire_lease(name: str, holder: str, ttl: float) -> bool:
+    now = time.time()
+    conn = _get_conn()
+    with conn:
+        # Atomic across processes: takes a free or expired lease, or extends our own
+        cursor = conn.execute("INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+                              "ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+                              "WHERE leases.holder = excluded.holder OR leases.expires_at < ?",
+                              (name, holder, now + ttl, now))
+    return cursor.rowcount > 0
+
+
+async def acquire_lease(name: str, holder: str, ttl: float) -> bool:
+    """Acquires or renews a lease for ttl seconds. Returns False if another holder has it (or on a DB error)."""
+    try:
+        return await _run(_acquire_lease, name, holder, ttl)
+    except sqlite3.Error as e:
+        logging.error(f"DB Error acquiring lease {name}: {e}")
         return False
+
+
+def _release_lease(name: str, holder: str):
+    conn = _get_conn()
+    with conn:
+        conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+
+
+async def release_lease(name: str, holder: str):
+    """Gives up a lease early so another process can take over without waiting for it to expire."""
+    try:
+        await _run(_release_lease, name, holder)
+    except sqlite3.Error as e:
+        logging.error(f"DB Error releasing lease {name}: {e}")
+
+
+def _get_lease(name: str) -> tuple[str, float] | None:
+    return _get_conn().execute("SELECT holder, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+
+
+async def get_lease(name: str) -> tuple[str, float] | None:
+    """Fetches a lease's (holder, expires_at unix time), or None if nobody holds it."""
+    try:
+        return await _run(_get_lease, name)
+    except sqlite3.Error as e:
+        logging.error(f"DB Error fetching lease {name}: {e}")
+        return None
+
+
+# --- Profile Cache Sync ---
+# Each process has its own profile cache (user_cache.py). Edits made by any process are logged
+# in profile_changes by a trigger, and every process polls the log and evicts what changed, so
+# another process serves a stale profile for at most USER_CACHE_SYNC_INTERVAL seconds.
+def _get_last_profile_change() -> int:
+    return _get_conn().execute("SELECT COALESCE(MAX(seq), 0) FROM profile_changes").fetchone()[0]
+
+
+def _get_profile_changes(after_seq: int, limit: int) -> list[tuple[int, int]]:
+    return _get_conn().execute("SELECT seq, telegram_id FROM profile_changes WHERE seq > ? ORDER BY seq LIMIT ?",
+                               (after_seq, limit)).fetchall()
+
+
+async def get_profile_changes(after_seq: int, limit: int = 1000) -> list[tuple[int, int]]:
+    """Profile edits (seq, telegram_id) logged after `after_seq`, oldest first. Raises on DB errors."""
+    return await _run(_get_profile_changes, after_seq, limit)
+
+
+async def sync_profile_cache(interval: float = config.USER_CACHE_SYNC_INTERVAL):
+    """Runs forever, evicting cached profiles that any process (this one included) has changed."""
+    last_seq = await _run(_get_last_profile_change)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            while changes := await get_profile_changes(last_seq):
+                if changes[0][0] != last_seq + 1:
+                    # Entries we hadn't seen yet were pruned: whatever they were, forget everything
+                    logging.warning(f"Missed profile changes after #{last_seq}, clearing the profile cache.")
+                    profile_cache.clear()
+                for _seq, telegram_id in changes:
+                    profile_cache.invalidate(telegram_id)
+                last_seq = changes[-1][0]
+        except sqlite3.Error as e:
+            logging.error(f"DB Error reading profile changes after #{last_seq}: {e}")
+
+
+def _prune_profile_changes(max_age: float) -> int:
+    conn = _get_conn()
+    with conn:
+        return conn.execute("DELETE FROM profile_changes WHERE changed_at < datetime('now', ?)",
+                            (f"-{int(max_age)} seconds",)).rowcount
+
+
+async def prune_profile_changes(max_age: float = config.PROFILE_CHANGES_RETENTION):
+    """Deletes profile change entries older than max_age seconds. Raises on DB errors."""
+    deleted = await _run(_prune_profile_changes, max_age)
+    logging.info(f"Pruned {deleted} profile change entries.")
+
+
+# --- Scheduled Jobs ---
+def _add_scheduled_job(name: str, kind: str, family_id: int | None, next_run_at: str) -> bool:
+    conn = _get_conn()
+    with conn:
+        cursor = conn.execute("INSERT OR IGNORE INTO scheduled_jobs (name, kind, family_id, next_run_at) "
+                              "VALUES (?, ?, ?, ?)", (name, kind, family_id, next_run_at))
+    return cursor.rowcount > 0
+
+
+async def add_scheduled_job(name: str, kind: str, family_id: int | None, next_run_at: datetime) -> bool:
+    """Registers a job unless it already exists (an existing job keeps its persisted schedule)."""
+    try:
+        return await _run(_add_scheduled_job, name, kind, family_id, next_run_at.isoformat())
+    except sqlite3.Error as e:
+        logging.error(f"DB Error adding scheduled job {name}: {e}")
+        return False
+
+
+def _get_scheduled_jobs() -> list:
+    return _get_conn().execute(
+        "SELECT j.name, j.kind, j.family_id, f.billing_day, j.next_run_at, j.last_run_at, j.last_status, j.last_error "
+        "FROM scheduled_jobs j LEFT JOIN families f ON f.id = j.family_id ORDER BY j.next_run_at"
+    ).fetchall()
+
+
+def _delete_scheduled_job(name: str):
+    conn = _get_conn()
+    with conn:
+        conn.execute("DELETE FROM scheduled_jobs WHERE name = ?", (name,))
+
+
+async def delete_scheduled_job(name: str):
+    """Removes a job that no longer applies."""
+    try:
+        await _run(_delete_scheduled_job, name)
+    except sqlite3.Error as e:
+        logging.error(f"DB Error deleting scheduled job {name}: {e}")
+
+
+async def get_scheduled_jobs() -> list:
+    """
+    Fetches all jobs (name, kind, family_id, billing_day, next_run_at, last_run_at, last_status, last_error);
+    family_id and billing_day are None for global jobs.
+    """
+    try:
+        return await _run(_get_scheduled_jobs)
+    except sqlite3.Error as e:
+        logging.error(f"DB Error fetching scheduled jobs: {e}")
+        return []
+
+
+def _record_job_run(name: str, ran_at: str, status: str, error: str | None, next_run_at: str):
+    conn = _get_conn()
+    with conn:
+        conn.execute("UPDATE scheduled_jobs SET last_run_at = ?, last_status = ?, last_error = ?, next_run_at = ? "
+                     "WHERE name = ?", (ran_at, status, error, next_run_at, name))
+
+
+async def record_job_run(name: str, ran_at: datetime, status: str, error: str | None, next_run_at: datetime):
+    """Stores a job's last-run outcome together with its next due time."""
+    try:
+        await _run(_record_job_run, name, ran_at.isoformat(), status, error, next_run_at.isoformat())
+    except sqlite3.Error as e:
+        logging.error(f"DB Error recording run of job {name}: {e}")
+
+
+# --- Family Operations ---
+def _add_family(name: str, billing_day: int, price: float) -> int:
+    conn = _get_conn()
+    with conn:
+        cursor = conn.execute("INSERT INTO families (name, billing_day, price) VALUES (?, ?, ?)",
+                              (name, billing_day, price))
+    return cursor.lastrowid
+
+
+async def add_family(name: str, billing_day: int, price: float) -> int | None:
+    """Creates a family plan and returns its id."""
+    try:
+        return await _run(_add_family, name, billing_day, price)
+    except sqlite3.Error as e:
+        logging.error(f"DB Error adding family {name}: {e}")
+        return None
+
+
+def _get_families() -> list:
+    return _get_conn().execute("SELECT f.id, f.name, f.billing_day, f.price, "
+                               "(SELECT COUNT(*) FROM users u WHERE u.family_id = f.id) "
+                               "FROM families f ORDER BY f.id").fetchall()
+
+
+async def get_families() -> list:
+    """Fetches all families (id, name, billing_day, price, member_count)."""
+    try:
+        return await _run(_get_families)
+    except sqlite3.Error as e:
+        logging.error(f"DB Error fetching families: {e}")
+        return []
+
+
+def _set_user_family(user_id: int, family_id: int) -> bool:
+    conn = _get_conn()
+    with conn:
+        # Leaving the Spotify account's family frees the member's position
+        cursor = conn.execute("UPDATE users SET family_id = ?, "
+                              "spotify_member = CASE WHEN ? = ? THEN spotify_member END WHERE telegram_id = ? "
+                              "AND EXISTS (SELECT 1 FROM families WHERE id = ?)",
+                              (family_id, family_id, config.SPOTIFY_FAMILY_ID, user_id, family_id))
+    return cursor.rowcount > 0
+
+
+async def set_user_family(user_id: int, family_id: int) -> bool:
+    """Moves a user into a family. Returns False if the user or family doesn't exist."""
+    try:
+        updated = await _run(_set_user_family, user_id, family_id)
+    except sqlite3.Error as e:
+        logging.error(f"DB Error moving user {user_id} to family {family_id}: {e}")
+        return False
+    if updated:
+        profile_cache.update(user_id, family_id=family_id)
+    return updated
+
+
+def _add_family_admin(family_id: int, user_id: int):
+    conn = _get_conn()
+    with conn:
+        conn.execute("INSERT OR IGNORE INTO family_admins (family_id, telegram_id) VALUES (?, ?)", (family_id, user_id))
+
+
+async def add_family_admin(family_id: int, user_id: int) -> bool:
+    """Makes a user an admin of a family."""
+    try:
+        await _run(_add_family_admin, family_id, user_id)
+        return True
+    except sqlite3.Error as e:
+        logging.error(f"DB Error adding admin {user_id} to family {family_id}: {e}")
+        return False
+
+
+def _get_admin_family_ids(user_id: int) -> list[int]:
+    return [row[0] for row in _get_conn().execute("SELECT family_id FROM family_admins WHERE telegram_id = ?",
+                                                  (user_id,))]
+
+
+async def get_admin_family_ids(user_id: int) -> list[int]:
+    """Fetches ids of the families a user administers."""
+    try:
+        return await _run(_get_admin_family_ids, user_id)
+    except sqlite3.Error as e:
+        logging.error(f"DB Error fetching administered families for {user_id}: {e}")
+        return []
+
+
+def _get_family_admin_ids(family_id: int) -> list[int]:
+    return [row[0] for row in _get_conn().execute("SELECT telegram_id FROM family_admins WHERE family_id = ?",
+                                                  (family_id,))]
+
+
+async def get_family_admin_ids(family_id: int) -> list[int]:
+    """Fetches telegram_ids of a family's admins."""
+    try:
+        return await _run(_get_family_admin_ids, family_id)
+    except sqlite3.Error as e:
+        logging.error(f"DB Error fetching admins of family {family_id}: {e}")
+        return []
@@ -0,0 +1,66 @@
+# exports.py
+import asyncio
+import csv
+import gzip
+import os
+import tempfile
+from contextlib import aclosing
+from datetime import date, datetime, timedelta
+from typing import AsyncIterator, NamedTuple
+
+import config
+import database
+
+PAYMENT_COLUMNS = ("payment_id", "timestamp", "telegram_id", "full_name", "family_id", "sha256", "duplicate_of")
+BALANCE_COLUMNS = ("telegram_id", "full_name", "family_id", "language", "balance", "role", "is_blocked",
+                   "spotify_member")
+
+
+class Export(NamedTuple):
+    path: str # Temporary file, removed by the caller once sent
+    filename: str # Name to send it under
+    rows: int
+    size: int # Bytes on disk
+
+
+async def write_csv(batches: AsyncIterator[list[tuple]], columns: tuple[str, ...], name: str,
+                    compress: bool = False) -> Export:
+    """
+    Writes row batches to a temporary CSV file, gzipped if `compress`, as they arrive: only one
+    batch is ever in memory, however many rows there are. UTF-8 with a BOM, so spreadsheets
+    read non-Latin names correctly.
+    """
+    suffix = ".csv.gz" if compress else ".csv"
+    fd, path = tempfile.mkstemp(prefix="export-", suffix=suffix)
+    os.close(fd)
+    rows = 0
+    try:
+        opener = gzip.open if compress else open
+        with opener(path, "wt", encoding="utf-8-sig", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            async with aclosing(batches): # Ends the query (and its snapshot) if writing fails
+                async for batch in batches:
+                    await asyncio.to_thread(writer.writerows, batch)
+                    rows += len(batch)
+    except BaseException:
+        os.remove(path)
+        raise
+    return Export(path, f"{name}-{date.today().isoformat()}{suffix}", rows, os.path.getsize(path))
+
+
+async def export_payments(start: date | None = None, end: date | None = None, user_id: int | None = None,
+                          family_ids: list[int] | None = None, compress: bool = False) -> Export:
+    """Payments from `start` to `end` (both inclusive), optionally of one user, as a CSV file. Raises on DB errors."""
+    batches = database.iter_payments_export(
+        datetime.combine(start, datetime.min.time()) if start else None,
+        datetime.combine(end + timedelta(days=1), datetime.min.time()) if end else None,
+        user_id, family_ids, config.EXPORT_BATCH_SIZE)
+    return await write_csv(batches, PAYMENT_COLUMNS, "payments", compress)
+
+
+async def export_balances(user_id: int | None = None, family_ids: list[int] | None = None,
+                          compress: bool = False) -> Export:
+    """Current balances of all users (or one), as a CSV file. Raises on DB errors."""
+    batches = database.iter_balances_export(user_id, family_ids, config.EXPORT_BATCH_SIZE)
+    return await write_csv(batches, BALANCE_COLUMNS, "balances", compress)
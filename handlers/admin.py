@@ -1,78 +1,623 @@
+import csv
+import io
 import logging
+import os
+import sqlite3
+import time
+from datetime import date
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from typing import Iterable
 
-from aiogram import Router, Bot
-from aiogram.filters import Command
-from aiogram.types import Message
+from aiogram import F, Router, Bot
+from aiogram.filters import Command, CommandObject
+from aiogram.types import BufferedInputFile, CallbackQuery, FSInputFile, InlineKeyboardMarkup, Message
 
 import config
 import database
-from handlers.common import show_main_menu_options
-from localization import _
+import exports
+import keyboards
+import metrics
+import receipts
+import scheduler
+import script
+from broadcast import broadcast
+from ingestion import ReceiptIngestion
+from keyboards import StatsPage
+from localization import _, available_locales, reload_catalogs
+from responses import Reply
+from user_cache import profile_cache
 
 admin_router = Router()
 
 
 async def is_admin(user_id: int) -> bool:
-    """Checks if a user ID is in the configured admin list."""
+    """Checks if a user ID is in the configured admin list (admins of every family)."""
     return user_id in config.ADMIN_IDS
 
+
+async def get_admin_scope(user_id: int) -> list[int] | None:
+    """
+    Returns the family ids a user may administer: None for global admins (all families),
+    the administered families for family admins, and an empty list for everyone else.
+    """
+    if await is_admin(user_id):
+        return None
+    return await database.get_admin_family_ids(user_id)
+
+
+async def render_stats_page(page: StatsPage, scope: list[int] | None) -> tuple[str, InlineKeyboardMarkup | None]:
+    """Builds one /admin_stats page: a single indexed query for page_size + 1 rows."""
+    family_ids = scope
+    if page.family:
+        family_ids = [page.family] if scope is None or page.family in scope else []
+    page_size = config.ADMIN_STATS_PAGE_SIZE
+    rows = await database.get_users_page(after_id=page.after or None, before_id=page.before or None,
+                                         limit=page_size + 1, debtors_only=page.debtors,
+                                         language=page.lang or None, family_ids=family_ids)
+    # The extra row only tells us whether there is another page in the direction we moved
+    has_more = len(rows) > page_size
+    if page.before:
+        rows = rows[-page_size:]
+        has_prev, has_next = has_more, True
+    else:
+        rows = rows[:page_size]
+        has_prev, has_next = bool(page.after), has_more
+
+    if not rows:
+        return _("No users found in the database."), None
+
+    text_lines = [_("User stats:")]
+    for user_tg_id, name, debt, lang in rows:
+        text_lines.append(f"{name or 'N/A'} (ID: {user_tg_id}, Lang: {lang}) - Debt: ${debt:.2f}")
+    keyboard = keyboards.get_stats_pagination_keyboard(page, rows[0][0], rows[-1][0], has_prev, has_next)
+    return "\n".join(text_lines), keyboard
+
+
 @admin_router.message(Command("admin_stats"))
-async def admin_view_stats(message: Message):
+async def admin_view_stats(message: Message, command: CommandObject):
     user_id = message.from_user.id
-    if not await is_admin(user_id):
-        await message.answer(_("You are not authorized to use this command.", user_id=user_id))
+    scope = await get_admin_scope(user_id)
+    if scope == []:
+        await message.answer(_("You are not authorized to use this command."))
         return
 
-    users_data = database.get_all_users_stats()
+    # Filters: /admin_stats [debtors] [lang=<code>] [family=<id>]
+    page = StatsPage()
+    for arg in (command.args or "").split():
+        key, _sep, value = arg.partition("=")
+        if key == "debtors":
+            page.debtors = True
+        elif key == "lang" and value in available_locales():
+            page.lang = value # Also keeps the callback data packable (no ':' and short)
+        elif key == "family" and value.isdigit():
+            page.family = int(value)
+        else:
+            await message.answer(_("Usage: /admin_stats [debtors] [lang=<code>] [family=<id>]"))
+            return
+
+    text, keyboard = await render_stats_page(page, scope)
+    await message.answer(text, reply_markup=keyboard, parse_mode=None)
+
 
-    if not users_data:
-        await message.answer(_("No users found in the database.", user_id=user_id))
+@admin_router.callback_query(StatsPage.filter())
+async def admin_stats_page(callback: CallbackQuery, callback_data: StatsPage):
+    scope = await get_admin_scope(callback.from_user.id)
+    if scope == []:
+        await callback.answer(_("You are not authorized to use this command."), show_alert=True)
         return
 
-    text_lines = [_("User stats:", user_id=user_id)]
-    for user_tg_id, name, debt, lang in users_data:
-        text_lines.append(f"{name or 'N/A'} (ID: {user_tg_id}, Lang: {lang}) - Debt: ${debt:.2f}")
+    text, keyboard = await render_stats_page(callback_data, scope)
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode=None)
+    await callback.answer()
+
+MAX_AMOUNT = Decimal(1_000_000) # Largest debt or family price an admin can type, in dollars
+
+
+def parse_amount(text: str) -> Decimal | None:
+    """Parses a dollar amount rounded to cents. Returns None unless it is finite and within +-MAX_AMOUNT."""
+    try:
+        amount = Decimal(text.strip())
+    except InvalidOperation:
+        return None
+    if not amount.is_finite() or abs(amount) > MAX_AMOUNT:
+        return None
+    return amount.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+
+
+def parse_debt_csv(lines: Iterable[str], max_rows: int) -> tuple[list[tuple[int, int]], list[tuple[int, str]]]:
+    """
+    Validates telegram_id,amount rows in one pass. Returns (debts as (telegram_id, cents),
+    rejected rows as (line number, reason)). A header line is allowed.
+    """
+    debts: dict[int, int] = {}
+    rejected: list[tuple[int, str]] = []
+    for line_no, row in enumerate(csv.reader(lines), start=1):
+        if not row or not "".join(row).strip():
+            continue
+        if line_no == 1 and not row[0].strip().lstrip("-").isdigit():
+            continue # Header
+        if len(debts) + len(rejected) >= max_rows:
+            rejected.append((line_no, f"more than {max_rows} rows"))
+            break
+        if len(row) != 2:
+            rejected.append((line_no, "expected telegram_id,amount"))
+            continue
+        try:
+            user_id = int(row[0])
+            amount = Decimal(row[1].strip())
+        except (ValueError, InvalidOperation):
+            rejected.append((line_no, "not a number"))
+            continue
+        if not amount.is_finite() or amount.as_tuple().exponent < -2:
+            rejected.append((line_no, "amount must have at most 2 decimals"))
+        elif abs(amount) > MAX_AMOUNT:
+            rejected.append((line_no, f"amount out of range (max {MAX_AMOUNT})"))
+        elif user_id in debts:
+            rejected.append((line_no, f"duplicate user {user_id}"))
+        else:
+            debts[user_id] = int(amount * 100)
+    return list(debts.items()), rejected
+
+
+@admin_router.message(Command("update_debt"), F.document)
+async def bulk_update_debt(message: Message, bot: Bot):
+    """/update_debt as the caption of a CSV document: sets every listed balance in one transaction."""
+    scope = await get_admin_scope(message.from_user.id)
+    if scope == []:
+        await message.answer(_("You are not authorized to use this command."))
+        return
+
+    if (message.document.file_size or 0) > config.BULK_DEBT_MAX_BYTES:
+        await message.answer(_("The file is too large."))
+        return
+
+    buffer = io.BytesIO()
+    await bot.download(message.document, destination=buffer)
+    buffer.seek(0)
+    try:
+        debts, rejected = parse_debt_csv(io.TextIOWrapper(buffer, encoding="utf-8-sig", newline=""),
+                                         config.BULK_DEBT_MAX_ROWS)
+    except UnicodeDecodeError:
+        await message.answer(_("Could not read the file. Please upload a UTF-8 CSV of telegram_id,amount rows."))
+        return
+
+    if not rejected:
+        result = await database.bulk_update_debts(debts, scope, f"bulk update by admin {message.from_user.id}")
+        if result is None:
+            await message.answer(_("An unexpected error occurred."))
+            return
+        changed, unknown = result
+        rejected = [(0, f"user {user_id} not found") for user_id in unknown]
+
+    if rejected:
+        text_lines = [_("Nothing was applied: {count} rows were rejected.").format(count=len(rejected))]
+        for line_no, reason in rejected[:30]:
+            text_lines.append(f"{line_no or '-'}: {reason}")
+        await message.answer("\n".join(text_lines), parse_mode=None)
+        return
+
+    async def notifications():
+        for user_id, cents, language in changed:
+            yield user_id, _("An admin has updated your debt to ${debt}.", locale=language).format(debt=f"{cents / 100:.2f}")
+
+    report = await broadcast(bot, notifications())
+    await message.answer(
+        _("Applied {applied} rows ({changed} balances changed), 0 rejected. "
+          "Notified {sent} users, {unreachable} unreachable.").format(
+            applied=len(debts), changed=len(changed), sent=report.sent, unreachable=report.failed + report.blocked),
+        parse_mode=None)
 
-    await message.answer("\n".join(text_lines))
 
 @admin_router.message(Command("update_debt"))
 async def update_debt(message: Message, bot: Bot):
     admin_user_id = message.from_user.id
-    if not await is_admin(admin_user_id):
-        await message.answer(_("You are not authorized to use this command.", user_id=admin_user_id))
+    scope = await get_admin_scope(admin_user_id)
+    if scope == []:
+        await message.answer(_("You are not authorized to use this command."))
         return
 
     parts = message.text.split()
-    if len(parts) != 3:
-        await message.answer(_("Usage: /update_debt <user_telegram_id> <new_debt_amount>", user_id=admin_user_id))
+    amount = parse_amount(parts[2]) if len(parts) == 3 else None
+    if amount is None:
+        await message.answer(_("Usage: /update_debt <user_telegram_id> <new_debt_amount>"))
         return
 
     try:
         target_user_id = int(parts[1])
-        new_debt = float(parts[2])
+        new_debt = float(amount) # Exact to the cent well within MAX_AMOUNT
 
-        if database.update_user_debt(target_user_id, new_debt): # Use DB function
-            await message.answer(
-                _("Updated debt for user {uid} to ${amt}", user_id=admin_user_id).format(uid=target_user_id, amt=f"{new_debt:.2f}")
-            )
+        if scope is not None:
+            # Family admins may only touch members of their own families
+            target = await database.get_user_profile(target_user_id)
+            in_scope = target is not None and target.family_id in scope
+        else:
+            in_scope = True
+
+        if in_scope and await database.update_user_debt(target_user_id, new_debt, f"set by admin {admin_user_id}"):
+            await Reply(message).add(
+                _("Updated debt for user {uid} to ${amt}").format(uid=target_user_id, amt=f"{new_debt:.2f}")
+            ).with_menu().send()
 
             try:
+                target_locale = await database.get_user_language(target_user_id)
                 await bot.send_message(
                     target_user_id,
-                    _("An admin has updated your debt to ${debt}.", user_id=target_user_id).format(debt=f"{new_debt:.2f}")
+                    _("An admin has updated your debt to ${debt}.", locale=target_locale).format(debt=f"{new_debt:.2f}")
                 )
-                await show_main_menu_options(message)
             except Exception as notify_err:
                 logging.warning(f"Could not notify user {target_user_id} about debt update: {notify_err}")
-                await show_main_menu_options(message)
         else:
-            await message.answer(
-                _("User with ID {uid} not found or could not update debt.", user_id=admin_user_id).format(uid=target_user_id)
-            )
-            await show_main_menu_options(message)
+            await Reply(message).add(
+                _("User with ID {uid} not found or could not update debt.").format(uid=target_user_id)
+            ).with_menu().send()
 
     except ValueError:
-        await message.answer(_("Invalid user ID or amount. Please use numbers.", user_id=admin_user_id))
+        await message.answer(_("Invalid user ID or amount. Please use numbers."))
     except Exception as e:
         logging.error(f"Unexpected error during update_debt: {e}", exc_info=True)
-        await message.answer(_("An unexpected error occurred.", user_id=admin_user_id))
+        await message.answer(_("An unexpected error occurred."))
+
+
+@admin_router.message(Command("ledger"))
+async def admin_view_ledger(message: Message, command: CommandObject):
+    scope = await get_admin_scope(message.from_user.id)
+    if scope == []:
+        await message.answer(_("You are not authorized to use this command."))
+        return
+
+    try:
+        target_user_id = int(command.args or "")
+    except ValueError:
+        await message.answer(_("Usage: /ledger <user_telegram_id>"))
+        return
+
+    target = await database.get_user_profile(target_user_id)
+    if target is None or (scope is not None and target.family_id not in scope):
+        await message.answer(_("User or family not found."))
+        return
+
+    entries = await database.get_ledger_entries(target_user_id)
+    text_lines = [_("Ledger for {name} (ID: {uid}), balance ${debt}:").format(
+        name=target.full_name or "N/A", uid=target_user_id, debt=f"{target.debt:.2f}")]
+    for entry_id, kind, amount, period, note, created_at in entries:
+        line = f"#{entry_id} {created_at[:16]} {kind} {amount:+.2f}"
+        if period:
+            line += f" [{period}]"
+        if note:
+            line += f" - {note}"
+        text_lines.append(line)
+    await message.answer("\n".join(text_lines), parse_mode=None)
+
+
+@admin_router.message(Command("ledger_check"))
+async def admin_check_ledger(message: Message, command: CommandObject):
+    if not await is_admin(message.from_user.id):
+        await message.answer(_("You are not authorized to use this command."))
+        return
+
+    repair = (command.args or "").strip() == "repair"
+    drift = await database.check_ledger_consistency(repair=repair)
+    if drift is None:
+        await message.answer(_("An unexpected error occurred."))
+        return
+    if not drift:
+        await message.answer(_("Ledger is consistent: every balance matches its entries."))
+        return
+
+    text_lines = [_("Balances out of sync with the ledger:")]
+    for telegram_id, balance_cents, ledger_cents in drift[:50]:
+        text_lines.append(f"{telegram_id}: {balance_cents / 100:.2f} != {ledger_cents / 100:.2f}")
+    if repair:
+        text_lines.append(_("Repaired {count} balances.").format(count=len(drift)))
+    await message.answer("\n".join(text_lines), parse_mode=None)
+
+
+@admin_router.message(Command("admin_payments"))
+async def admin_view_payments(message: Message):
+    scope = await get_admin_scope(message.from_user.id)
+    if scope == []:
+        await message.answer(_("You are not authorized to use this command."))
+        return
+
+    payments = await database.get_recent_payments(family_ids=scope)
+    if not payments:
+        await message.answer(_("No payments yet."))
+        return
+
+    text_lines = [_("Recent payments:")]
+    for payment_id, user_tg_id, name, timestamp, duplicate_of in payments:
+        line = f"#{payment_id} {name or 'N/A'} (ID: {user_tg_id}) - {timestamp[:16]}"
+        if duplicate_of is not None:
+            line += " " + _("[duplicate receipt of #{id}]").format(id=duplicate_of)
+        text_lines.append(line)
+    await message.answer("\n".join(text_lines), parse_mode=None)
+
+
+@admin_router.message(Command("receipt"))
+async def admin_view_receipt(message: Message, command: CommandObject):
+    scope = await get_admin_scope(message.from_user.id)
+    if scope == []:
+        await message.answer(_("You are not authorized to use this command."))
+        return
+    if not command.args or not command.args.strip().lstrip("#").isdigit():
+        await message.answer(_("Usage: /receipt <payment_id>"), parse_mode=None)
+        return
+
+    payment_id = int(command.args.strip().lstrip("#"))
+    payment = await database.get_payment(payment_id)
+    if payment is None or (scope is not None and payment[1] not in scope):
+        await message.answer(_("Payment #{id} not found.").format(id=payment_id))
+        return
+
+    user_id, family_id, sha256, image_path, timestamp = payment
+    image = await receipts.load_receipt(sha256, image_path)
+    if image is None:
+        await message.answer(_("The receipt image of payment #{id} is no longer available.").format(id=payment_id))
+        return
+    caption = _("Receipt of payment #{id} from user {uid}, {time}.").format(id=payment_id, uid=user_id, time=timestamp[:16])
+    await message.answer_photo(BufferedInputFile(image, filename=f"receipt-{payment_id}.jpg"), caption=caption,
+                               parse_mode=None)
+
+
+@admin_router.message(Command("export"))
+async def admin_export(message: Message, command: CommandObject):
+    """Sends payments or balances as a CSV document, streamed from the database in batches."""
+    scope = await get_admin_scope(message.from_user.id)
+    if scope == []:
+        await message.answer(_("You are not authorized to use this command."))
+        return
+
+    # /export <payments|balances> [from=YYYY-MM-DD] [to=YYYY-MM-DD] [user=<id>] [gzip]
+    usage = _("Usage: /export <payments|balances> [from=YYYY-MM-DD] [to=YYYY-MM-DD] [user=<id>] [gzip]")
+    args = (command.args or "").split()
+    if not args or args[0] not in ("payments", "balances"):
+        await message.answer(usage, parse_mode=None)
+        return
+    kind = args[0]
+    start = end = user_id = None
+    compress = False
+    for arg in args[1:]:
+        key, _sep, value = arg.partition("=")
+        try:
+            if key == "gzip" and not value:
+                compress = True
+            elif key == "user" and value.isdigit():
+                user_id = int(value)
+            elif key == "from" and kind == "payments":
+                start = date.fromisoformat(value)
+            elif key == "to" and kind == "payments":
+                end = date.fromisoformat(value)
+            else:
+                raise ValueError(arg)
+        except ValueError:
+            await message.answer(usage, parse_mode=None)
+            return
+
+    try:
+        if kind == "payments":
+            export = await exports.export_payments(start, end, user_id, scope, compress)
+        else:
+            export = await exports.export_balances(user_id, scope, compress)
+    except (sqlite3.Error, OSError) as e:
+        logging.error(f"Export of {kind} for admin {message.from_user.id} failed: {e}", exc_info=True)
+        await message.answer(_("An unexpected error occurred."))
+        return
+
+    try:
+        if export.size > config.EXPORT_MAX_BYTES:
+            await message.answer(_("The export is too large to send ({size} MB). "
+                                   "Narrow it down with from=/to=/user= or add gzip.").format(
+                size=f"{export.size / 1024 / 1024:.0f}"))
+            return
+        await message.answer_document(FSInputFile(export.path, filename=export.filename),
+                                      caption=_("{rows} rows.").format(rows=export.rows), parse_mode=None)
+    finally:
+        os.remove(export.path)
+
+
+@admin_router.message(Command("admin_queue"))
+async def admin_view_queue(message: Message, ingestion: ReceiptIngestion):
+    if not await is_admin(message.from_user.id):
+        await message.answer(_("You are not authorized to use this command."))
+        return
+
+    stats = await ingestion.stats()
+    await message.answer(
+        _("Receipt queue: {depth} queued, {pending} pending in DB, {processed} processed, {retried} retried, "
+          "{failed} failed. Latency p50 {p50:.1f}s, max {max:.1f}s.").format(
+            depth=stats["queue_depth"], pending=stats["pending_in_db"], processed=stats["processed"],
+            retried=stats["retried"], failed=stats["failed"], p50=stats["latency_p50"], max=stats["latency_max"]),
+        parse_mode=None)
+
+
+@admin_router.message(Command("admin_jobs"))
+async def admin_view_jobs(message: Message):
+    if not await is_admin(message.from_user.id):
+        await message.answer(_("You are not authorized to use this command."))
+        return
+
+    jobs = await database.get_scheduled_jobs()
+    if not jobs:
+        await message.answer(_("No scheduled jobs."))
+        return
+
+    text_lines = [_("Scheduled jobs:")]
+    for name, kind, family_id, billing_day, next_run_at, last_run_at, last_status, last_error in jobs:
+        line = f"{name}: next {next_run_at[:16]}, last {last_run_at[:16] if last_run_at else 'never'} ({last_status or '-'})"
+        if last_error:
+            line += f" - {last_error}"
+        text_lines.append(line)
+    await message.answer("\n".join(text_lines), parse_mode=None)
+
+
+@admin_router.message(Command("admin_metrics"))
+async def admin_view_metrics(message: Message):
+    if not await is_admin(message.from_user.id):
+        await message.answer(_("You are not authorized to use this command."))
+        return
+
+    uptime = time.time() - metrics.STARTED_AT
+    text_lines = [_("Metrics (uptime {hours:.1f}h):").format(hours=uptime / 3600), "", _("Handlers:")]
+    text_lines += metrics.summary(metrics.HANDLER_LATENCY)
+    text_lines += ["", _("Database:")] + metrics.summary(metrics.DB_LATENCY)
+    text_lines += ["", _("Telegram API:")] + metrics.summary(metrics.TELEGRAM_LATENCY)
+    errors = [(f"{name} {'/'.join(labels)}", count) for name, counter in
+              (("handler", metrics.HANDLER_ERRORS), ("db", metrics.DB_ERRORS), ("api", metrics.TELEGRAM_ERRORS))
+              for labels, count in counter.values.items()]
+    if errors:
+        text_lines += ["", _("Errors:")] + [f"{label}: {count:g}" for label, count in errors]
+    throttled = ", ".join(f"{labels[0]} {count:g}" for labels, count in metrics.THROTTLED.values.items())
+    if throttled:
+        text_lines += ["", _("Throttled updates: {counts}").format(counts=throttled)]
+    cache = profile_cache.stats()
+    text_lines += ["", f"Profile cache: {cache['size']} entries, {cache['hits']} hits, {cache['misses']} misses"]
+    await message.answer("\n".join(text_lines), parse_mode=None)
+
+
+@admin_router.message(Command("families"))
+async def admin_view_families(message: Message):
+    scope = await get_admin_scope(message.from_user.id)
+    if scope == []:
+        await message.answer(_("You are not authorized to use this command."))
+        return
+
+    families = [f for f in await database.get_families() if scope is None or f[0] in scope]
+    text_lines = [_("Families:")]
+    for family_id, name, billing_day, price, member_count in families:
+        text_lines.append(f"#{family_id} {name} - billing day {billing_day}, ${price:.2f}, {member_count} members")
+    await message.answer("\n".join(text_lines), parse_mode=None)
+
+
+@admin_router.message(Command("add_family"))
+async def admin_add_family(message: Message):
+    if not await is_admin(message.from_user.id):
+        await message.answer(_("You are not authorized to use this command."))
+        return
+
+    parts = message.text.split(maxsplit=3)
+    try:
+        billing_day, price, name = int(parts[1]), parse_amount(parts[2]), parts[3]
+        if not 1 <= billing_day <= 31 or price is None or price < 0:
+            raise ValueError
+    except (IndexError, ValueError):
+        await message.answer(_("Usage: /add_family <billing_day 1-31> <price> <name>"))
+        return
+
+    family_id = await database.add_family(name, billing_day, float(price))
+    if family_id is None:
+        await message.answer(_("An unexpected error occurred."))
+        return
+    await scheduler.schedule_family(family_id, billing_day)
+    await message.answer(_("Created family #{id}. Invite link parameter: family_{id}").format(id=family_id))
+
+
+@admin_router.message(Command("set_family"))
+async def admin_set_family(message: Message):
+    if not await is_admin(message.from_user.id):
+        await message.answer(_("You are not authorized to use this command."))
+        return
+
+    parts = message.text.split()
+    try:
+        target_user_id, family_id = int(parts[1]), int(parts[2])
+    except (IndexError, ValueError):
+        await message.answer(_("Usage: /set_family <user_telegram_id> <family_id>"))
+        return
+
+    if await database.set_user_family(target_user_id, family_id):
+        await message.answer(_("Moved user {uid} to family #{fid}.").format(uid=target_user_id, fid=family_id))
+    else:
+        await message.answer(_("User or family not found."))
+
+
+@admin_router.message(Command("add_family_admin"))
+async def admin_add_family_admin(message: Message):
+    if not await is_admin(message.from_user.id):
+        await message.answer(_("You are not authorized to use this command."))
+        return
+
+    parts = message.text.split()
+    try:
+        family_id, target_user_id = int(parts[1]), int(parts[2])
+    except (IndexError, ValueError):
+        await message.answer(_("Usage: /add_family_admin <family_id> <user_telegram_id>"))
+        return
+
+    if await database.add_family_admin(family_id, target_user_id):
+        await message.answer(_("User {uid} is now an admin of family #{fid}.").format(uid=target_user_id, fid=family_id))
+    else:
+        await message.answer(_("An unexpected error occurred."))
+
+
+@admin_router.message(Command("set_member"))
+async def admin_set_spotify_member(message: Message):
+    scope = await get_admin_scope(message.from_user.id)
+    if scope == []:
+        await message.answer(_("You are not authorized to use this command."))
+        return
+
+    # /set_member <user_telegram_id> <position 1-5 | none>
+    parts = message.text.split()
+    try:
+        target_user_id = int(parts[1])
+        position = None if parts[2].lower() == "none" else int(parts[2])
+        if position is not None and not 1 <= position <= script.MAX_MEMBERS:
+            raise ValueError
+    except (IndexError, ValueError):
+        await message.answer(_("Usage: /set_member <user_telegram_id> <position 1-{max}|none>").format(max=script.MAX_MEMBERS))
+        return
+
+    target = await database.get_user_profile(target_user_id)
+    if target is None or (scope is not None and target.family_id not in scope) \
+            or not await database.set_spotify_member(target_user_id, position):
+        await message.answer(_("Could not map user {uid}: unknown user, not in family {family} (the Spotify account's), "
+                               "or the position is taken.").format(uid=target_user_id, family=config.SPOTIFY_FAMILY_ID))
+        return
+    await message.answer(_("User {uid} is now Spotify member {position}. The next enforcement run applies it.").format(
+        uid=target_user_id, position=position if position is not None else "-"))
+
+
+@admin_router.message(Command("enforcement"))
+async def admin_view_enforcement(message: Message, command: CommandObject):
+    scope = await get_admin_scope(message.from_user.id)
+    if scope == []:
+        await message.answer(_("You are not authorized to use this command."))
+        return
+    if not command.args or not command.args.isdigit() or (scope is not None and int(command.args) not in scope):
+        await message.answer(_("Usage: /enforcement <family_id>"))
+        return
+
+    members = await database.get_enforcement_overview(int(command.args))
+    if not members:
+        await message.answer(_("No Spotify members mapped in this family."))
+        return
+
+    def explicit(allow: int | None) -> str:
+        return "?" if allow is None else ("on" if allow else "off")
+
+    text_lines = [_("Spotify members (explicit content applied / pending):")]
+    for telegram_id, name, member, debt, applied, applied_at, pending, attempts, last_error in members:
+        line = f"{member}. {name or 'N/A'} (ID: {telegram_id}) ${debt:.2f} - {explicit(applied)}"
+        if applied_at:
+            line += f" since {applied_at[:16]}"
+        if pending is not None:
+            line += f", pending {explicit(pending)}"
+            if attempts:
+                line += f" ({attempts} failed: {(last_error or '')[:80]})"
+        text_lines.append(line)
+    await message.answer("\n".join(text_lines), parse_mode=None)
+
+
+@admin_router.message(Command("reload_locales"))
+async def admin_reload_locales(message: Message):
+    if not await is_admin(message.from_user.id):
+        await message.answer(_("You are not authorized to use this command."))
+        return
+
+    try:
+        reload_catalogs()
+    except (OSError, RuntimeError) as e:
+        logging.error(f"Could not reload translation catalogs: {e}")
+        await message.answer(_("An unexpected error occurred."))
+        return
+    await message.answer(_("Translations reloaded."))
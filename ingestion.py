@@ -0,0 +1,178 @@
+# ingestion.py
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+from aiogram import Bot
+
+import config
+import database
+import receipts
+from localization import _
+
+
+class ReceiptIngestion:
+    """
+    Background pipeline for receipt photos. Handlers only persist a job and reply;
+    a bounded pool of workers downloads the file, records the payment and notifies
+    admins. Jobs live in the receipt_jobs table, so anything not finished survives a
+    restart. The in-memory queue is bounded: when it's full, jobs just wait in the DB
+    until the feeder has room for them again.
+    """
+
+    def __init__(self, bot: Bot, workers: int = config.INGESTION_WORKERS,
+                 queue_size: int = config.INGESTION_QUEUE_SIZE, max_attempts: int = config.INGESTION_MAX_ATTEMPTS):
+        self.bot = bot
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.queue: asyncio.Queue[int] = asyncio.Queue(maxsize=queue_size)
+        self._queued: set[int] = set()
+        self._tasks: list[asyncio.Task] = []
+        self._feeder_wakeup = asyncio.Event()
+        self._next_sweep = 0.0 # Monotonic time of the next stale-job sweep
+        # Metrics
+        self.enqueued = 0
+        self.processed = 0
+        self.retried = 0
+        self.failed = 0
+        self.latencies: deque[float] = deque(maxlen=1000) # Seconds from submission to completion
+
+    # --- Producer side ---
+    def _offer(self, job_id: int) -> bool:
+        if job_id in self._queued:
+            return True
+        try:
+            self.queue.put_nowait(job_id)
+        except asyncio.QueueFull:
+            return False
+        self._queued.add(job_id)
+        return True
+
+    async def submit(self, user_id: int, chat_id: int, full_name: str, locale: str, file_id: str,
+                     file_unique_id: str) -> bool:
+        """Persists a receipt job and hands it to the workers. Never waits for the download."""
+        job_id = await database.enqueue_receipt_job(user_id, chat_id, full_name, locale, file_id, file_unique_id)
+        if job_id is None:
+            return False
+        self.enqueued += 1
+        if not self._offer(job_id):
+            logging.info(f"Receipt queue full, job {job_id} will be picked up from the DB.")
+        return True
+
+    async def _requeue_stale(self):
+        """
+        Returns jobs stuck in 'processing' for over INGESTION_STALE_AFTER to the queue. Runs for the
+        whole lifetime, not just at startup: a process that crashes and restarts right away leaves
+        claims that only become stale later.
+        """
+        if time.monotonic() < self._next_sweep:
+            return
+        self._next_sweep = time.monotonic() + config.INGESTION_STALE_SWEEP_INTERVAL
+        stale_before = datetime.now() - timedelta(seconds=config.INGESTION_STALE_AFTER)
+        requeued = await database.requeue_stale_receipt_jobs(stale_before)
+        if requeued:
+            logging.info(f"Requeued {requeued} receipt jobs left processing by a crashed worker.")
+
+    async def _feeder(self):
+        """Moves due jobs from the DB (retries, overflow, orphans of a crash) into the queue."""
+        while True:
+            await self._requeue_stale()
+            room = self.queue.maxsize - self.queue.qsize()
+            if room > 0:
+                for job_id in await database.get_due_receipt_job_ids(room):
+                    if not self._offer(job_id):
+                        break
+            self._feeder_wakeup.clear()
+            try:
+                await asyncio.wait_for(self._feeder_wakeup.wait(), timeout=config.INGESTION_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    # --- Worker side ---
+    async def _notify_admins(self, user_id: int, full_name: str, file_id: str, duplicate_of: int | None):
+        profile = await database.get_user_profile(user_id)
+        admin_ids = set(config.ADMIN_IDS)
+        if profile is not None and profile.family_id is not None:
+            admin_ids.update(await database.get_family_admin_ids(profile.family_id))
+        for admin_id in admin_ids:
+            locale = await database.get_user_language(admin_id)
+            caption = _("New receipt from {name} (ID: {uid}).", locale=locale).format(name=full_name, uid=user_id)
+            if duplicate_of is not None:
+                caption += " " + _("[duplicate receipt of #{id}]", locale=locale).format(id=duplicate_of)
+            try:
+                await self.bot.send_photo(admin_id, file_id, caption=caption, parse_mode=None)
+            except Exception as e:
+                logging.warning(f"Could not notify admin {admin_id} about receipt from {user_id}: {e}")
+
+    async def _process(self, job: tuple):
+        job_id, user_id, chat_id, full_name, locale, file_id, file_unique_id, attempts, created_at = job
+        receipt = await receipts.store_receipt(self.bot, file_id, file_unique_id)
+        if not await database.add_payment_record(user_id, receipt.path, receipt.sha256, file_unique_id,
+                                                 duplicate_of=receipt.duplicate_of):
+            raise RuntimeError("could not save payment record")
+        await database.finish_receipt_job(job_id, "done")
+
+        if receipt.duplicate_of is not None:
+            try:
+                await self.bot.send_message(chat_id, _("This receipt has already been submitted. Please send a new one.",
+                                                       locale=locale))
+            except Exception as e:
+                logging.warning(f"Could not tell user {user_id} about a duplicate receipt: {e}")
+        await self._notify_admins(user_id, full_name, file_id, receipt.duplicate_of)
+        self.latencies.append((datetime.now() - datetime.fromisoformat(created_at)).total_seconds())
+
+    async def _fail(self, job: tuple, error: Exception):
+        job_id, user_id, chat_id, full_name, locale, file_id, file_unique_id, attempts, created_at = job
+        if attempts < self.max_attempts:
+            retry_at = datetime.now() + timedelta(seconds=config.INGESTION_RETRY_DELAY * 2 ** (attempts - 1))
+            await database.finish_receipt_job(job_id, "pending", str(error), retry_at)
+            self.retried += 1
+            logging.warning(f"Receipt job {job_id} failed (attempt {attempts}), retrying at {retry_at:%H:%M:%S}: {error}")
+            return
+        await database.finish_receipt_job(job_id, "failed", str(error))
+        self.failed += 1
+        logging.error(f"Receipt job {job_id} for user {user_id} failed permanently: {error}")
+        try:
+            await self.bot.send_message(chat_id, _("Sorry, there was an error processing your receipt.", locale=locale))
+        except Exception as e:
+            logging.warning(f"Could not tell user {user_id} about a failed receipt: {e}")
+
+    async def _worker(self):
+        while True:
+            job_id = await self.queue.get()
+            self._queued.discard(job_id)
+            self._feeder_wakeup.set()
+            job = await database.claim_receipt_job(job_id)
+            if job is None:
+                continue
+            try:
+                await self._process(job)
+                self.processed += 1
+            except Exception as e:
+                await self._fail(job, e)
+
+    # --- Lifecycle ---
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._feeder()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def stats(self) -> dict:
+        latencies = sorted(self.latencies)
+        return {
+            "queue_depth": self.queue.qsize(),
+            "pending_in_db": await database.count_pending_receipt_jobs(),
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "retried": self.retried,
+            "failed": self.failed,
+            "latency_p50": latencies[len(latencies) // 2] if latencies else 0.0,
+            "latency_max": latencies[-1] if latencies else 0.0,
+        }
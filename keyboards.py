@@ -1,7 +1,9 @@
 # keyboards.py
 from aiogram import types
-from aiogram.utils.keyboard import ReplyKeyboardBuilder
-from localization import _
+from aiogram.filters import Filter
+from aiogram.filters.callback_data import CallbackData
+from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
+from localization import _, available_locales, i18n, on_catalogs_reload
 
 def get_language_keyboard() -> types.ReplyKeyboardMarkup:
     builder = ReplyKeyboardBuilder()
@@ -12,8 +14,8 @@ def get_language_keyboard() -> types.ReplyKeyboardMarkup:
 # def get_main_menu_keyboard(user_id: int) -> types.ReplyKeyboardMarkup:
 #     """Returns the main menu keyboard, translated for the user."""
 #     builder = ReplyKeyboardBuilder()
-#     builder.add(types.KeyboardButton(text=_("Upload", user_id=user_id)))
-#     builder.add(types.KeyboardButton(text=_("Stats", user_id=user_id)))
+#     builder.add(types.KeyboardButton(text=_("Upload")))
+#     builder.add(types.KeyboardButton(text=_("Stats")))
 #     return builder.as_markup(resize_keyboard=True)
 
 def get_start_keyboard() -> types.ReplyKeyboardMarkup:
@@ -21,9 +23,73 @@ def get_start_keyboard() -> types.ReplyKeyboardMarkup:
     builder.add(types.KeyboardButton(text="Start"))
     return builder.as_markup(resize_keyboard=True, one_time_keyboard=True)
 
-def get_main_menu_keyboard(user_id: int) -> types.ReplyKeyboardMarkup | None:
-    """Returns the main menu keyboard, translated for the user."""
-    builder = ReplyKeyboardBuilder()
-    builder.add(types.KeyboardButton(text=_("Upload")))
-    builder.add(types.KeyboardButton(text=_("Stats", user_id=user_id)))
-    return builder.as_markup(resize_keyboard=True)
\ No newline at end of file
+# --- Main menu ---
+# Built once per locale; button presses are routed back through a label -> action index,
+# so a single filter matches the button in every language without calling gettext.
+MENU_ACTIONS = {
+    "upload": "Upload",
+    "stats": "Stats",
+}
+
+_main_menus: dict[str, types.ReplyKeyboardMarkup] | None = None # Built on first use
+_label_actions: dict[str, str] = {}
+
+
+def build_main_menus():
+    """(Re)builds the main menu of every available locale and the label index."""
+    menus, labels = {}, {}
+    for locale in available_locales():
+        builder = ReplyKeyboardBuilder()
+        for action, text_key in MENU_ACTIONS.items():
+            label = _(text_key, locale=locale)
+            builder.add(types.KeyboardButton(text=label))
+            labels[label] = action
+        menus[locale] = builder.as_markup(resize_keyboard=True)
+    # Swap in complete tables so handlers never see a half-built index
+    global _main_menus, _label_actions
+    _main_menus, _label_actions = menus, labels
+
+
+def get_main_menu_keyboard(locale: str | None = None) -> types.ReplyKeyboardMarkup:
+    """Returns the main menu keyboard for a locale (default: the current update's locale)."""
+    if _main_menus is None:
+        build_main_menus()
+    return _main_menus.get(locale or i18n.current_locale) or _main_menus[i18n.default_locale]
+
+
+def action_for_label(text: str | None) -> str | None:
+    """Maps a menu button label in any language to its action id."""
+    if _main_menus is None:
+        build_main_menus()
+    return _label_actions.get(text) if text else None
+
+
+class MenuAction(Filter):
+    """Matches a press of the given main menu button, whatever the user's language."""
+
+    def __init__(self, action: str):
+        self.action = action
+
+    async def __call__(self, message: types.Message) -> bool:
+        return action_for_label(message.text) == self.action
+
+
+on_catalogs_reload(build_main_menus)
+
+class StatsPage(CallbackData, prefix="stats"):
+    """Keyset cursor and filters for paginated /admin_stats."""
+    after: int = 0 # Show users with telegram_id > after ...
+    before: int = 0 # ... or, when set, the page ending just before this id
+    debtors: bool = False
+    lang: str = ""
+    family: int = 0
+
+
+def get_stats_pagination_keyboard(page: StatsPage, first_id: int, last_id: int, has_prev: bool,
+                                  has_next: bool) -> types.InlineKeyboardMarkup | None:
+    builder = InlineKeyboardBuilder()
+    if has_prev:
+        builder.button(text="« " + _("Prev"), callback_data=page.model_copy(update={"after": 0, "before": first_id}))
+    if has_next:
+        builder.button(text=_("Next") + " »", callback_data=page.model_copy(update={"after": last_id, "before": 0}))
+    return builder.as_markup() if has_prev or has_next else None
@@ -0,0 +1,73 @@
+# lease.py
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from typing import Awaitable, Callable
+
+import config
+import database
+
+SCHEDULER_LEASE = "scheduler"
+
+
+def make_holder_id() -> str:
+    """Identifies this process in the leases table; unique even if a pid gets reused."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class LeaderLease:
+    """
+    Runs a task only while this process holds a named lease in the shared database.
+    Every process contends for the lease; the holder renews it on a heartbeat, and when it
+    dies without releasing it, another process takes over once the lease expires.
+    A holder that fails to renew stops its task before the lease can be taken over.
+    """
+
+    def __init__(self, name: str, ttl: float = config.LEASE_TTL, renew_interval: float = config.LEASE_RENEW_INTERVAL,
+                 holder: str | None = None):
+        if renew_interval * 2 > ttl:
+            raise ValueError("The lease must survive at least one missed heartbeat (ttl >= 2 * renew_interval)")
+        self.name = name
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+        self.holder = holder or make_holder_id()
+        self.is_leader = False
+
+    async def run(self, leader_task: Callable[[], Awaitable[None]]):
+        """Contends for the lease forever, running leader_task() whenever this process holds it."""
+        loop = asyncio.get_running_loop()
+        task: asyncio.Task | None = None
+        renewed_at = 0.0
+        try:
+            while True:
+                if await database.acquire_lease(self.name, self.holder, self.ttl):
+                    renewed_at = loop.time()
+                    if task is None or task.done():
+                        if task is not None and not task.cancelled() and task.exception():
+                            logging.error(f"Leader task for lease {self.name} crashed: {task.exception()!r}, restarting.")
+                        logging.info(f"Acquired lease {self.name} as {self.holder}.")
+                        self.is_leader = True
+                        task = asyncio.create_task(leader_task())
+                elif task is not None:
+                    # Someone else holds it now, or we couldn't reach the DB: step down
+                    logging.warning(f"Lost lease {self.name}, stopping leader task.")
+                    await self._stop(task)
+                    task = None
+
+                # Sleep until the next heartbeat, but never past the point where the lease
+                # could expire under us (e.g. after a slow renewal)
+                delay = self.renew_interval
+                if task is not None:
+                    delay = min(delay, renewed_at + self.ttl - self.renew_interval - loop.time())
+                await asyncio.sleep(max(delay, 0))
+        finally:
+            if task is not None:
+                await self._stop(task)
+                await database.release_lease(self.name, self.holder)
+
+    async def _stop(self, task: asyncio.Task):
+        self.is_leader = False
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
@@ -1,39 +1,74 @@
+import gettext
 import logging
+from typing import Callable
 from aiogram.utils.i18n import I18n
 import config
-import database # Import database functions
 
-i18n = I18n(path=config.LOCALES_DIR, default_locale=config.DEFAULT_LOCALE, domain=config.I18N_DOMAIN)
 
+class LazyI18n(I18n):
+    """
+    aiogram's I18n, except that the compiled catalogs are read on first use rather than at import.
+    bot.main() touches them right after startup, so a missing or uncompiled catalog still stops
+    the bot there instead of failing every update.
+    """
 
-# async def get_user_locale(event_from_user: types.User | None) -> str:
-#     """
-#     Gets the user locale from the database.
-#     Required signature for SimpleI18nMiddleware locale_provider.
-#     """
-#     if event_from_user is None:
-#         return config.DEFAULT_LOCALE # Or handle anonymous users as needed
-#
-#     user_id = event_from_user.id
-#     locale = database.get_user_language(user_id) # Use your DB function
-#     # Ensure the locale exists in your i18n setup, otherwise fallback
-#     if locale in i18n.available_locales:
-#          return locale
-#     return config.DEFAULT_LOCALE
+    def __init__(self, **kwargs):
+        self._locales: dict[str, gettext.GNUTranslations] | None = None
+        self._deferred = True
+        super().__init__(**kwargs) # Its `self.locales = self.find_locales()` stores None while deferred
+        self._deferred = False
 
+    def find_locales(self) -> dict[str, gettext.GNUTranslations] | None:
+        if self._deferred:
+            return None
+        return super().find_locales()
 
-def _(text_key: str, user_id: int | None = None, **kwargs) -> str:
-    """Gets the translation for a key, fetching user locale from DB if user_id is provided."""
-    locale = config.DEFAULT_LOCALE # Start with default
-    if user_id:
-        locale = database.get_user_language(user_id) # Fetch from DB
+    @property
+    def locales(self) -> dict[str, gettext.GNUTranslations]:
+        if self._locales is None:
+            self._locales = self.find_locales()
+        return self._locales
 
+    @locales.setter
+    def locales(self, value: dict[str, gettext.GNUTranslations] | None):
+        self._locales = value
+
+
+i18n = LazyI18n(path=config.LOCALES_DIR, default_locale=config.DEFAULT_LOCALE, domain=config.I18N_DOMAIN)
+
+_reload_listeners: list[Callable[[], None]] = []
+
+
+def available_locales() -> tuple[str, ...]:
+    """Locales with a loaded catalog, always including the default (untranslated keys)."""
+    return tuple(dict.fromkeys((i18n.default_locale, *i18n.available_locales)))
+
+
+def on_catalogs_reload(listener: Callable[[], None]):
+    """Registers a callback run after reload_catalogs(), e.g. to rebuild precomputed translations."""
+    _reload_listeners.append(listener)
+
+
+def reload_catalogs():
+    """Re-reads the compiled catalogs from disk and notifies everything derived from them."""
+    i18n.reload()
+    for listener in _reload_listeners:
+        listener()
+    logging.info(f"Reloaded translation catalogs: {', '.join(available_locales())}")
+
+
+def _(text_key: str, locale: str | None = None) -> str:
+    """
+    Gets the translation for a key.
+    Without an explicit locale, uses the current update's locale set by DatabaseI18nMiddleware,
+    so calls inside handlers never touch the database.
+    """
     try:
         # Use gettext directly; formatting is handled separately if needed
         translation = i18n.gettext(text_key, locale=locale)
         return translation # kwargs formatting will be done where needed, e.g., in handlers
     except KeyError:
-        logging.warning(f"Missing translation key '{text_key}' for locale '{locale}'")
+        logging.warning(f"Missing translation key '{text_key}' for locale '{locale or i18n.current_locale}'")
         # Fallback to English or the key itself
         try:
             translation = i18n.gettext(text_key, locale='en')
@@ -42,4 +77,6 @@ def _(text_key: str, user_id: int | None = None, **kwargs) -> str:
             return f"[{text_key}]" # Return key if totally missing
 
 # Example of how to use formatting outside the function:
-# text = _("Hello, {name}!", user_id=user_id).format(name=full_name)
+# text = _("Hello, {name}!").format(name=full_name)
+# For messages sent to someone other than the current user, pass their locale:
+# text = _("Hello, {name}!", locale=await database.get_user_language(other_id)).format(name=other_name)
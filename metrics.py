@@ -0,0 +1,129 @@
+# metrics.py
+import bisect
+import time
+from typing import Iterable
+
+# Latency buckets in seconds, from sub-millisecond DB hits to slow Telegram calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter per label combination."""
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self.values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value:g}"
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram per label combination. Observing is a bisect and two additions,
+    cheap enough to time every handler, query and API call in production.
+    """
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.series: dict[tuple[str, ...], list] = {} # labels -> [bucket counts (+Inf last), sum, count]
+
+    def observe(self, value: float, *labels: str):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def quantile(self, q: float, *labels: str) -> float:
+        """Estimates a quantile as the upper bound of the bucket it falls in."""
+        series = self.series.get(labels)
+        if not series or not series[2]:
+            return 0.0
+        rank, seen = q * series[2], 0
+        for bound, count in zip((*self.buckets, float("inf")), series[0]):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total, count) in self.series.items():
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % bound
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {total:g}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {count}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[Counter | Histogram] = []
+
+    def counter(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, help_text, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> Histogram:
+        metric = Histogram(name, help_text, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+STARTED_AT = time.time()
+
+HANDLER_LATENCY = REGISTRY.histogram("bot_handler_duration_seconds", "Time spent in update handlers.", ("handler",))
+HANDLER_ERRORS = REGISTRY.counter("bot_handler_errors_total", "Handler calls that raised.", ("handler", "error"))
+DB_LATENCY = REGISTRY.histogram("bot_db_duration_seconds",
+                                "Database calls, including the wait for the SQLite thread.", ("function",))
+DB_ERRORS = REGISTRY.counter("bot_db_errors_total", "Database calls that raised.", ("function", "error"))
+TELEGRAM_LATENCY = REGISTRY.histogram("bot_telegram_request_duration_seconds", "Telegram Bot API requests.",
+                                      ("method",))
+TELEGRAM_ERRORS = REGISTRY.counter("bot_telegram_errors_total", "Failed Telegram Bot API requests.",
+                                   ("method", "error"))
+THROTTLED = REGISTRY.counter("bot_throttled_updates_total", "Updates dropped by the anti-flood middleware.", ("reason",))
+JOB_RUNS = REGISTRY.counter("bot_scheduled_job_runs_total", "Scheduled job runs by outcome.", ("kind", "status"))
+
+
+def summary(histogram: Histogram, limit: int = 10) -> list[str]:
+    """Human-readable lines for the busiest series of a histogram: count, mean, p50 and p99."""
+    rows = sorted(histogram.series.items(), key=lambda item: item[1][2], reverse=True)[:limit]
+    lines = []
+    for labels, (counts, total, count) in rows:
+        lines.append(f"{'/'.join(labels)}: {count}x, avg {total / count * 1000:.1f}ms, "
+                     f"p50 <{histogram.quantile(0.5, *labels) * 1000:g}ms, p99 <{histogram.quantile(0.99, *labels) * 1000:g}ms")
+    return lines
@@ -0,0 +1,26 @@
+# middlewares/i18n.py
+from typing import Any
+
+from aiogram.types import TelegramObject
+from aiogram.utils.i18n.middleware import I18nMiddleware
+
+import database
+
+
+class DatabaseI18nMiddleware(I18nMiddleware):
+    """
+    Resolves the user's locale from the users table once per update and makes it the
+    aiogram i18n context, so localization._() inside handlers is already locale-bound.
+    The resolved locale is also passed to handlers as the `locale` argument.
+    """
+
+    async def get_locale(self, event: TelegramObject, data: dict[str, Any]) -> str:
+        locale = self.i18n.default_locale
+        event_from_user = data.get("event_from_user")
+        if event_from_user is not None:
+            user_locale = await database.get_user_language(event_from_user.id)
+            # Ensure the locale exists in the i18n setup, otherwise fallback
+            if user_locale in self.i18n.available_locales:
+                locale = user_locale
+        data["locale"] = locale
+        return locale
@@ -0,0 +1,114 @@
+# middlewares/throttling.py
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+import config
+import metrics
+from localization import _
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated_at", "notified_at")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated_at = now # Last update from this user; buckets are ordered by it
+        self.notified_at = float("-inf") # Last "slow down" reply
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Per-user anti-flood for messages and button presses, as an outer middleware so dropped
+    updates never reach filters, handlers or the database. Each user has a token bucket of
+    `burst` updates refilled at `rate` per second; updates beyond it are dropped, and the user
+    gets at most one "slow down" reply per `notice_interval`. The parts of an album
+    (media_group_id) are coalesced: only the first part that gets past the rate limit reaches
+    the handlers, so an album of screenshots is one receipt submission, of its first image; the
+    other images are dropped.
+
+    State is one small object per recently active user. Buckets idle for `idle_ttl` are
+    evicted (they would be full again by then), so memory tracks active users, not all users.
+    Global admins are never throttled.
+    """
+
+    def __init__(self, rate: float = config.THROTTLE_RATE, burst: int = config.THROTTLE_BURST,
+                 notice_interval: float = config.THROTTLE_NOTICE_INTERVAL, idle_ttl: float = config.THROTTLE_IDLE_TTL,
+                 media_group_window: float = config.MEDIA_GROUP_WINDOW):
+        if idle_ttl < max(burst / rate, notice_interval):
+            raise ValueError("Buckets must outlive their refill time and the notice interval (idle_ttl too short)")
+        self.rate = rate
+        self.burst = burst
+        self.notice_interval = notice_interval
+        self.idle_ttl = idle_ttl
+        self.media_group_window = media_group_window
+        self._buckets: OrderedDict[int, _Bucket] = OrderedDict() # LRU by last update
+        self._media_groups: OrderedDict[str, float] = OrderedDict() # media_group_id -> first part seen at
+
+    def _evict(self, now: float):
+        # Both dicts are in time order, so this only ever looks at expired entries plus one
+        while self._buckets and now - next(iter(self._buckets.values())).updated_at >= self.idle_ttl:
+            self._buckets.popitem(last=False)
+        while self._media_groups and now - next(iter(self._media_groups.values())) >= self.media_group_window:
+            self._media_groups.popitem(last=False)
+
+    def _take(self, user_id: int, now: float) -> _Bucket | None:
+        """Takes a token from the user's bucket; returns the bucket if it was empty."""
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = _Bucket(self.burst, now)
+        else:
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated_at) * self.rate)
+            bucket.updated_at = now
+            self._buckets.move_to_end(user_id)
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return None
+        return bucket
+
+    async def _notify(self, event: TelegramObject, user_id: int, bucket: _Bucket, now: float):
+        notify = now - bucket.notified_at >= self.notice_interval
+        if notify:
+            bucket.notified_at = now
+        text = _("Too many requests, please slow down.")
+        try:
+            if isinstance(event, CallbackQuery):
+                # Always answer, or the button keeps spinning; only the text is rate-limited
+                await event.answer(text if notify else None)
+            elif notify and isinstance(event, Message):
+                await event.answer(text, parse_mode=None)
+        except Exception as e:
+            logging.warning(f"Could not send throttling notice to {user_id}: {e}")
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None or user.id in config.ADMIN_IDS:
+            return await handler(event, data)
+
+        now = time.monotonic()
+        self._evict(now)
+
+        media_group_id = getattr(event, "media_group_id", None)
+        if media_group_id is not None and media_group_id in self._media_groups:
+            metrics.THROTTLED.inc("media_group")
+            return None
+
+        bucket = self._take(user.id, now)
+        if bucket is None:
+            # Only a part that reaches the handlers claims its album: if this one was rate-limited,
+            # a later part of the same album still gets through once tokens refill
+            if media_group_id is not None:
+                self._media_groups[media_group_id] = now
+            return await handler(event, data)
+        metrics.THROTTLED.inc("rate")
+        await self._notify(event, user.id, bucket, now)
+        return None
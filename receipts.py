@@ -0,0 +1,193 @@
+# receipts.py
+import asyncio
+import hashlib
+import logging
+import os
+import struct
+import uuid
+import zlib
+from datetime import date, datetime, timedelta
+from typing import NamedTuple
+
+import aiofiles
+from aiogram import Bot
+
+import config
+import database
+
+
+class StoredReceipt(NamedTuple):
+    sha256: str
+    path: str
+    duplicate_of: int | None # id of an earlier payment with the same image, if any
+
+
+def receipt_path(sha256: str) -> str:
+    """Content-addressed location: receipts/ab/cd/abcd....jpg keeps every directory small."""
+    return os.path.join(config.RECEIPTS_DIR, sha256[:2], sha256[2:4], f"{sha256}.jpg")
+
+
+async def _download_hashed(bot: Bot, file_id: str) -> tuple[str, str]:
+    """Streams a Telegram file to a temp file while hashing it. Returns (sha256, temp path)."""
+    file = await bot.get_file(file_id)
+    url = bot.session.api.file_url(bot.token, file.file_path)
+    tmp_dir = os.path.join(config.RECEIPTS_DIR, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+    digest = hashlib.sha256()
+    try:
+        async with aiofiles.open(tmp_path, "wb") as f:
+            async for chunk in bot.session.stream_content(url, timeout=bot.session.timeout):
+                digest.update(chunk)
+                await f.write(chunk)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return digest.hexdigest(), tmp_path
+
+
+async def store_receipt(bot: Bot, file_id: str, file_unique_id: str) -> StoredReceipt:
+    """
+    Saves a receipt photo once per distinct image. A file Telegram has already given us
+    (same file_unique_id) isn't downloaded again, and different uploads of identical
+    bytes share one file on disk.
+    """
+    known = await database.find_payment_by_file_unique_id(file_unique_id)
+    if known is not None:
+        payment_id, sha256 = known
+        return StoredReceipt(sha256, receipt_path(sha256), payment_id)
+
+    sha256, tmp_path = await _download_hashed(bot, file_id)
+    path = receipt_path(sha256)
+    archived = await database.get_archived_receipt(sha256)
+    if os.path.exists(path) or (archived is not None and archived[0] is not None):
+        os.remove(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+    return StoredReceipt(sha256, path, await database.find_payment_by_sha256(sha256))
+
+
+async def load_receipt(sha256: str | None, image_path: str | None = None) -> bytes | None:
+    """
+    Reads a receipt image: from its file while it's live, from its archive bundle (a single seek)
+    once archived. None if it's gone, e.g. dropped by the retention policy.
+    """
+    path = receipt_path(sha256) if sha256 else image_path
+    if path and os.path.exists(path):
+        async with aiofiles.open(path, "rb") as f:
+            return await f.read()
+    if sha256:
+        location = await database.get_archived_receipt(sha256)
+        if location is not None and location[0] is not None:
+            return await asyncio.to_thread(_read_from_bundle, *location)
+    return None
+
+
+# --- Archive ---
+# A bundle holds the receipts first used in one month, as independently compressed entries:
+#   b"RCPT" | sha256 (32 bytes) | compressed length (4 bytes, big-endian) | zlib data
+# The receipt_archive table points at each entry's zlib data, so reading one receipt back is one
+# seek and one read; the headers keep a bundle self-describing should its index need rebuilding.
+ENTRY_HEADER = struct.Struct(">4s32sI")
+ENTRY_MAGIC = b"RCPT"
+
+
+def archive_dir() -> str:
+    return os.path.join(config.RECEIPTS_DIR, "archive")
+
+
+def bundle_path(bundle: str) -> str:
+    return os.path.join(archive_dir(), f"{bundle}.bundle")
+
+
+def _append_to_bundle(bundle: str, sha256s: list[str]) -> list[tuple[str, str | None, int | None, int | None, int | None]]:
+    """Appends receipt files to a bundle and syncs it to disk. Returns their index entries."""
+    entries = []
+    compressed = []
+    for sha256 in sha256s:
+        try:
+            with open(receipt_path(sha256), "rb") as source:
+                data = source.read()
+        except FileNotFoundError:
+            logging.warning(f"Receipt {sha256} is missing from {config.RECEIPTS_DIR}, archiving it as gone.")
+            entries.append((sha256, None, None, None, None))
+            continue
+        compressed.append((sha256, zlib.compress(data), len(data)))
+    if not compressed:
+        return entries
+
+    os.makedirs(archive_dir(), exist_ok=True)
+    with open(bundle_path(bundle), "ab") as f:
+        offset = f.seek(0, os.SEEK_END)
+        for sha256, blob, size in compressed:
+            f.write(ENTRY_HEADER.pack(ENTRY_MAGIC, bytes.fromhex(sha256), len(blob)))
+            f.write(blob)
+            entries.append((sha256, bundle, offset + ENTRY_HEADER.size, len(blob), size))
+            offset += ENTRY_HEADER.size + len(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    return entries
+
+
+def _read_from_bundle(bundle: str, offset: int, length: int) -> bytes:
+    with open(bundle_path(bundle), "rb") as f:
+        f.seek(offset)
+        return zlib.decompress(f.read(length))
+
+
+def _remove_files(paths: list[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _remove_bundles_before(before_bundle: str) -> list[str]:
+    if not os.path.isdir(archive_dir()):
+        return []
+    removed = []
+    for name in sorted(os.listdir(archive_dir())):
+        bundle, extension = os.path.splitext(name)
+        if extension == ".bundle" and bundle < before_bundle:
+            os.remove(os.path.join(archive_dir(), name))
+            removed.append(bundle)
+    return removed
+
+
+async def drop_expired_bundles(today: date | None = None) -> list[str]:
+    """Deletes bundles older than RECEIPT_RETENTION_MONTHS (if set). Returns the dropped bundle names."""
+    if not config.RECEIPT_RETENTION_MONTHS:
+        return []
+    today = today or date.today()
+    months = today.year * 12 + today.month - 1 - config.RECEIPT_RETENTION_MONTHS
+    before_bundle = f"{months // 12:04d}-{months % 12 + 1:02d}"
+    # Index first, so a receipt is never looked up in a bundle that's being deleted
+    await database.drop_archive_bundles(before_bundle)
+    return await asyncio.to_thread(_remove_bundles_before, before_bundle)
+
+
+async def archive_receipts() -> int:
+    """
+    Packs receipts unused for RECEIPT_ARCHIVE_AFTER_DAYS into monthly bundles and removes their files,
+    then applies the retention policy. Returns the number of receipts archived.
+    Bytes are synced to the bundle before the index points at them, and files are removed only once
+    indexed: a crash in between leaves unreferenced bytes or a stray file behind, never a lost receipt.
+    """
+    before = datetime.now() - timedelta(days=config.RECEIPT_ARCHIVE_AFTER_DAYS)
+    archived = 0
+    while batch := await database.get_unarchived_receipts(before, config.RECEIPT_ARCHIVE_BATCH):
+        by_bundle: dict[str, list[str]] = {}
+        for sha256, first_used in batch:
+            by_bundle.setdefault(first_used[:7], []).append(sha256)
+        for bundle, sha256s in by_bundle.items():
+            entries = await asyncio.to_thread(_append_to_bundle, bundle, sha256s)
+            await database.add_archived_receipts(entries)
+            stored = [sha256 for sha256, entry_bundle, *_ in entries if entry_bundle is not None]
+            await asyncio.to_thread(_remove_files, [receipt_path(sha256) for sha256 in stored])
+            archived += len(stored)
+    dropped = await drop_expired_bundles()
+    logging.info(f"Archived {archived} receipts" + (f", dropped bundles {', '.join(dropped)}." if dropped else "."))
+    return archived
@@ -0,0 +1,69 @@
+# responses.py
+from aiogram.types import InlineKeyboardMarkup, Message, ReplyKeyboardMarkup, ReplyKeyboardRemove
+
+import keyboards
+
+MESSAGE_LIMIT = 4096 # Telegram's maximum text length per message
+
+
+class Reply:
+    """
+    Composes a handler's answer as one outgoing message: text parts are queued with add()
+    and joined, and the reply markup (usually the main menu) rides on the same message
+    instead of a separate one. Only text beyond Telegram's length limit is split, with the
+    markup on the last chunk.
+
+        await Reply(message).add(_("Language set.")).add(_("Welcome!")).with_menu().send()
+    """
+
+    def __init__(self, message: Message):
+        self.message = message
+        self.parts: list[str] = []
+        self.reply_markup: InlineKeyboardMarkup | ReplyKeyboardMarkup | ReplyKeyboardRemove | None = None
+
+    def add(self, text: str) -> "Reply":
+        self.parts.append(text)
+        return self
+
+    def with_markup(self, markup: InlineKeyboardMarkup | ReplyKeyboardMarkup | ReplyKeyboardRemove) -> "Reply":
+        self.reply_markup = markup
+        return self
+
+    def with_menu(self, locale: str | None = None) -> "Reply":
+        """Attaches the main menu keyboard (default: in the current update's locale)."""
+        return self.with_markup(keyboards.get_main_menu_keyboard(locale))
+
+    @staticmethod
+    def _split(text: str) -> list[str]:
+        """Cuts a text longer than one message at the last newline within the limit (hard cut if none)."""
+        pieces = []
+        while len(text) > MESSAGE_LIMIT:
+            cut = text.rfind("\n", 0, MESSAGE_LIMIT + 1)
+            if cut <= 0:
+                pieces.append(text[:MESSAGE_LIMIT])
+                text = text[MESSAGE_LIMIT:]
+            else:
+                pieces.append(text[:cut])
+                text = text[cut + 1:]
+        pieces.append(text)
+        return pieces
+
+    def _chunks(self) -> list[str]:
+        chunks: list[str] = []
+        for part in self.parts:
+            for piece in self._split(part):
+                if chunks and len(chunks[-1]) + 2 + len(piece) <= MESSAGE_LIMIT:
+                    chunks[-1] += "\n\n" + piece
+                else:
+                    chunks.append(piece)
+        return chunks
+
+    async def send(self, **kwargs) -> Message | None:
+        """Sends the composed reply; one API call unless the text exceeds one message."""
+        chunks = self._chunks()
+        sent = None
+        for i, chunk in enumerate(chunks):
+            markup = self.reply_markup if i == len(chunks) - 1 else None
+            sent = await self.message.answer(chunk, reply_markup=markup, **kwargs)
+        self.parts.clear()
+        return sent
@@ -1,140 +1,301 @@
 # scheduler.py
 import asyncio
+import heapq
 import logging
+from dataclasses import dataclass
 from datetime import datetime, timedelta, time
+from typing import Awaitable, Callable
 
 from aiogram import Bot
 
 import config
 import database
+import metrics
+import receipts
+import script
+from broadcast import broadcast
+from billing import billing_day_in
 from localization import _ # Import translation helper
 
-async def notify_users(bot: Bot):
-    """Sends debt reminders to users with outstanding debt."""
-    logging.info("Running daily notification check...")
-    users_to_notify = database.get_users_for_notification() # Use DB function
+async def notify_users(bot: Bot, family_id: int):
+    """Sends debt reminders to a family's users with outstanding debt."""
+    logging.info(f"Running notification check for family {family_id}...")
 
-    if not users_to_notify:
-        logging.info("No users found for notifications.")
-        return
+    async def reminders():
+        async for telegram_id, full_name, debt, language in database.iter_debtors(family_id):
+            # Get user-specific translation
+            text = _("Reminder: Your current debt is ${debt}. Please pay before the billing date.", locale=language).format(debt=f"{debt:.2f}")
+            yield telegram_id, text
 
-    for telegram_id, full_name, debt in users_to_notify:
-        try:
-            if debt > 0:
-                # Get user-specific translation
-                text = _("Reminder: Your current debt is ${debt}. Please pay before the billing date.", user_id=telegram_id).format(debt=f"{debt:.2f}")
-                await bot.send_message(telegram_id, text)
-            # else: # Avoid spamming users with 0 debt
-            #     pass
-        except Exception as e:
-            # Handle specific exceptions like BotBlocked, CantInitiateConversation etc. if needed
-            logging.warning(f"Failed to send notification to user {telegram_id} ({full_name}): {e}")
-        await asyncio.sleep(0.2) # Small delay between messages
-    logging.info("Finished notification check.")
-
-
-async def turn_off_explicit_songs_for_debtors():
-    """Checks for debtors and triggers the external script (if implemented)."""
-    logging.info("Running explicit content check...")
-    debtor_ids = database.get_debtor_ids() # Use DB function
-
-    if not debtor_ids:
-        logging.info("No debtors found with debt > 0.")
+    report = await broadcast(bot, reminders())
+    logging.info(f"Finished notification check for family {family_id}: {report}")
+
+
+async def sync_explicit_content(family_id: int, restore_only: bool = False):
+    """
+    Brings a family's Spotify members in line with their debt: explicit content off for debtors, back on
+    once they've paid. Only members whose state differs from the one last applied are touched, through
+    pending actions in the DB: a failed or interrupted run leaves them pending, and the next run retries
+    just those (the browser only flips toggles that aren't already right). Restore runs only re-enable
+    members who have paid since they were blocked, so they are cheap enough to run often.
+    """
+    if family_id != config.SPOTIFY_FAMILY_ID:
+        # The account's member positions mean nothing for other families; toggling them would fight its runs
+        logging.warning(f"Not enforcing family {family_id}: the Spotify account is family {config.SPOTIFY_FAMILY_ID}'s.")
+        return
+    await database.plan_enforcement(family_id, restore_only)
+    actions = await database.get_pending_enforcement_actions(family_id, restore_only)
+    if not actions:
+        logging.debug(f"Explicit content of family {family_id} is up to date.")
         return
 
-    logging.info(f"Debtors found (IDs): {debtor_ids}")
+    settings = {spotify_member: bool(allow_explicit) for _id, _user_id, spotify_member, allow_explicit in actions}
+    logging.info(f"Applying explicit content settings for family {family_id}: {settings}")
+    try:
+        # Selenium is blocking, so the shared browser session is driven from a worker thread
+        changed = await asyncio.to_thread(script.get_enforcer().set_explicit_content, settings)
+    except Exception as e:
+        await database.fail_enforcement_actions([action[0] for action in actions], str(e))
+        raise
+    await database.complete_enforcement_actions(actions)
+    logging.info(f"Explicit content enforcement for family {family_id} finished, toggles changed: {changed}")
+
+
+# --- Scheduling ---
+def next_billing_offset_run(after: datetime, days_from_billing: int, at: time, billing_day: int) -> datetime:
+    """First datetime strictly after `after` that is `days_from_billing` days from a billing day, at `at`."""
+    year, month = after.year, after.month - 1 # Start a month back: the offset can cross a month boundary
+    while True:
+        if month == 0:
+            year, month = year - 1, 12
+        elif month == 13:
+            year, month = year + 1, 1
+        candidate = datetime.combine(billing_day_in(year, month, billing_day) + timedelta(days=days_from_billing), at)
+        if candidate > after:
+            return candidate
+        month += 1
+
+
+def next_daily_run(after: datetime, at: time) -> datetime:
+    """First datetime strictly after `after` at the time of day `at`."""
+    candidate = datetime.combine(after.date(), at)
+    return candidate if candidate > after else candidate + timedelta(days=1)
+
+
+@dataclass
+class JobKind:
+    run: Callable[[Bot, int | None], Awaitable[None]] # Called with (bot, family_id); None for global jobs
+    next_run: Callable[[datetime, int | None], datetime] # (after, billing_day) -> next due time strictly after `after`
+    catch_up_window: timedelta # A missed run older than this is skipped rather than run late
+
+
+JOB_KINDS: dict[str, JobKind] = {
+    "monthly_charge": JobKind(
+        run=lambda bot, family_id: database.accrue_monthly_charges(family_id),
+        next_run=lambda after, billing_day: next_billing_offset_run(after, 0, config.ACCRUAL_TIME, billing_day),
+        catch_up_window=timedelta(days=27), # Charges are idempotent per cycle, so late is fine within the cycle
+    ),
+    "notify_debtors": JobKind(
+        run=notify_users,
+        next_run=lambda after, billing_day: next_billing_offset_run(after, -1, config.NOTIFICATION_TIME, billing_day),
+        catch_up_window=timedelta(days=1),
+    ),
+    "explicit_check": JobKind(
+        run=lambda bot, family_id: sync_explicit_content(family_id),
+        next_run=lambda after, billing_day: next_billing_offset_run(after, 3, config.EXPLICIT_CHECK_TIME, billing_day),
+        catch_up_window=timedelta(days=20),
+    ),
+    "explicit_restore": JobKind(
+        run=lambda bot, family_id: sync_explicit_content(family_id, restore_only=True),
+        next_run=lambda after, billing_day: after + timedelta(seconds=config.EXPLICIT_RESTORE_INTERVAL),
+        catch_up_window=timedelta(seconds=config.EXPLICIT_RESTORE_INTERVAL),
+    ),
+    "archive_receipts": JobKind(
+        run=lambda bot, family_id: receipts.archive_receipts(),
+        next_run=lambda after, billing_day: next_daily_run(after, config.RECEIPT_ARCHIVE_TIME),
+        catch_up_window=timedelta(days=1),
+    ),
+    "prune_profile_changes": JobKind(
+        run=lambda bot, family_id: database.prune_profile_changes(),
+        next_run=lambda after, billing_day: after + timedelta(hours=1),
+        catch_up_window=timedelta(hours=1),
+    ),
+}
+
+FAMILY_JOB_KINDS = ("monthly_charge", "notify_debtors") # Scheduled for every family
+ENFORCEMENT_JOB_KINDS = ("explicit_check", "explicit_restore") # Only for SPOTIFY_FAMILY_ID, which owns the account
+GLOBAL_JOB_KINDS = ("archive_receipts", "prune_profile_changes") # Scheduled once, named after their kind
+
+
+def family_job_kinds(family_id: int) -> tuple[str, ...]:
+    return FAMILY_JOB_KINDS + (ENFORCEMENT_JOB_KINDS if family_id == config.SPOTIFY_FAMILY_ID else ())
+
+
+@dataclass
+class ScheduledJob:
+    name: str
+    kind: str
+    family_id: int | None
+    billing_day: int | None
+    next_run_at: datetime
 
-    # --- IMPORTANT ---
-    # You need to implement the logic to map these telegram_ids to
-    # whatever identifier your `script.py` needs (e.g., Spotify usernames).
-    # This might involve adding a 'spotify_username' column to your 'users' table
-    # and fetching those usernames for the debtor_ids.
-    # --- Placeholder ---
-    spotify_usernames_to_block = [] # Populate this list based on debtor_ids and mapping logic
 
-    if spotify_usernames_to_block:
-        logging.info(f"Attempting to run explicit songs script for users: {', '.join(spotify_usernames_to_block)}")
+class JobScheduler:
+    """
+    Runs jobs persisted in the scheduled_jobs table. Due times live in a min-heap, so the
+    loop sleeps exactly until the earliest job regardless of how many jobs exist. Jobs whose
+    due time passed while the bot was down are run once on startup (within their kind's
+    catch-up window), and every run records its outcome and next due time in the DB.
+    """
+
+    MAX_SLEEP = 3600 # Re-check at least hourly in case the wall clock jumps (suspend, NTP)
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self._heap: list[tuple[datetime, str]] = []
+        self._jobs: dict[str, ScheduledJob] = {}
+        self._running: set[asyncio.Task] = set()
+        self._running_names: set[str] = set()
+        self._wakeup = asyncio.Event()
+
+    def _push(self, job: ScheduledJob):
+        self._jobs[job.name] = job
+        heapq.heappush(self._heap, (job.next_run_at, job.name))
+        self._wakeup.set()
+
+    async def add_job(self, name: str, kind: str, family_id: int | None, billing_day: int | None):
+        """Registers a job; an already-persisted job keeps its stored schedule."""
+        next_run_at = JOB_KINDS[kind].next_run(datetime.now(), billing_day)
+        if await database.add_scheduled_job(name, kind, family_id, next_run_at) and name not in self._jobs:
+            self._push(ScheduledJob(name, kind, family_id, billing_day, next_run_at))
+
+    async def add_family_jobs(self, family_id: int, billing_day: int):
+        for kind in family_job_kinds(family_id):
+            await self.add_job(f"{kind}:{family_id}", kind, family_id, billing_day)
+
+    async def _stored_jobs(self) -> list[ScheduledJob]:
+        jobs = []
+        for name, kind, family_id, billing_day, next_run_at, *_rest in await database.get_scheduled_jobs():
+            if kind not in JOB_KINDS:
+                logging.warning(f"Skipping scheduled job {name} of unknown kind {kind}.")
+                continue
+            if kind in ENFORCEMENT_JOB_KINDS and family_id != config.SPOTIFY_FAMILY_ID:
+                logging.warning(f"Removing job {name}: family {family_id} doesn't own the Spotify account.")
+                await database.delete_scheduled_job(name)
+                continue
+            jobs.append(ScheduledJob(name, kind, family_id, billing_day, datetime.fromisoformat(next_run_at)))
+        return jobs
+
+    async def load(self):
+        for job in await self._stored_jobs():
+            self._jobs[job.name] = job
+        self._heap = [(job.next_run_at, name) for name, job in self._jobs.items()]
+        heapq.heapify(self._heap)
+        logging.info(f"Scheduler loaded {len(self._heap)} jobs.")
+
+    async def refresh(self):
+        """Picks up jobs persisted by other processes, e.g. for a family added through a non-leader."""
+        for job in await self._stored_jobs():
+            if job.name not in self._jobs and job.name not in self._running_names:
+                logging.info(f"Scheduler picked up new job {job.name}.")
+                self._push(job)
+
+    async def _run_job(self, job: ScheduledJob):
         try:
-            # Example using subprocess (safer than os.system)
-            # Adjust path and arguments as needed for your script.py
-            # script_path = "/home/ilie/PycharmProjects/SpotifyFamily/script.py"
-            # command = [sys.executable, script_path] + spotify_usernames_to_block
-            # process = await asyncio.create_subprocess_exec(
-            #     *command,
-            #     stdout=asyncio.subprocess.PIPE,
-            #     stderr=asyncio.subprocess.PIPE
-            # )
-            # stdout, stderr = await process.communicate()
-            # if process.returncode == 0:
-            #      logging.info(f"Explicit songs script finished successfully. Output:\n{stdout.decode()}")
-            # else:
-            #      logging.error(f"Explicit songs script failed (Code: {process.returncode}). Error:\n{stderr.decode()}")
-            logging.warning("Actual call to script.py is commented out. Implement user mapping and uncomment/adapt the subprocess call.")
-        except FileNotFoundError:
-             logging.error("Error running script.py: Script not found at the specified path.")
-        except Exception as e:
-             logging.error(f"Error running explicit songs script: {e}", exc_info=True)
-    else:
-        logging.warning("Found debtors by ID, but could not map to Spotify usernames to run script (or mapping logic not implemented).")
-    logging.info("Finished explicit content check.")
+            await self._execute(job)
+        finally:
+            self._running_names.discard(job.name)
+
+    async def _execute(self, job: ScheduledJob):
+        job_kind = JOB_KINDS[job.kind]
+        due_at = job.next_run_at
+        started_at = datetime.now()
+        error = None
+        if started_at - due_at > job_kind.catch_up_window:
+            status = "skipped"
+            logging.warning(f"Job {job.name} was due at {due_at:%Y-%m-%d %H:%M} and is too old to catch up. Skipping.")
+        else:
+            if started_at - due_at > timedelta(minutes=1):
+                logging.info(f"Catching up job {job.name} missed at {due_at:%Y-%m-%d %H:%M}.")
+            try:
+                await job_kind.run(self.bot, job.family_id)
+                status = "ok"
+            except Exception as e:
+                status, error = "error", str(e)
+                logging.error(f"Scheduled job {job.name} failed: {e}", exc_info=True)
+        metrics.JOB_RUNS.inc(job.kind, status)
+        # Several missed occurrences collapse into this one run
+        job.next_run_at = job_kind.next_run(max(datetime.now(), due_at), job.billing_day)
+        await database.record_job_run(job.name, started_at, status, error, job.next_run_at)
+        self._push(job)
+
+    async def run_forever(self):
+        loop = asyncio.get_running_loop()
+        next_refresh = loop.time() + config.SCHEDULER_REFRESH_INTERVAL
+        while True:
+            self._wakeup.clear()
+            if loop.time() >= next_refresh:
+                await self.refresh()
+                next_refresh = loop.time() + config.SCHEDULER_REFRESH_INTERVAL
+            max_sleep = min(self.MAX_SLEEP, next_refresh - loop.time())
+            if not self._heap:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=max_sleep)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            due_at, name = self._heap[0]
+            job = self._jobs.get(name)
+            if job is None or job.next_run_at != due_at: # Superseded heap entry
+                heapq.heappop(self._heap)
+                continue
+            delay = (due_at - datetime.now()).total_seconds()
+            if delay > 0:
+                logging.debug(f"Scheduler sleeping for {delay:.0f} seconds (until {due_at:%Y-%m-%d %H:%M:%S}, job {name}).")
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=min(delay, max_sleep))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            del self._jobs[name] # Re-added with its next due time once the run finishes
+            self._running_names.add(name)
+            task = asyncio.create_task(self._run_job(job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def stop(self):
+        for task in self._running:
+            task.cancel()
+        await asyncio.gather(*self._running, return_exceptions=True)
+
+
+active_scheduler: JobScheduler | None = None # Set while scheduler_loop runs in this process
+
+
+async def schedule_family(family_id: int, billing_day: int):
+    """Creates a new family's jobs; picked up immediately if the scheduler runs in this process."""
+    if active_scheduler is not None:
+        await active_scheduler.add_family_jobs(family_id, billing_day)
+        return
+    for kind in family_job_kinds(family_id):
+        next_run_at = JOB_KINDS[kind].next_run(datetime.now(), billing_day)
+        await database.add_scheduled_job(f"{kind}:{family_id}", kind, family_id, next_run_at)
 
 
 async def scheduler_loop(bot: Bot):
-    """The main loop that runs scheduled tasks at appropriate times."""
+    """The main loop that runs scheduled tasks when they are due. Run it in one process only (see lease.py)."""
+    global active_scheduler
     logging.info("Scheduler started.")
-    while True:
-        now = datetime.now()
-        # --- Define Check Times ---
-        # Run notifications daily at a specific time (e.g., 10:00 AM)
-        notification_time = time(10, 0) # 10:00 AM
-        # Run explicit check daily at a specific time (e.g., 11:00 AM)
-        explicit_check_time = time(11, 0) # 11:00 AM
-
-        # --- Calculate Next Run Times ---
-        today_notification_dt = datetime.combine(now.date(), notification_time)
-        today_explicit_check_dt = datetime.combine(now.date(), explicit_check_time)
-
-        next_notification_dt = today_notification_dt
-        if now >= today_notification_dt: # If time has passed for today, schedule for tomorrow
-            next_notification_dt += timedelta(days=1)
-
-        next_explicit_check_dt = today_explicit_check_dt
-        if now >= today_explicit_check_dt: # If time has passed for today, schedule for tomorrow
-            next_explicit_check_dt += timedelta(days=1)
-
-        # --- Determine Sleep Duration ---
-        sleep_target = min(next_notification_dt, next_explicit_check_dt)
-        sleep_seconds = (sleep_target - now).total_seconds()
-        sleep_seconds = max(sleep_seconds, 1) # Sleep at least 1 second
-
-        logging.debug(f"Scheduler sleeping for {sleep_seconds:.0f} seconds (until {sleep_target.strftime('%Y-%m-%d %H:%M:%S')}).")
-        await asyncio.sleep(sleep_seconds)
-
-        # --- Run Tasks Due ---
-        # Re-check 'now' after waking up
-        now = datetime.now()
-
-        # Check notification condition: e.g., run daily regardless of billing date?
-        # Or only run near billing date? Modify condition as needed.
-        # Current implementation runs daily at notification_time.
-        if now >= today_notification_dt and now < today_notification_dt + timedelta(minutes=1): # Check within a minute window
-             # Check if it's the day before billing
-             is_day_before_billing = (now + timedelta(days=1)).day == config.BILLING_DATE.day
-             if is_day_before_billing:
-                 logging.info(f"It's the day before billing date ({config.BILLING_DATE.day}). Running notifications.")
-                 await notify_users(bot)
-             else:
-                 logging.info(f"Daily notification time reached, but not the day before billing. Skipping notifications.")
-
-
-        # Check explicit content condition: e.g., run daily regardless?
-        # Or only run after billing date? Modify condition as needed.
-        # Current implementation runs daily at explicit_check_time.
-        if now >= today_explicit_check_dt and now < today_explicit_check_dt + timedelta(minutes=1): # Check within a minute window
-            # Check if it's 3 days past the billing day
-            is_3_days_past_billing = (now - timedelta(days=3)).day == config.BILLING_DATE.day
-            if is_3_days_past_billing:
-                 logging.info(f"It's 3 days past billing date ({config.BILLING_DATE.day}). Running explicit content check.")
-                 await turn_off_explicit_songs_for_debtors()
-            else:
-                 logging.info(f"Daily explicit check time reached, but not 3 days past billing. Skipping check.")
\ No newline at end of file
+    scheduler = JobScheduler(bot)
+    await scheduler.load()
+    for family_id, name, billing_day, price, member_count in await database.get_families():
+        await scheduler.add_family_jobs(family_id, billing_day)
+    for kind in GLOBAL_JOB_KINDS:
+        await scheduler.add_job(kind, kind, None, None)
+    active_scheduler = scheduler
+    try:
+        await scheduler.run_forever()
+    finally:
+        active_scheduler = None
+        await scheduler.stop()
@@ -1,57 +1,200 @@
+# script.py
+import json
+import logging
 import os
-import time
+import sys
+import threading
+from typing import TYPE_CHECKING
+
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+import config
+
+if TYPE_CHECKING:
+    from selenium import webdriver
+
+# selenium.webdriver (and the browser with it) is imported on first use: it is by far the
+# heaviest import here, and most processes importing this module never drive a browser
+
+MENU_GROUP_BUTTON = "/html/body/div[1]/div[1]/div/div[2]/div/div[4]/div[3]/a[3]"
+FAMILY_FRAME_ID = "family-web-iframe"
+# Member list inside the family iframe; li[1] is the plan owner, members start at li[2]
+MEMBER_LINK_XPATH = '//*[@id="__next"]/main/div[2]/div/section/div[1]/ul/li[{item}]/a'
+EXPLICIT_TOGGLE_XPATH = '//*[@id="__next"]/main//input[@type="checkbox"]'
+# The toggle saves through a fetch/XHR. Resource timing entries only appear once a response has
+# arrived, so the first such entry after clearing the buffer is the finished save (0 if no status)
+SAVE_STATUS_JS = ("return performance.getEntriesByType('resource')"
+                  ".filter(e => e.initiatorType === 'fetch' || e.initiatorType === 'xmlhttprequest')"
+                  ".map(e => e.responseStatus || 200)[0];")
+MAX_MEMBERS = 5
+
+
+class SpotifyFamilyEnforcer:
+    """
+    Keeps one (headless) browser session logged into the Spotify account and applies
+    explicit-content settings for a batch of family members in a single pass.
+    The session is restored from saved cookies when possible, so a run normally
+    skips the login form entirely. Not thread-safe by itself; calls are serialised
+    with a lock because the scheduler runs them in a worker thread.
+    """
+
+    def __init__(self, email: str | None = config.SPOTIFY_EMAIL, password: str | None = config.SPOTIFY_PASSWORD,
+                 account_url: str = config.SPOTIFY_ACCOUNT_URL, cookies_file: str = config.SPOTIFY_COOKIES_FILE,
+                 headless: bool = config.SPOTIFY_HEADLESS, timeout: float = config.SPOTIFY_WAIT_TIMEOUT):
+        self.email = email
+        self.password = password
+        self.account_url = account_url
+        self.cookies_file = cookies_file
+        self.headless = headless
+        self.timeout = timeout
+        self.browser: "webdriver.Chrome | None" = None
+        self._lock = threading.Lock()
+
+    # --- Session ---
+    def _start_browser(self):
+        from selenium import webdriver
+        options = webdriver.ChromeOptions()
+        if self.headless:
+            options.add_argument("--headless=new")
+        options.add_argument("--disable-gpu")
+        options.add_argument("--no-sandbox")
+        self.browser = webdriver.Chrome(options=options)
+
+    def _wait(self, condition):
+        from selenium.webdriver.support.ui import WebDriverWait
+        return WebDriverWait(self.browser, self.timeout).until(condition)
+
+    def _restore_cookies(self):
+        if not self.cookies_file or not os.path.exists(self.cookies_file):
+            return
+        try:
+            with open(self.cookies_file) as f:
+                cookies = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not read saved Spotify cookies: {e}")
+            return
+        for cookie in cookies:
+            try:
+                self.browser.add_cookie(cookie)
+            except WebDriverException:
+                pass # Cookie for another domain (e.g. accounts.spotify.com)
+
+    def _save_cookies(self):
+        if not self.cookies_file:
+            return
+        try:
+            with open(self.cookies_file, "w") as f:
+                json.dump(self.browser.get_cookies(), f)
+        except OSError as e:
+            logging.warning(f"Could not save Spotify cookies: {e}")
+
+    def _login(self):
+        from selenium.webdriver.common.by import By
+        self.browser.find_element(By.ID, 'login-username').send_keys(self.email)
+        self.browser.find_element(By.ID, 'login-password').send_keys(self.password)
+        self.browser.find_element(By.ID, 'login-button').click()
+
+    def _open_family_page(self):
+        """Opens the account page (logging in only if the session is gone) and enters the family iframe."""
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions
+        if self.browser is None:
+            self._start_browser()
+            self.browser.get(self.account_url)
+            self._restore_cookies()
+        self.browser.switch_to.default_content()
+        self.browser.get(self.account_url)
+
+        menu_button = (By.XPATH, MENU_GROUP_BUTTON)
+        login_field = (By.ID, 'login-username')
+        self._wait(expected_conditions.any_of(
+            expected_conditions.element_to_be_clickable(menu_button),
+            expected_conditions.presence_of_element_located(login_field)))
+        if self.browser.find_elements(*login_field):
+            self._login()
+            self._wait(expected_conditions.element_to_be_clickable(menu_button))
+            self._save_cookies()
+
+        self.browser.find_element(*menu_button).click()
+        self._wait(expected_conditions.frame_to_be_available_and_switch_to_it((By.ID, FAMILY_FRAME_ID)))
+
+    def _set_member(self, position: int, allow_explicit: bool) -> bool:
+        """Opens one member's page, flips the toggle if needed, waits for it to be saved and returns to the member list."""
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions
+        member_link = (By.XPATH, MEMBER_LINK_XPATH.format(item=position + 1))
+        self._wait(expected_conditions.element_to_be_clickable(member_link)).click()
+
+        toggle = self._wait(expected_conditions.presence_of_element_located((By.XPATH, EXPLICIT_TOGGLE_XPATH)))
+        changed = toggle.is_selected() != allow_explicit
+        if changed:
+            self.browser.execute_script("performance.clearResourceTimings(); arguments[0].click();", toggle)
+            self._wait(lambda _: toggle.is_selected() == allow_explicit)
+            # Leaving the page before the save request has finished can cancel it
+            status = self._wait(lambda browser: browser.execute_script(SAVE_STATUS_JS))
+            if status >= 400:
+                raise WebDriverException(f"Saving member {position}'s explicit-content setting failed with HTTP {status}")
+
+        self.browser.back()
+        self._wait(expected_conditions.element_to_be_clickable(member_link))
+        return changed
+
+    def close(self):
+        if self.browser is not None:
+            try:
+                self.browser.quit()
+            except WebDriverException:
+                pass
+            self.browser = None
+
+    # --- Public API ---
+    def set_explicit_content(self, members: dict[int, bool]) -> dict[int, bool]:
+        """
+        Applies {member position (1-5): allow_explicit} in one pass over the family page.
+        Returns {position: True if the toggle was changed}. A stale session is restarted once.
+        """
+        members = {pos: allow for pos, allow in members.items() if 1 <= pos <= MAX_MEMBERS}
+        if not members:
+            return {}
+        with self._lock:
+            for attempt in (1, 2):
+                try:
+                    self._open_family_page()
+                    return {pos: self._set_member(pos, allow) for pos, allow in members.items()}
+                except (TimeoutException, WebDriverException) as e:
+                    logging.warning(f"Spotify enforcement attempt {attempt} failed: {e}")
+                    self.close()
+                    if attempt == 2:
+                        raise
+
+    def disable_explicit_content(self, positions: list[int]) -> dict[int, bool]:
+        return self.set_explicit_content({pos: False for pos in positions})
+
+
+_enforcer: SpotifyFamilyEnforcer | None = None
+
+
+def get_enforcer() -> SpotifyFamilyEnforcer:
+    """Returns the process-wide enforcer; the browser itself starts on first use."""
+    global _enforcer
+    if _enforcer is None:
+        _enforcer = SpotifyFamilyEnforcer()
+    return _enforcer
+
+
+def shutdown():
+    if _enforcer is not None:
+        _enforcer.close()
+
+
+def turn_off_explicit_songs(positions: list[int]) -> dict[int, bool]:
+    return get_enforcer().disable_explicit_content(positions)
 
-from dotenv import load_dotenv
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions
-
-browser = webdriver.Chrome()
-
-browser.get('https://www.spotify.com/account/overview/')
-
-load_dotenv()
-
-browser.find_element(By.ID, 'login-username').send_keys(os.getenv("EMAIL"))
-
-browser.find_element(By.ID, 'login-password').send_keys(os.getenv("PASSWORD"))
-
-browser.find_element(By.ID, 'login-button').click()
-
-menu_group_button =  "/html/body/div[1]/div[1]/div/div[2]/div/div[4]/div[3]/a[3]"
-
-WebDriverWait(browser, 5).until(expected_conditions.element_to_be_clickable((By.XPATH, menu_group_button))).click()
-
-frame = browser.find_element(By.ID, 'family-web-iframe')
-
-time.sleep(5)
-
-users = ["//*[@id=""__next""]/main/div[2]/div/section/div[1]/ul/li[2]/a",
-         "//*[@id=""__next""]/main/div[2]/div/section/div[1]/ul/li[3]/a",
-         "//*[@id=""__next""]/main/div[2]/div/section/div[1]/ul/li[4]/a",
-         "//*[@id=""__next""]/main/div[2]/div/section/div[1]/ul/li[5]/a",
-         "//*[@id=""__next""]/main/div[2]/div/section/div[1]/ul/li[6]/a"]
-
-def turn_off_explicit_songs(user_id):
-    user_buttons = {
-        1: "//*[@id=""__next""]/main/div[2]/div/section/div[1]/ul/li[2]/a",
-        2: "//*[@id=""__next""]/main/div[2]/div/section/div[1]/ul/li[3]/a",
-        3: "//*[@id=""__next""]/main/div[2]/div/section/div[1]/ul/li[4]/a",
-        4: "//*[@id=""__next""]/main/div[2]/div/section/div[1]/ul/li[5]/a",
-        5: "//*[@id=""__next""]/main/div[2]/div/section/div[1]/ul/li[6]/a"
-    }
-
-    button_xpath = user_buttons.get(user_id)
-    if button_xpath:
-        WebDriverWait(browser, 5).until(expected_conditions.element_to_be_clickable((By.XPATH, button_xpath))).click()
 
 if __name__ == "__main__":
-    conn = sqlite3.connect("/home/ilie/PycharmProjects/SpotifyFamily/spotify_family.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT telegram_id FROM users WHERE debt > 0")
-    users_with_debt = cursor.fetchall()
-    conn.close()
-
-    for user in users_with_debt:
-        turn_off_explicit_songs(user[0])
+    # Usage: python script.py <member position> [<member position> ...]
+    logging.basicConfig(level=logging.INFO)
+    try:
+        print(turn_off_explicit_songs([int(arg) for arg in sys.argv[1:]]))
+    finally:
+        shutdown()
@@ -0,0 +1,73 @@
+# user_cache.py
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+import config
+
+
+class UserProfile(NamedTuple):
+    telegram_id: int
+    full_name: str | None
+    language: str | None
+    debt: float | None
+    role: str | None
+    family_id: int | None
+
+
+class UserProfileCache:
+    """
+    Bounded LRU cache of user profiles keyed by telegram_id, with a TTL per entry.
+    Only touched from the event loop thread, so no locking is needed.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[int, tuple[float, UserProfile]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, telegram_id: int) -> UserProfile | None:
+        entry = self._entries.get(telegram_id)
+        if entry is not None:
+            expires_at, profile = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(telegram_id)
+                self.hits += 1
+                return profile
+            del self._entries[telegram_id]
+        self.misses += 1
+        return None
+
+    def put(self, profile: UserProfile):
+        self._entries[profile.telegram_id] = (time.monotonic() + self.ttl, profile)
+        self._entries.move_to_end(profile.telegram_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def update(self, telegram_id: int, **fields):
+        """Write-through: patches a cached profile in place (no-op if it isn't cached)."""
+        entry = self._entries.get(telegram_id)
+        if entry is not None:
+            expires_at, profile = entry
+            self._entries[telegram_id] = (expires_at, profile._replace(**fields))
+
+    def invalidate(self, telegram_id: int):
+        self._entries.pop(telegram_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+profile_cache = UserProfileCache(max_size=config.USER_CACHE_SIZE, ttl=config.USER_CACHE_TTL)